@@ -0,0 +1,139 @@
+import threading
+import time
+from retry_policy import ThrottledError
+
+# 接口在JSON中返回的风控错误码
+THROTTLE_CODES = {
+    -412: '请求被拦截',
+    -509: '请求过于频繁',
+    -799: '请求过于频繁，请稍后再试',
+}
+THROTTLE_STATUS = (412, 429)
+
+
+def parse_retry_after(headers):
+    """响应头中的Retry-After（秒），没有或不是秒数时返回None"""
+    value = (headers or {}).get('Retry-After')
+    if value and str(value).strip().isdigit():
+        return int(value)
+    return None
+
+
+def throttle_code(data):
+    """JSON响应中的风控错误码，不是限流时返回None"""
+    code = data.get('code') if isinstance(data, dict) else None
+    return code if code in THROTTLE_CODES else None
+
+
+def throttle_error(status, headers, data=None):
+    """响应是限流时返回ThrottledError（带Retry-After），否则返回None"""
+    if status in THROTTLE_STATUS:
+        return ThrottledError(status, THROTTLE_CODES.get(-status, '请求过于频繁'), parse_retry_after(headers))
+    code = throttle_code(data)
+    if code is not None:
+        return ThrottledError(code, data.get('message') or THROTTLE_CODES[code], parse_retry_after(headers))
+    return None
+
+
+class Slot:
+    """一个正在进行的接口请求，退出时把结果告诉限流器"""
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.started = time.monotonic()
+        self.throttled = False
+        self.retry_after = None
+
+    def throttle(self, retry_after=None):
+        """标记这个请求被限流"""
+        self.throttled = True
+        self.retry_after = retry_after
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # 超时等网络错误与接口的承受能力无关，不调整上限
+        self.limiter.release(self, success=exc_type is None and not self.throttled)
+
+
+class AdaptiveLimiter:
+    """接口请求的自适应并发上限（AIMD：加性增、乘性减）
+
+    每个成功的请求使上限增加1/limit（约每一轮请求加1）；被限流时上限乘以backoff，
+    并暂停所有新请求retry_after秒（没有Retry-After时为pause秒）。
+    同一轮中已经发出的请求一起被限流时只降低一次，避免上限一下子降到最低。
+    上限已经降到min_limit仍被限流时，改为拉长相邻两次请求的间隔（加倍），成功的请求逐步缩短间隔，
+    间隔缩短到0后才重新增加并发。
+    """
+    def __init__(self, initial=4, min_limit=1, max_limit=16, backoff=0.5, pause=1.0,
+                 min_interval=0.05, max_interval=5.0, interval_step=0.005):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.backoff = backoff
+        self.pause = pause
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval_step = interval_step
+        self.interval = 0.0  # 相邻两次请求开始的最小间隔
+        self.next_start = 0.0
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.throttled = 0
+        self.cond = threading.Condition()
+
+    def wait_time(self, now):
+        """还需要等待的秒数；0表示现在可以发出请求（调用时持有锁）"""
+        wait = max(self.paused_until, self.next_start) - now
+        if wait > 0:
+            return wait
+        if self.in_flight >= int(self.limit):
+            return None  # 等其他请求结束
+        return 0
+
+    def take(self, now):
+        self.in_flight += 1
+        self.next_start = now + self.interval
+        return Slot(self)
+
+    def slot(self):
+        """阻塞到可以发出请求，返回Slot上下文"""
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                wait = self.wait_time(now)
+                if wait == 0:
+                    return self.take(now)
+                self.cond.wait(wait)
+
+    def release(self, slot, success):
+        with self.cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if slot.throttled:
+                self.throttled += 1
+                if slot.started >= self.last_decrease:
+                    if self.limit > self.min_limit:
+                        self.limit = max(self.min_limit, self.limit * self.backoff)
+                    else:
+                        self.interval = min(self.max_interval, max(self.min_interval, self.interval * 2))
+                    self.last_decrease = now
+                pause = slot.retry_after if slot.retry_after is not None else self.pause
+                self.paused_until = max(self.paused_until, now + pause)
+            elif success:
+                if self.interval > 0:
+                    self.interval = max(0.0, self.interval - self.interval_step)
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            return {
+                'limit': round(self.limit, 2),
+                'interval': round(self.interval, 3),
+                'in_flight': self.in_flight,
+                'throttled': self.throttled,
+                'paused': max(0.0, round(self.paused_until - time.monotonic(), 2))
+            }
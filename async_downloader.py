@@ -0,0 +1,87 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from video_downloader import VideoDownloader
+from bandwidth import PRIORITY_NORMAL, PRIORITY_BACKGROUND
+
+
+class AsyncVideoDownloader:
+    """VideoDownloader的asyncio接口：方法同名，都是协程
+
+    下载由同一个VideoDownloader完成，缓存、预取、带宽调度、缓冲池、任务记录、画质策略、预检和合集解析都相同；
+    阻塞的调用在线程池中执行，不阻塞事件循环，最多concurrency个调用同时进行。
+    回调在事件循环的线程中调用。取消协程时取消对应的下载任务，传输在当前数据块读完后停止，进度保留在.part文件中。
+    """
+    def __init__(self, downloader=None, concurrency=64, **options):
+        self.downloader = downloader or VideoDownloader(**options)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='async-download')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        """等待线程池中的调用结束后关闭下载器"""
+        await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+        self.downloader.close()
+
+    async def run(self, func, *args, job_ids=(), **kwargs):
+        """在线程池中执行func；协程被取消时取消job_ids对应的下载任务，等它们停止后再抛出CancelledError"""
+        future = asyncio.get_running_loop().run_in_executor(self.executor, partial(func, *args, **kwargs))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if not job_ids:
+                raise
+            self.downloader.bandwidth.cancel(job_ids)
+            try:
+                await asyncio.wait([future])
+                if not future.cancelled():
+                    future.exception()  # 下载线程抛出的DownloadCancelled，已经由CancelledError代替
+            finally:
+                self.downloader.bandwidth.uncancel(job_ids)
+            raise
+
+    def on_loop(self, callback):
+        """把下载线程中的回调转到事件循环的线程中调用"""
+        if callback is None:
+            return None
+        loop = asyncio.get_running_loop()
+        return lambda *args: loop.call_soon_threadsafe(callback, *args)
+
+    def extract_video_id(self, url):
+        return self.downloader.extract_video_id(url)
+
+    async def get_video_info(self, bvid, use_cache=True):
+        return await self.run(self.downloader.get_video_info, bvid, use_cache)
+
+    async def get_video_streams(self, bvid, cid):
+        return await self.run(self.downloader.get_video_streams, bvid, cid)
+
+    async def get_video_url(self, bvid, cid):
+        return await self.run(self.downloader.get_video_url, bvid, cid)
+
+    async def get_collection_info(self, bvid, season=True):
+        return await self.run(self.downloader.get_collection_info, bvid, season)
+
+    async def find_downloaded(self, cid, folder):
+        """cid已下载完成且文件校验通过时返回文件路径，校验在线程池中读取文件"""
+        return await self.run(self.downloader.find_downloaded, cid, folder)
+
+    async def download_single_video(self, bvid, cid, title, save_path, callback=None, max_retries=None,
+                                    priority=PRIORITY_NORMAL):
+        return await self.run(
+            self.downloader.download_single_video, bvid, cid, title, save_path, self.on_loop(callback),
+            max_retries, priority=priority, job_ids=[f"{bvid}:{cid}"]
+        )
+
+    async def download_collection(self, video_id, collection_info, callback=None, priority=PRIORITY_BACKGROUND):
+        """下载整个合集，最多同时下载max_workers个分P，回调事件与VideoDownloader相同"""
+        job_ids = [f"{page.get('bvid', video_id)}:{page['cid']}" for page in collection_info['pages']]
+        return await self.run(
+            self.downloader.download_collection, video_id, collection_info, self.on_loop(callback), priority,
+            job_ids=job_ids
+        )
+
@@ -0,0 +1,230 @@
+import threading
+import time
+
+# 优先级，数字越小越优先：界面中单独下载的视频排在后台合集下载前面
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2
+
+BURST_SECONDS = 0.5  # 令牌桶最多积累的时间，空闲后的突发流量不超过0.5秒的配额
+MIN_CHUNK = 16 * 1024
+MAX_WAIT = 0.1  # 等待时最长隔多久重新检查一次（速率可能在运行中被修改）
+
+
+def parse_rate(value):
+    """'500K'、'2M'、'1.5G'或字节数 -> 每秒字节数，'0'表示不限速"""
+    value = value.strip().upper().rstrip('B')
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if value and value[-1] in units:
+        rate = float(value[:-1]) * units[value[-1]]
+    else:
+        rate = float(value)
+    return int(rate) or None
+
+
+def parse_window(value):
+    """'09:00-18:00=1M' -> ('09:00', '18:00', 1048576)"""
+    span, rate = value.split('=')
+    start, end = span.split('-')
+    parse_time(start), parse_time(end)  # 检查格式
+    return start, end, parse_rate(rate)
+
+
+def parse_time(value):
+    """'HH:MM' -> 一天中的分钟数"""
+    hour, minute = value.split(':')
+    return int(hour) * 60 + int(minute)
+
+
+def window_rate(windows, now=None):
+    """返回当前时间所在时间段的速率上限，不在任何时间段内时返回False
+
+    windows是[(开始'HH:MM', 结束'HH:MM', 速率), ...]，结束早于开始表示跨过午夜。
+    """
+    local = time.localtime(now)
+    minute = local.tm_hour * 60 + local.tm_min
+    for start, end, rate in windows:
+        start, end = parse_time(start), parse_time(end)
+        if start <= minute < end or (end < start and (minute >= start or minute < end)):
+            return rate
+    return False
+
+
+class TokenBucket:
+    """令牌桶：rate为每秒字节数，None表示不限速
+
+    允许令牌变成负数（先取后还），一次取1MB也不需要桶的容量有1MB，欠下的令牌用等待时间偿还。
+    """
+    def __init__(self, rate=None):
+        self.rate = None
+        self.burst = 0
+        self.tokens = 0
+        self.updated = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        self.refill(time.monotonic())
+        self.rate = rate or None
+        self.burst = max(self.rate * BURST_SECONDS, MIN_CHUNK) if self.rate else 0
+        self.tokens = min(self.tokens, self.burst) if self.rate else 0
+
+    def refill(self, now):
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """还清欠下的令牌需要等待的秒数"""
+        if not self.rate or self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+    def consume(self, size):
+        if self.rate:
+            self.tokens -= size
+
+
+class DownloadCancelled(Exception):
+    """下载任务被取消（BandwidthScheduler.cancel），已下载的部分保留在.part文件中"""
+    def __init__(self, job_id):
+        super().__init__(f"下载已取消: {job_id}")
+        self.job_id = job_id
+
+
+class BandwidthJob:
+    """一个下载任务，任务的所有连接共用一个令牌桶"""
+    def __init__(self, job_id, priority, rate, cancelled=False):
+        self.job_id = job_id
+        self.priority = priority
+        self.bucket = TokenBucket(rate)
+        self.cancelled = cancelled
+
+
+class BandwidthScheduler:
+    """同一个VideoDownloader的所有传输共用的带宽调度器
+
+    - rate: 全局速率上限（字节/秒），None表示不限
+    - job_rate: 每个任务默认的速率上限
+    - windows: [(开始'HH:MM', 结束'HH:MM', 速率), ...]，在这些时间段内使用对应的全局上限
+    全局带宽不够时，优先级高的任务先取得令牌。所有上限都可以在下载过程中修改，立即生效。
+    """
+    def __init__(self, rate=None, job_rate=None, windows=None):
+        self.cond = threading.Condition()
+        self.base_rate = rate
+        self.windows = list(windows or [])
+        self.job_rate = job_rate
+        self.job_rates = {}  # job_id -> 单独设置的上限
+        self.jobs = {}  # job_id -> BandwidthJob
+        self.waiting = {}  # 优先级 -> 正在等待全局令牌的传输数
+        self.cancelled = set()  # 被取消的job_id，包括还没开始的任务
+        self.global_bucket = TokenBucket(self.current_rate())
+
+    def current_rate(self):
+        """当前生效的全局上限"""
+        if self.windows:
+            rate = window_rate(self.windows)
+            if rate is not False:
+                return rate
+        return self.base_rate
+
+    def set_rate(self, rate):
+        """修改全局上限"""
+        with self.cond:
+            self.base_rate = rate
+            self.global_bucket.set_rate(self.current_rate())
+            self.cond.notify_all()
+
+    def set_windows(self, windows):
+        with self.cond:
+            self.windows = list(windows or [])
+            self.global_bucket.set_rate(self.current_rate())
+            self.cond.notify_all()
+
+    def set_job_rate(self, job_id, rate):
+        """修改某个任务的上限，任务还没开始时在开始后生效"""
+        with self.cond:
+            self.job_rates[job_id] = rate
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job.bucket.set_rate(rate)
+            self.cond.notify_all()
+
+    def job(self, job_id, priority=PRIORITY_NORMAL):
+        """登记一个下载任务，下载结束后调用finish"""
+        with self.cond:
+            job = BandwidthJob(job_id, priority, self.job_rates.get(job_id, self.job_rate), job_id in self.cancelled)
+            self.jobs[job_id] = job
+            return job
+
+    def cancel(self, job_ids):
+        """取消任务：正在进行的传输在读完当前数据块后停止，还没开始的任务开始时立即停止"""
+        with self.cond:
+            for job_id in job_ids:
+                self.cancelled.add(job_id)
+                job = self.jobs.get(job_id)
+                if job is not None:
+                    job.cancelled = True
+            self.cond.notify_all()
+
+    def uncancel(self, job_ids):
+        """取消结束后清除记录，同一个任务之后可以重新下载"""
+        with self.cond:
+            self.cancelled.difference_update(job_ids)
+
+    def check(self, job):
+        """任务已被取消时抛出DownloadCancelled"""
+        if job is not None and job.cancelled:
+            raise DownloadCancelled(job.job_id)
+
+    def finish(self, job):
+        with self.cond:
+            if self.jobs.get(job.job_id) is job:
+                del self.jobs[job.job_id]
+
+    def limited(self, job):
+        return bool(self.global_bucket.rate or self.windows or (job is not None and job.bucket.rate))
+
+    def chunk_size(self, job, size):
+        """限速时每次读取的字节数：约为0.1秒的配额，让限速更平滑"""
+        rates = [rate for rate in (self.global_bucket.rate, job.bucket.rate if job else None) if rate]
+        if not rates:
+            return size
+        return max(MIN_CHUNK, min(size, int(min(rates) * MAX_WAIT)))
+
+    def acquire(self, job, size):
+        """为刚读取的size字节取得令牌，超过上限时阻塞到配额允许为止"""
+        if not self.limited(job):
+            return
+        with self.cond:
+            priority = job.priority if job else PRIORITY_NORMAL
+            registered = False
+            try:
+                while True:
+                    self.check(job)
+                    now = time.monotonic()
+                    rate = self.current_rate()
+                    if rate != self.global_bucket.rate:
+                        self.global_bucket.set_rate(rate)  # 进入或离开了限速时间段
+                    wait = 0
+                    if job is not None:
+                        job.bucket.refill(now)
+                        wait = job.bucket.wait_time()
+                    if wait <= 0:
+                        if not registered:
+                            self.waiting[priority] = self.waiting.get(priority, 0) + 1
+                            registered = True
+                        self.global_bucket.refill(now)
+                        if any(count for p, count in self.waiting.items() if p < priority):
+                            wait = MAX_WAIT  # 有更高优先级的传输在等待全局令牌
+                        else:
+                            wait = self.global_bucket.wait_time()
+                        if wait <= 0:
+                            if job is not None:
+                                job.bucket.consume(size)
+                            self.global_bucket.consume(size)
+                            return
+                    self.cond.wait(min(wait, MAX_WAIT))
+            finally:
+                if registered:
+                    self.waiting[priority] -= 1
+                    self.cond.notify_all()
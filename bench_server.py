@@ -0,0 +1,303 @@
+import collections
+import hashlib
+import json
+import random
+import re
+import socket
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+from listings import mixin_key, wbi_key
+
+WBI_IMG_URL = 'https://i0.hdslb.com/bfs/wbi/7cd084941338484aae1ad9425b84077c.png'
+WBI_SUB_URL = 'https://i0.hdslb.com/bfs/wbi/4932caff0ff746eab6f01bf08b70ac45.png'
+
+# 视频内容由固定的伪随机块循环组成，任意偏移的字节都可以直接计算，不需要占用内存
+PATTERN = bytes(random.Random(0).getrandbits(8) for _ in range(64 * 1024))
+
+
+def content_bytes(start, length):
+    """返回模拟视频文件中[start, start + length)的内容"""
+    offset = start % len(PATTERN)
+    data = PATTERN[offset:] + PATTERN * (length // len(PATTERN) + 1)
+    return data[:length]
+
+
+class MockConfig:
+    """模拟服务器的配置"""
+    def __init__(self, file_size=16 * 1024 * 1024, pages=1, durl_segments=1,
+                 bandwidth=None, latency=0.0, accept_ranges=True, backup_urls=0,
+                 reset_rate=0.0, short_rate=0.0, error_rate=0.0, api_rate=None, api_retry_after=None,
+                 qualities=None, duration=60, page_scales=None, season=0, listing=0, seed=0):
+        self.file_size = file_size  # 每个durl分段的字节数
+        self.pages = pages  # 每个视频的分P数
+        self.durl_segments = durl_segments  # 每个分P的durl分段数
+        self.bandwidth = bandwidth  # 每个连接的带宽上限，字节/秒，None表示不限
+        self.latency = latency  # 每个请求返回首字节前的延迟，秒
+        self.accept_ranges = accept_ranges  # CDN是否支持Range请求
+        self.backup_urls = backup_urls  # 每个分段返回的备用镜像数量
+        self.reset_rate = reset_rate  # 传输中途断开连接的概率
+        self.short_rate = short_rate  # 返回的内容比Content-Length短的概率
+        self.error_rate = error_rate  # 返回503的概率
+        self.api_rate = api_rate  # 接口每秒最多响应的请求数，超过时返回风控错误码-799，None表示不限
+        self.api_retry_after = api_retry_after  # 限流响应中的Retry-After秒数
+        self.api_requests = collections.deque()  # 最近一秒内接口请求的时间
+        self.qualities = qualities or {80: 1.0}  # 画质(qn) -> 文件大小相对file_size的比例
+        self.duration = duration  # 每个分P的时长（秒）
+        self.page_scales = page_scales or [1.0]  # 第n个分P的文件大小比例为page_scales[(n - 1) % 长度]
+        self.season = season  # 大于0时每个视频都属于一个有这么多集的合集（ugc_season），各集的BV号为BV1S00000001…
+        self.listing = listing  # UP主空间投稿列表的视频数，BV号为BV1L00000001…
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def roll(self, rate):
+        with self.lock:
+            return rate > 0 and self.random.random() < rate
+
+    def api_allowed(self):
+        """接口请求是否在速率限制内（最近一秒的请求数）"""
+        if not self.api_rate:
+            return True
+        with self.lock:
+            now = time.time()
+            while self.api_requests and self.api_requests[0] <= now - 1:
+                self.api_requests.popleft()
+            if len(self.api_requests) >= self.api_rate:
+                return False
+            self.api_requests.append(now)
+            return True
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """模拟 /x/web-interface/view、/x/player/playurl、合集和UP主投稿列表接口以及CDN"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def do_GET(self):
+        self.server.count('requests')
+        if self.config.latency:
+            time.sleep(self.config.latency)
+        parsed = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        if parsed.path.startswith('/x/') and not self.config.api_allowed():
+            self.server.count('throttled')
+            headers = {'Retry-After': str(self.config.api_retry_after)} if self.config.api_retry_after else {}
+            self.send_json({'code': -799, 'message': '请求过于频繁，请稍后再试', 'ttl': 1}, headers)
+        elif parsed.path == '/x/web-interface/view':
+            self.send_json(self.view(query['bvid']))
+        elif parsed.path == '/x/player/playurl':
+            self.send_json(self.playurl(query['bvid'], int(query['cid']), int(query.get('qn') or 0)))
+        elif parsed.path == '/x/web-interface/nav':
+            # 未登录：返回-101，但带有WBI签名密钥
+            self.send_json({'code': -101, 'message': '账号未登录', 'data': {
+                'isLogin': False, 'wbi_img': {'img_url': WBI_IMG_URL, 'sub_url': WBI_SUB_URL}
+            }})
+        elif parsed.path == '/x/polymer/web-space/seasons_archives_list':
+            self.send_json(self.season_archives(int(query['page_num']), int(query['page_size'])))
+        elif parsed.path == '/x/space/wbi/arc/search':
+            self.send_json(self.space_search(query))
+        elif parsed.path.startswith('/cdn/'):
+            self.send_media()
+        else:
+            self.send_error(404)
+
+    def view(self, bvid):
+        episode = self.episode_number(bvid)
+        if episode:
+            # 合集中的一集：一个分P，cid在各集之间不重复
+            pages = [{'cid': 1000 + episode, 'page': 1, 'part': f"合集第{episode}集", 'duration': self.config.duration}]
+        else:
+            # 投稿列表中的视频放在同一个目录，cid也不能重复
+            match = re.fullmatch(r'BV1L(\d{8})', bvid)
+            base = 100 * int(match.group(1)) if match else 0
+            pages = [{'cid': base + index, 'page': index, 'part': f"第{index}集", 'duration': self.config.duration}
+                     for index in range(1, self.config.pages + 1)]
+        data = {
+            'bvid': bvid, 'title': f"基准测试-{bvid}", 'videos': len(pages),
+            'cid': pages[0]['cid'], 'pages': pages
+        }
+        if self.config.season:
+            data['ugc_season'] = {'id': 1, 'title': '基准测试合集', 'sections': [
+                {'id': 1, 'title': '正片', 'episodes': self.episodes(1, self.config.season)}
+            ]}
+        return {'code': 0, 'message': '0', 'data': data}
+
+    def episode_number(self, bvid):
+        match = re.fullmatch(r'BV1S(\d{8})', bvid)
+        return int(match.group(1)) if match and self.config.season else 0
+
+    def episodes(self, first, last):
+        return [{
+            'bvid': f"BV1S{n:08d}", 'cid': 1000 + n, 'title': f"合集第{n}集",
+            'page': {'cid': 1000 + n, 'page': 1, 'part': f"合集第{n}集", 'duration': self.config.duration}
+        } for n in range(first, last + 1)]
+
+    def season_archives(self, page_num, page_size):
+        first = (page_num - 1) * page_size + 1
+        archives = [{'bvid': episode['bvid'], 'title': episode['title']}
+                    for episode in self.episodes(first, min(first + page_size - 1, self.config.season))]
+        return {'code': 0, 'message': '0', 'data': {
+            'archives': archives,
+            'meta': {'name': '基准测试合集', 'total': self.config.season},
+            'page': {'page_num': page_num, 'page_size': page_size, 'total': self.config.season}
+        }}
+
+    def space_search(self, query):
+        """投稿列表，要求WBI签名正确"""
+        signed = {name: value for name, value in query.items() if name != 'w_rid'}
+        key = mixin_key(wbi_key(WBI_IMG_URL), wbi_key(WBI_SUB_URL))
+        w_rid = hashlib.md5((urlencode(sorted(signed.items())) + key).encode('utf-8')).hexdigest()
+        if 'wts' not in query or query.get('w_rid') != w_rid:
+            return {'code': -403, 'message': '访问权限不足'}
+        pn, ps = int(query['pn']), int(query['ps'])
+        first = (pn - 1) * ps + 1
+        vlist = [{'bvid': f"BV1L{n:08d}", 'title': f"投稿{n}", 'author': '基准测试UP主'}
+                 for n in range(first, min(first + ps - 1, self.config.listing) + 1)]
+        return {'code': 0, 'message': '0', 'data': {
+            'list': {'vlist': vlist},
+            'page': {'pn': pn, 'ps': ps, 'count': self.config.listing}
+        }}
+
+    def playurl(self, bvid, cid, qn=0):
+        host = f"http://127.0.0.1:{self.server.server_address[1]}"
+        deadline = int(time.time()) + 3600
+        # 返回不超过qn的最高画质，qn为0或低于所有画质时返回最低画质
+        accept = sorted(self.config.qualities, reverse=True)
+        quality = next((q for q in accept if q <= qn), accept[-1]) if qn else accept[0]
+        durl = []
+        for order in range(1, self.config.durl_segments + 1):
+            path = f"/cdn/{bvid}-{cid}-{order}-q{quality}.flv?deadline={deadline}"
+            durl.append({
+                'order': order,
+                'size': self.media_size(quality, cid),
+                'url': f"{host}{path}",
+                'backup_url': [f"{host}{path}&mirror={i}" for i in range(1, self.config.backup_urls + 1)]
+            })
+        return {'code': 0, 'message': '0', 'data': {
+            'quality': quality,
+            'accept_quality': accept,
+            'support_formats': [{'quality': q, 'new_description': f"{q}"} for q in accept],
+            'timelength': self.config.duration * 1000,
+            'durl': durl
+        }}
+
+    def media_size(self, quality, cid=1):
+        scale = self.config.page_scales[(cid - 1) % len(self.config.page_scales)]
+        return int(self.config.file_size * self.config.qualities.get(quality, 1.0) * scale)
+
+    def send_json(self, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_media(self):
+        config = self.config
+        if config.roll(config.error_rate):
+            self.server.count('errors')
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        
+        match = re.search(r'-(\d+)-\d+-q(\d+)\.flv', self.path)
+        size = self.media_size(int(match.group(2)), int(match.group(1))) if match else config.file_size
+        start, end = 0, size - 1
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match and config.accept_ranges:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        if config.accept_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        
+        # 注入的故障：中途断开或提前结束，都只发送一半内容
+        length = end - start + 1
+        cut = None
+        if length > 1 and config.roll(config.reset_rate):
+            cut, fault = length // 2, 'resets'
+        elif length > 1 and config.roll(config.short_rate):
+            cut, fault = length // 2, 'short_bodies'
+        self.send_body(start, cut if cut is not None else length)
+        if cut is not None:
+            self.server.count(fault)
+            self.close_connection = True
+            if fault == 'resets':
+                # SO_LINGER为0时close会发送RST
+                self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+
+    def send_body(self, start, length):
+        """按带宽上限分块发送内容"""
+        chunk_size = 64 * 1024
+        bandwidth = self.config.bandwidth
+        begin = time.time()
+        sent = 0
+        while sent < length:
+            data = content_bytes(start + sent, min(chunk_size, length - sent))
+            self.wfile.write(data)
+            sent += len(data)
+            self.server.count('bytes_sent', len(data))
+            if bandwidth:
+                delay = sent / bandwidth - (time.time() - begin)
+                if delay > 0:
+                    time.sleep(delay)
+
+
+class MockServer(ThreadingHTTPServer):
+    """本地模拟的B站接口和CDN服务器"""
+    daemon_threads = True
+
+    def __init__(self, config=None, port=0):
+        super().__init__(('127.0.0.1', port), MockHandler)
+        self.config = config or MockConfig()
+        self.counters = {}
+        self.counter_lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, name, value=1):
+        with self.counter_lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def handle_error(self, request, client_address):
+        """客户端主动断开（例如分段下载被取消）是正常情况，不打印堆栈"""
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def start(self):
+        """在后台线程中运行服务器"""
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    server = MockServer(port=8765)
+    print(f"模拟服务器已启动: {server.base_url}")
+    server.serve_forever()
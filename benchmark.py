@@ -0,0 +1,222 @@
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from bench_server import MockConfig, MockServer
+
+try:
+    import resource
+except ImportError:  # Windows没有resource模块，不统计内存峰值
+    resource = None
+
+MB = 1024 * 1024
+
+# 每个场景：模拟服务器配置、下载器参数、下载方式（single单个视频 / collection整个合集）
+SCENARIOS = {
+    'single-1conn': {
+        'server': {'file_size': 64 * MB, 'bandwidth': 20 * MB},
+        'downloader': {'segments': 1},
+        'mode': 'single'
+    },
+    'single-4conn': {
+        'server': {'file_size': 64 * MB, 'bandwidth': 20 * MB},
+        'downloader': {'segments': 4, 'min_segment_size': 4 * MB},
+        'mode': 'single'
+    },
+    'single-latency': {
+        'server': {'file_size': 32 * MB, 'bandwidth': 20 * MB, 'latency': 0.2},
+        'downloader': {'segments': 4, 'min_segment_size': 4 * MB},
+        'mode': 'single'
+    },
+    'single-faults': {
+        'server': {'file_size': 32 * MB, 'bandwidth': 40 * MB,
+                   'reset_rate': 0.1, 'short_rate': 0.1, 'error_rate': 0.1, 'seed': 7},
+        'downloader': {'segments': 4, 'min_segment_size': 4 * MB},
+        'mode': 'single'
+    },
+    'collection-serial': {
+        'server': {'file_size': 8 * MB, 'pages': 12, 'bandwidth': 20 * MB, 'latency': 0.05},
+        'downloader': {'segments': 1, 'max_workers': 1},
+        'mode': 'collection'
+    },
+    'collection-parallel': {
+        'server': {'file_size': 8 * MB, 'pages': 12, 'bandwidth': 20 * MB, 'latency': 0.05},
+        'downloader': {'segments': 2, 'min_segment_size': 2 * MB, 'max_workers': 4},
+        'mode': 'collection'
+    },
+    'collection-throttled': {
+        'server': {'file_size': 1 * MB, 'pages': 48, 'latency': 0.05, 'api_rate': 10},
+        'downloader': {'segments': 1, 'max_workers': 8, 'prefetch_count': 8},
+        'mode': 'collection'
+    },
+    # 最后一个分P是其他分P的8倍大：按分P顺序时它最后才开始，先下大文件可以缩短总耗时
+    'collection-skewed': {
+        'server': {'file_size': 4 * MB, 'pages': 9, 'bandwidth': 8 * MB, 'page_scales': [1] * 8 + [8]},
+        'downloader': {'segments': 1, 'max_workers': 3},
+        'mode': 'collection'
+    },
+    'collection-skewed-largest': {
+        'server': {'file_size': 4 * MB, 'pages': 9, 'bandwidth': 8 * MB, 'page_scales': [1] * 8 + [8]},
+        'downloader': {'segments': 1, 'max_workers': 3, 'order': 'largest'},
+        'mode': 'collection'
+    },
+    # 全部1080P需要约12秒，要求8秒内完成时按实测吞吐量降低部分分P的画质
+    'collection-deadline': {
+        'server': {'file_size': 8 * MB, 'pages': 12, 'bandwidth': 4 * MB,
+                   'qualities': {80: 1.0, 64: 0.5, 32: 0.25, 16: 0.125}},
+        'downloader': {'segments': 1, 'max_workers': 2},
+        'quality': {'deadline': 8},
+        'mode': 'collection'
+    },
+}
+
+
+def peak_rss_mb():
+    """当前进程的内存峰值（MB）"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux单位为KB，macOS为字节
+    return round(peak / (MB if sys.platform == 'darwin' else 1024), 1)
+
+
+def git_version():
+    """当前代码的git版本，用于跨版本对比结果"""
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'],
+            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or 'unknown'
+    except OSError:
+        return 'unknown'
+
+
+def run_client(base_url, scenario, workdir, results):
+    """在子进程中用真实的VideoDownloader下载，内存峰值只包含下载器本身"""
+    from video_downloader import VideoDownloader
+    from quality import QualityPolicy
+    os.chdir(workdir)
+    options = dict(scenario['downloader'])
+    if 'quality' in scenario:
+        quality = dict(scenario['quality'])
+        if 'deadline' in quality:
+            quality['deadline'] += time.time()  # 场景中的截止时间是相对开始下载的秒数
+        options['quality_policy'] = QualityPolicy(**quality)
+    downloader = VideoDownloader(api_base=base_url, **options)
+    
+    # 记录每个CDN请求从发出到收到响应头的时间，作为首字节时间
+    ttfb = []
+    http_get = downloader.http.get
+    def timed_get(url, **kwargs):
+        start = time.perf_counter()
+        response = http_get(url, **kwargs)
+        if '/cdn/' in url:
+            ttfb.append(time.perf_counter() - start)
+        return response
+    downloader.http.get = timed_get
+    
+    bvid = 'BV1bench00001'
+    start = time.perf_counter()
+    failed = 0
+    if scenario['mode'] == 'collection':
+        info = downloader.get_collection_info(bvid)
+        failed = len(downloader.download_collection(bvid, info)['failed'])
+    else:
+        info = downloader.get_video_info(bvid)['data']
+        try:
+            downloader.download_single_video(bvid, info['cid'], 'single', 'downloads')
+        except Exception as e:
+            print(f"下载失败: {str(e)}")
+            failed = 1
+    makespan = time.perf_counter() - start
+    downloader.close()
+    
+    # 只统计下载完成的文件，不包括.part等中间文件
+    size = sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk('downloads') for name in names
+        if name.endswith('.mp4')
+    )
+    # 各阶段的累计耗时，便于看出时间花在了哪里
+    phases = {}
+    for timing in downloader.metrics.snapshot()['timings']:
+        phase = timing['labels'].get('phase')
+        if phase:
+            phases[phase] = round(phases.get(phase, 0) + timing['sum'], 3)
+    # 画质策略选择的各画质次数
+    qualities = {
+        counter['labels']['quality']: counter['value']
+        for counter in downloader.metrics.snapshot()['counters'] if counter['name'] == 'quality_selected_total'
+    }
+    results.put({
+        'makespan_s': round(makespan, 3),
+        'bytes': size,
+        'mb_per_s': round(size / MB / makespan, 2) if makespan else None,
+        'ttfb_ms': round(statistics.median(ttfb) * 1000, 1) if ttfb else None,
+        'requests': len(ttfb),
+        'failed': failed,
+        'peak_rss_mb': peak_rss_mb(),
+        'phases_s': phases,
+        **({'qualities': qualities} if qualities else {})
+    })
+
+
+def run_scenario(name, scenario):
+    """启动模拟服务器，在子进程中运行一个场景，返回结果"""
+    server = MockServer(MockConfig(**scenario['server'])).start()
+    results = multiprocessing.Queue()
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            process = multiprocessing.Process(
+                target=run_client, args=(server.base_url, scenario, workdir, results)
+            )
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                raise Exception(f"场景 {name} 运行失败，退出码: {process.exitcode}")
+            result = results.get()
+    finally:
+        server.stop()
+    result.update({
+        'scenario': name,
+        'version': git_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'server': {k: v for k, v in server.counters.items()}
+    })
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="下载吞吐量基准测试")
+    parser.add_argument('scenarios', nargs='*', help="要运行的场景，默认全部")
+    parser.add_argument('--list', action='store_true', help="列出所有场景")
+    parser.add_argument('--output', help="把结果追加到JSON行文件，便于跨版本对比")
+    args = parser.parse_args(argv)
+    
+    if args.list:
+        for name, scenario in SCENARIOS.items():
+            print(f"{name}: {json.dumps(scenario, ensure_ascii=False)}")
+        return 0
+    
+    names = args.scenarios or list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"未知的场景: {', '.join(unknown)}")
+    
+    for name in names:
+        result = run_scenario(name, SCENARIOS[name])
+        line = json.dumps(result, ensure_ascii=False)
+        print(line)
+        if args.output:
+            with open(args.output, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+import os
+import queue
+import threading
+import time
+
+
+def read_into(raw, buf, size):
+    """从响应中读取最多size字节到buf，尽量填满缓冲区，返回读取的字节数（0表示连接已读完）"""
+    view = memoryview(buf)
+    got = 0
+    while got < size:
+        n = raw.readinto(view[got:size])
+        if not n:
+            break
+        got += n
+    return got
+
+
+def pwrite_all(fd, view, offset):
+    """把view完整写入文件的offset位置"""
+    while view:
+        if hasattr(os, 'pwrite'):
+            n = os.pwrite(fd, view, offset)
+        else:  # Windows没有pwrite；所有写入都在同一个写线程中，seek+write不会互相干扰
+            os.lseek(fd, offset, os.SEEK_SET)
+            n = os.write(fd, view)
+        view = view[n:]
+        offset += n
+
+
+class BufferPool:
+    """固定数量、可重复使用的缓冲区，所有下载共用，内存占用不超过count * size"""
+    def __init__(self, count=16, size=1024 * 1024):
+        self.size = size
+        self.free = queue.LifoQueue()  # 后进先出，最近用过的缓冲区更可能还在CPU缓存中
+        for _ in range(max(1, count)):
+            self.free.put(bytearray(size))
+
+    def acquire(self):
+        """取出一个空闲缓冲区，全部在使用中时等待写线程归还"""
+        return self.free.get()
+
+    def release(self, buf):
+        self.free.put(buf)
+
+
+class FileWriter:
+    """一次传输的写入端：填满的缓冲区交给后台写线程按位置写入文件，写入完成后调用on_written"""
+    def __init__(self, behind, path, on_written=None, truncate=False):
+        flags = os.O_WRONLY | getattr(os, 'O_BINARY', 0)
+        if truncate:
+            flags |= os.O_CREAT | os.O_TRUNC
+        self.fd = os.open(path, flags)
+        self.behind = behind
+        self.on_written = on_written
+        self.pending = 0
+        self.error = None
+        self.disk_time = 0.0  # 写线程花在这个文件上的时间
+        self.cond = threading.Condition()
+
+    def write(self, offset, buf, length):
+        """提交一个缓冲区，缓冲区的所有权交给写线程，写完后归还缓冲池
+
+        之前的写入已经失败时直接归还缓冲区并抛出写入错误，调用方不需要再归还。
+        """
+        if self.error is not None:
+            self.behind.pool.release(buf)
+            raise self.error
+        with self.cond:
+            self.pending += 1
+        self.behind.submit(self, offset, buf, length)
+
+    def done(self, error=None, seconds=0.0):
+        with self.cond:
+            self.pending -= 1
+            self.disk_time += seconds
+            if error is not None and self.error is None:
+                self.error = error
+            self.cond.notify_all()
+
+    def check(self):
+        """之前的写入失败时抛出写入错误（例如磁盘已满）"""
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        """等待已提交的写入全部完成后关闭文件，不抛出写入错误"""
+        with self.cond:
+            while self.pending:
+                self.cond.wait()
+        os.close(self.fd)
+
+
+class WriteBehind:
+    """后台写线程：网络读取和磁盘写入互不阻塞
+
+    只用一个线程按提交顺序写入，同一区间的数据按顺序写入，CRC可以按顺序累加。
+    """
+    def __init__(self, pool):
+        self.pool = pool
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, writer, offset, buf, length):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        self.queue.put((writer, offset, buf, length))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            writer, offset, buf, length = item
+            view = memoryview(buf)[:length]
+            start = time.perf_counter()
+            try:
+                if writer.error is None:
+                    pwrite_all(writer.fd, view, offset)
+                    # 数据写入文件后才记录进度，状态记录不会超前于文件内容
+                    if writer.on_written:
+                        writer.on_written(view)
+            except Exception as e:
+                writer.done(e, time.perf_counter() - start)
+            else:
+                writer.done(seconds=time.perf_counter() - start)
+            finally:
+                view.release()
+                self.pool.release(buf)
+
+    def open(self, path, on_written=None, truncate=False):
+        return FileWriter(self, path, on_written, truncate)
+
+    def close(self):
+        with self.lock:
+            if self.thread is not None:
+                self.queue.put(None)
+                self.thread.join()
+                self.thread = None
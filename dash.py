@@ -0,0 +1,132 @@
+import os
+import shutil
+import subprocess
+
+# 视频编码的默认偏好顺序：兼容性最好的AVC优先
+DEFAULT_CODECS = ('avc1', 'hev1', 'av01')
+
+
+def dash_urls(item):
+    """DASH流的主地址和备用镜像"""
+    url = item.get('baseUrl') or item.get('base_url')
+    backups = item.get('backupUrl') or item.get('backup_url') or []
+    return [url] + list(backups)
+
+
+class DashPolicy:
+    """DASH视频/音频流的选择策略"""
+    def __init__(self, max_quality=None, codecs=DEFAULT_CODECS, audio='best'):
+        self.max_quality = max_quality  # 画质上限（qn，例如80为1080P），None表示不限
+        self.codecs = codecs  # 编码偏好顺序，按codecs字段的前缀匹配
+        self.audio = audio  # 'best'选码率最高的音频，'smallest'选码率最低的
+
+    def capped(self, quality):
+        """画质上限不超过quality的同一策略，quality为None时返回自身"""
+        if quality is None or (self.max_quality is not None and self.max_quality <= quality):
+            return self
+        return DashPolicy(quality, self.codecs, self.audio)
+
+    def select_video(self, videos):
+        """在不超过画质上限的流中选画质最高的，同画质按编码偏好选择"""
+        if not videos:
+            raise Exception("DASH中没有视频流")
+        candidates = [v for v in videos if self.max_quality is None or v['id'] <= self.max_quality]
+        if not candidates:
+            # 所有流都超过上限时退而选择画质最低的
+            lowest = min(v['id'] for v in videos)
+            candidates = [v for v in videos if v['id'] == lowest]
+        quality = max(v['id'] for v in candidates)
+        candidates = [v for v in candidates if v['id'] == quality]
+        
+        def codec_rank(video):
+            codecs = video.get('codecs', '')
+            for rank, prefix in enumerate(self.codecs):
+                if codecs.startswith(prefix):
+                    return rank
+            return len(self.codecs)
+        return min(candidates, key=lambda v: (codec_rank(v), -v.get('bandwidth', 0)))
+
+    def select_audio(self, audios):
+        """按策略选择音频流，没有音频时返回None"""
+        if not audios:
+            return None
+        if self.audio == 'smallest':
+            return min(audios, key=lambda a: a.get('bandwidth', 0))
+        return max(audios, key=lambda a: a.get('bandwidth', 0))
+
+
+def parse_dash(data, policy):
+    """按策略从DASH数据中选出视频流和音频流，返回与parse_playurl相同格式的分段列表"""
+    dash = data['dash']
+    video = policy.select_video(dash.get('video') or [])
+    streams = [{
+        'order': 1,
+        'kind': 'video',
+        'size': 0,
+        'quality': video['id'],
+        'codecs': video.get('codecs', ''),
+        'urls': dash_urls(video)
+    }]
+    audio = policy.select_audio(dash.get('audio') or [])
+    if audio is not None:
+        streams.append({
+            'order': 2,
+            'kind': 'audio',
+            'size': 0,
+            'codecs': audio.get('codecs', ''),
+            'urls': dash_urls(audio)
+        })
+    return streams
+
+
+def find_muxer():
+    """查找本地的ffmpeg，没有时返回None"""
+    return shutil.which('ffmpeg')
+
+
+def mux_tracks(video_path, audio_path, file_path, ffmpeg=None):
+    """用ffmpeg直接复制音视频流（不重新编码）合并为mp4，成功后删除单独的音视频文件"""
+    ffmpeg = ffmpeg or find_muxer()
+    if not ffmpeg:
+        return False
+    part_path = file_path + '.part'
+    result = subprocess.run(
+        [ffmpeg, '-y', '-loglevel', 'error',
+         '-i', video_path, '-i', audio_path,
+         '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy', '-f', 'mp4', part_path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE
+    )
+    if result.returncode != 0:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise Exception(f"合并音视频失败: {result.stderr.decode('utf-8', 'replace').strip()}")
+    os.replace(part_path, file_path)
+    os.remove(video_path)
+    os.remove(audio_path)
+    return True
+
+
+def track_paths(file_path):
+    """DASH视频流和音频流下载时的临时文件路径"""
+    base_path = os.path.splitext(file_path)[0]
+    return {'video': f"{base_path}.video.m4s", 'audio': f"{base_path}.audio.m4s"}
+
+
+def finish_tracks(paths, file_path, has_audio=True):
+    """音视频都下载完成后合并为最终文件，返回最终文件路径
+
+    本地没有ffmpeg时保留单独的视频文件(.video.mp4)和音频文件(.audio.m4a)，返回视频文件路径。
+    """
+    if not has_audio:
+        os.replace(paths['video'], file_path)
+        return file_path
+    if mux_tracks(paths['video'], paths['audio'], file_path):
+        return file_path
+    
+    base_path = os.path.splitext(file_path)[0]
+    video_path, audio_path = f"{base_path}.video.mp4", f"{base_path}.audio.m4a"
+    os.replace(paths['video'], video_path)
+    os.replace(paths['audio'], audio_path)
+    print(f"未找到ffmpeg，视频和音频分别保存为: {video_path}, {audio_path}")
+    return video_path
@@ -0,0 +1,39 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HttpClient:
+    """共享连接池的HTTP会话，元数据请求和视频下载复用同一批长连接"""
+    def __init__(self, headers=None, pool_size=10, pool_connections=10,
+                 connect_timeout=10, read_timeout=30):
+        self.session = requests.Session()
+        if headers:
+            self.session.headers.update(headers)
+        # 每个请求的默认超时：(连接超时, 读取超时)，单位秒
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_connections = pool_connections
+        self.pool_size = 0
+        self.lock = threading.Lock()
+        self.resize(pool_size)
+
+    def resize(self, pool_size):
+        """调整每个主机的连接池大小，使其与下载并发数匹配"""
+        pool_size = max(1, pool_size)
+        with self.lock:
+            if pool_size == self.pool_size:
+                return
+            # pool_connections: 缓存多少个主机的连接池；pool_maxsize: 每个主机保持的长连接数
+            adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=pool_size)
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
+            self.pool_size = pool_size
+
+    def get(self, url, **kwargs):
+        """发送GET请求，未指定timeout时使用默认超时"""
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def close(self):
+        """关闭会话并释放所有连接"""
+        self.session.close()
@@ -0,0 +1,161 @@
+import os
+import sqlite3
+import threading
+import time
+
+# 任务状态
+QUEUED = 'queued'
+DOWNLOADING = 'downloading'
+COMPLETED = 'completed'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+UNFINISHED = (QUEUED, DOWNLOADING)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,        -- "bvid:cid"，合集为"bvid:collection"
+    kind TEXT NOT NULL,             -- video / collection
+    parent TEXT,                    -- 分P所属合集的job_id
+    bvid TEXT NOT NULL,
+    cid INTEGER,
+    title TEXT,
+    path TEXT,                      -- 视频文件路径，合集为目录
+    status TEXT NOT NULL,
+    downloaded INTEGER DEFAULT 0,   -- 已下载字节数
+    total INTEGER DEFAULT 0,        -- 总字节数
+    retries INTEGER DEFAULT 0,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created);
+"""
+
+MB = 1024 * 1024
+
+
+class JobStore:
+    """保存在SQLite中的下载任务记录：每个视频、合集和分P的状态、已下载字节数和错误
+
+    程序崩溃、断电或自动关机后，未完成的任务可以从这里恢复；界面的下载列表也从这里分页读取。
+    多个下载线程共用一个连接，写入由锁串行化。
+    进度回调很频繁，每个任务最多每progress_interval秒或每下载progress_bytes字节写入一次，
+    其间的进度在任务结束时与结束状态一起写入。
+    """
+    def __init__(self, path=os.path.join('downloads', 'jobs.db'), progress_interval=1.0, progress_bytes=16 * MB):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.progress_interval = progress_interval
+        self.progress_bytes = progress_bytes
+        self.written = {}  # job_id -> (上次写入进度的时间, 上次写入的已下载字节数, 尚未写入的进度字段)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')  # 读取历史记录时不阻塞下载线程的写入
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def add(self, job_id, bvid, cid=None, title=None, path=None, kind='video', parent=None, status=QUEUED):
+        """登记一个任务；已存在的任务保留原有记录，只更新标题、路径和状态"""
+        now = time.time()
+        with self.lock, self.conn:
+            self.written.pop(job_id, None)
+            self.conn.execute(
+                """INSERT INTO jobs (job_id, kind, parent, bvid, cid, title, path, status, created, updated)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(job_id) DO UPDATE SET
+                       title = COALESCE(excluded.title, title),
+                       path = COALESCE(excluded.path, path),
+                       parent = COALESCE(excluded.parent, parent),
+                       status = excluded.status,
+                       error = NULL,
+                       updated = excluded.updated""",
+                (job_id, kind, parent, bvid, cid, title, path, status, now, now)
+            )
+
+    def update(self, job_id, **fields):
+        """更新任务的若干字段"""
+        fields['updated'] = time.time()
+        columns = ', '.join(f"{name} = ?" for name in fields)
+        with self.lock, self.conn:
+            self.conn.execute(f"UPDATE jobs SET {columns} WHERE job_id = ?", (*fields.values(), job_id))
+
+    def progress(self, job_id, data):
+        """记录一次进度回调：已下载字节数，以及重试次数和错误
+
+        第一次回调（状态变为下载中）和出错的回调立即写入，其余的按间隔和字节数节流。
+        """
+        fields = {
+            'downloaded': int(data.get('downloaded_size', 0) * MB),
+            'total': int(data.get('total_size', 0) * MB)
+        }
+        if 'error' in data:
+            fields['retries'] = data.get('retry_count', 0)
+            fields['error'] = data['error']
+        else:
+            fields['status'] = DOWNLOADING
+        now = time.time()
+        with self.lock:
+            last = self.written.get(job_id)
+            if (last is not None and 'error' not in fields and now - last[0] < self.progress_interval
+                    and fields['downloaded'] - last[1] < self.progress_bytes):
+                self.written[job_id] = (last[0], last[1], fields)
+                return
+            self.written[job_id] = (now, fields['downloaded'], None)
+        self.update(job_id, **fields)
+
+    def finish(self, job_id, status, error=None, path=None, size=None):
+        """任务结束：完成、跳过或失败；size为完成后的文件大小，失败时一并写入节流中尚未写入的进度"""
+        with self.lock:
+            last = self.written.pop(job_id, None)
+        fields = dict(last[2]) if last and last[2] else {}
+        fields.update({'status': status, 'error': error})
+        if path is not None:
+            fields['path'] = path
+        if size is not None:
+            fields['downloaded'] = fields['total'] = size
+        self.update(job_id, **fields)
+
+    def get(self, job_id):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def recover(self):
+        """程序启动时调用：把上次运行中断的任务改回等待状态，返回所有未完成的顶层任务
+
+        顶层任务是单独下载的视频和合集；合集中未完成的分P随合集一起恢复。
+        """
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, updated = ? WHERE status = ?",
+                (QUEUED, time.time(), DOWNLOADING)
+            )
+            rows = self.conn.execute(
+                """SELECT * FROM jobs WHERE parent IS NULL AND (status = ? OR job_id IN (
+                       SELECT parent FROM jobs WHERE parent IS NOT NULL AND status = ?))
+                   ORDER BY created""",
+                (QUEUED, QUEUED)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def history(self, offset=0, limit=50):
+        """按创建顺序分页读取任务记录，供下载列表按需加载"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM jobs ORDER BY created, rowid LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
@@ -0,0 +1,198 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlencode
+from naming import collection_folder
+
+SPACE_PATTERN = re.compile(r'space\.bilibili\.com/(\d+)')
+# 合集列表页：旧版 /channel/collectiondetail?sid=…，新版 /lists/…?type=season
+SEASON_PATTERN = re.compile(r'space\.bilibili\.com/(\d+)/(?:channel/collectiondetail\?sid=|lists/)(\d+)')
+
+PAGE_SIZE = 30  # 列表接口每页的条数
+WBI_KEY_TTL = 3600  # WBI签名密钥每天更换，缓存一小时
+
+# WBI签名：把img_key和sub_key拼接后按此表重排，取前32个字符作为混合密钥
+MIXIN_KEY_ENC_TAB = [
+    46, 47, 18, 2, 53, 8, 23, 32, 15, 50, 10, 31, 58, 3, 45, 35, 27, 43, 5, 49,
+    33, 9, 42, 19, 29, 28, 14, 39, 12, 38, 41, 13, 37, 48, 7, 16, 24, 55, 40,
+    61, 26, 17, 0, 1, 60, 51, 30, 4, 22, 25, 54, 21, 56, 59, 6, 63, 57, 62, 11,
+    36, 20, 34, 44, 52
+]
+
+
+def mixin_key(img_key, sub_key):
+    keys = img_key + sub_key
+    return ''.join(keys[i] for i in MIXIN_KEY_ENC_TAB if i < len(keys))[:32]
+
+
+def wbi_key(url):
+    """nav接口返回的图片地址中的文件名就是密钥"""
+    return os.path.splitext(url.rsplit('/', 1)[-1])[0]
+
+
+def wbi_sign(params, key, now=None):
+    """给查询参数加上wts（时间戳）和w_rid（签名），返回新的参数字典"""
+    params = dict(params, wts=int(time.time() if now is None else now))
+    # 参数按名称排序，值中去掉 !'()* 这几个字符后再计算签名
+    params = {
+        name: ''.join(ch for ch in str(value) if ch not in "!'()*")
+        for name, value in sorted(params.items())
+    }
+    query = urlencode(params)
+    params['w_rid'] = hashlib.md5((query + key).encode('utf-8')).hexdigest()
+    return params
+
+
+def season_pages(season):
+    """视频信息中的ugc_season（合集）-> 按分节顺序排列的分P列表，每一项带有自己的bvid
+
+    每一集只取它的第一个分P；多个分节时在标题前加上分节名。
+    """
+    sections = season.get('sections') or []
+    pages = []
+    for section in sections:
+        for episode in section.get('episodes') or []:
+            page = episode.get('page') or {}
+            part = episode.get('title') or page.get('part') or episode['bvid']
+            if len(sections) > 1 and section.get('title'):
+                part = f"{section['title']}-{part}"
+            pages.append({
+                'bvid': episode['bvid'],
+                'cid': episode.get('cid') or page['cid'],
+                'part': part,
+                'page': len(pages) + 1,
+                'duration': page.get('duration') or (episode.get('arc') or {}).get('duration')
+            })
+    return pages
+
+
+class RateBudget:
+    """请求速率预算：多个线程共用，相邻两次请求开始的间隔不小于1/rate秒，rate为None表示不限"""
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def fetch_paginated(fetch_page, workers=4, budget=None):
+    """分页获取列表，逐条返回
+
+    fetch_page(页码)返回(本页的条目, 总页数)。先获取第一页得到总页数，其余各页最多workers个同时获取，
+    每一页返回后立即交出它的条目，不等整个列表获取完。获取失败的页在其他页都返回后统一报错。
+    """
+    budget = budget or RateBudget()
+    budget.acquire()
+    items, pages = fetch_page(1)
+    yield from items
+    if pages <= 1:
+        return
+
+    def fetch(number):
+        budget.acquire()
+        return fetch_page(number)[0]
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=min(workers, pages - 1)) as executor:
+        futures = {executor.submit(fetch, number): number for number in range(2, pages + 1)}
+        for future in as_completed(futures):
+            try:
+                yield from future.result()
+            except Exception as e:
+                failed.append((futures[future], e))
+    if failed:
+        numbers = '、'.join(str(number) for number, _ in sorted(failed, key=lambda item: item[0]))
+        raise Exception(f"列表的第{numbers}页获取失败: {failed[0][1]}")
+
+
+class ListingResolver:
+    """UP主的投稿列表和合集（ugc_season）列表
+
+    接口请求通过下载器的api_get发出，共用重试策略和自适应限流；另外每个列表受rate（每秒请求数）限制。
+    entries()边获取边返回{'bvid', 'title', 'folder'}，folder是列表对应的下载目录。
+    """
+    def __init__(self, downloader, workers=4, rate=5.0, page_size=PAGE_SIZE, root='downloads'):
+        self.downloader = downloader
+        self.workers = max(1, workers)
+        self.rate = rate
+        self.page_size = page_size
+        self.root = root
+        self.wbi = None  # (获取时间, 混合密钥)
+        self.wbi_lock = threading.Lock()
+
+    def match(self, url):
+        """是否是UP主空间或合集列表的地址"""
+        return bool(SPACE_PATTERN.search(url))
+
+    def entries(self, url):
+        match = SEASON_PATTERN.search(url)
+        if match:
+            return self.season_entries(int(match.group(1)), int(match.group(2)))
+        match = SPACE_PATTERN.search(url)
+        if match:
+            return self.space_entries(int(match.group(1)))
+        raise ValueError(f"不是UP主空间或合集列表的地址: {url}")
+
+    def api(self, path, params, phase='listing'):
+        data = self.downloader.api_get(f"{self.downloader.api_base}{path}?{urlencode(params)}", phase)
+        if data.get('code') != 0:
+            raise Exception(f"获取列表失败: {data.get('message')}")
+        return data['data']
+
+    def page_count(self, total):
+        return max(1, -(-total // self.page_size))
+
+    def season_entries(self, mid, season_id):
+        """合集中的所有视频"""
+        folder = []
+
+        def fetch_page(number):
+            data = self.api('/x/polymer/web-space/seasons_archives_list', {
+                'mid': mid, 'season_id': season_id, 'page_num': number, 'page_size': self.page_size
+            })
+            if not folder:
+                folder.append(collection_folder((data.get('meta') or {}).get('name') or f"合集{season_id}", self.root))
+            entries = [
+                {'bvid': archive['bvid'], 'title': archive.get('title', ''), 'folder': folder[0]}
+                for archive in data.get('archives') or []
+            ]
+            return entries, self.page_count(data['page']['total'])
+
+        return fetch_paginated(fetch_page, self.workers, RateBudget(self.rate))
+
+    def space_entries(self, mid):
+        """UP主的所有投稿，按UP主名称放在一个目录中"""
+        folder = []
+
+        def fetch_page(number):
+            params = wbi_sign({'mid': mid, 'pn': number, 'ps': self.page_size, 'order': 'pubdate'}, self.wbi_key())
+            data = self.api('/x/space/wbi/arc/search', params)
+            videos = (data.get('list') or {}).get('vlist') or []
+            if not folder:
+                author = videos[0].get('author') if videos else None
+                folder.append(collection_folder(author or f"UP主{mid}", self.root))
+            entries = [{'bvid': video['bvid'], 'title': video.get('title', ''), 'folder': folder[0]} for video in videos]
+            return entries, self.page_count(data['page']['count'])
+
+        return fetch_paginated(fetch_page, self.workers, RateBudget(self.rate))
+
+    def wbi_key(self):
+        """WBI签名的混合密钥，从nav接口获取（未登录时接口返回-101，但仍然带有密钥）"""
+        with self.wbi_lock:
+            if self.wbi is None or time.time() - self.wbi[0] > WBI_KEY_TTL:
+                data = self.downloader.api_get(f"{self.downloader.api_base}/x/web-interface/nav", 'listing')
+                images = (data.get('data') or {}).get('wbi_img')
+                if not images:
+                    raise Exception(f"获取签名密钥失败: {data.get('message')}")
+                self.wbi = (time.time(), mixin_key(wbi_key(images['img_url']), wbi_key(images['sub_url'])))
+            return self.wbi[1]
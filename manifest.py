@@ -0,0 +1,146 @@
+import contextlib
+import json
+import os
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+MANIFEST_NAME = '.manifest.json'
+BLOCK_SIZE = 1024 * 1024
+
+
+def file_crc(path, start=0, length=None, crc=0):
+    """计算文件中一段字节的CRC32，length为None时读到文件末尾"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length is None or length > 0:
+            data = f.read(BLOCK_SIZE if length is None else min(BLOCK_SIZE, length))
+            if not data:
+                break
+            crc = zlib.crc32(data, crc)
+            if length is not None:
+                length -= len(data)
+    return crc
+
+
+def file_checksum(path):
+    """读取整个文件计算校验记录（只用于ffmpeg合并等无法在写入时计算的文件）"""
+    size = os.path.getsize(path)
+    return {'size': size, 'crc32': [[0, size - 1, file_crc(path)]]}
+
+
+def verify_checksum(path, checksum):
+    """按校验记录检查文件：大小一致且每个区间的CRC32都匹配"""
+    try:
+        if os.path.getsize(path) != checksum['size']:
+            return False
+        return all(
+            file_crc(path, start, end - start + 1) == crc
+            for start, end, crc in checksum['crc32']
+        )
+    except OSError:
+        return False
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """进程间的文件锁：多个工作进程写同一个目录的清单时串行化"""
+    with open(path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class Manifest:
+    """目录下已完成文件的清单：cid -> {'path', 'size', 'crc32'}
+
+    crc32是[[start, end, crc], ...]，与下载时的字节区间一致，在写入数据时逐块计算，不需要再读一遍文件。
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, MANIFEST_NAME)
+        self.lock = threading.Lock()
+        self.entries = self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, cid):
+        with self.lock:
+            return self.entries.get(str(cid))
+
+    def names(self):
+        """cid -> 文件名，用于重新运行时保持原来的文件名"""
+        with self.lock:
+            return {cid: entry['path'] for cid, entry in self.entries.items()}
+
+    def put(self, cid, file_path, checksum):
+        """记录一个下载完成的文件"""
+        entry = {
+            'path': os.path.relpath(file_path, self.folder),
+            'size': checksum['size'],
+            'crc32': checksum['crc32']
+        }
+        self._update(lambda entries: entries.__setitem__(str(cid), entry))
+
+    def remove(self, cid):
+        self._update(lambda entries: entries.pop(str(cid), None))
+
+    def _update(self, change):
+        """在文件锁内重新读取清单、修改并保存，不会覆盖其他进程同时写入的记录"""
+        with self.lock:
+            os.makedirs(self.folder, exist_ok=True)
+            with file_lock(self.path + '.lock'):
+                self.entries = self.load()
+                change(self.entries)
+                self._save()
+
+    def _save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def present(self, cid):
+        """已完成且文件大小与记录一致时返回文件路径，不读取文件内容（增量同步时快速比较）"""
+        entry = self.get(cid)
+        if entry is None:
+            return None
+        file_path = os.path.join(self.folder, entry['path'])
+        try:
+            return file_path if os.path.getsize(file_path) == entry['size'] else None
+        except OSError:
+            return None
+
+    def verify(self, cid):
+        """已完成且校验通过时返回文件路径；文件缺失或损坏时删除记录并返回None"""
+        entry = self.get(cid)
+        if entry is None:
+            return None
+        file_path = os.path.join(self.folder, entry['path'])
+        if verify_checksum(file_path, entry):
+            return file_path
+        if os.path.exists(file_path):
+            print(f"文件校验失败，将重新下载: {file_path}")
+        self.remove(cid)
+        return None
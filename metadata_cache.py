@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class MetadataCache:
+    """带过期时间的LRU缓存，可选持久化到磁盘，同一个key的并发加载只发一次请求"""
+    def __init__(self, max_size=256, ttl=600, cache_dir=None):
+        self.max_size = max(1, max_size)
+        self.ttl = ttl  # 秒
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()  # key -> (过期时间, 值)
+        self.loading = {}  # key -> Loading，正在加载中的key
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self.coalesced = 0  # 等待其他线程加载而没有重复请求的次数
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key):
+        """读取未过期的缓存，不存在时返回None"""
+        with self.lock:
+            value = self._get_memory(key)
+            if value is not None:
+                self.hits += 1
+                return value
+        value = self._get_disk(key)
+        with self.lock:
+            if value is not None:
+                self.disk_hits += 1
+                self._put_memory(key, value[0], value[1])
+                return value[1]
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        """写入缓存，配置了cache_dir时同时写入磁盘"""
+        expires = time.time() + self.ttl
+        with self.lock:
+            self._put_memory(key, expires, value)
+        self._put_disk(key, expires, value)
+
+    def get_or_load(self, key, loader, cacheable=None):
+        """读取缓存，未命中时调用loader()加载；同一个key同时只有一个线程在加载
+
+        等待的线程直接使用加载线程的结果或异常，不再自己调用loader()。
+        cacheable(value)为False的结果（如接口的错误响应）只返回给这一批调用者，不写入缓存。
+        """
+        while True:
+            value = self.get(key)
+            if value is not None:
+                return value
+            with self.lock:
+                loading = self.loading.get(key)
+                if loading is None:
+                    loading = self.loading[key] = Loading()
+                    break
+                self.coalesced += 1
+            # 其他线程正在加载同一个key，等它完成后使用它的结果
+            loading.event.wait()
+            if loading.error is not None:
+                raise loading.error
+            return loading.value
+        
+        try:
+            value = loader()
+            if value is not None and (cacheable is None or cacheable(value)):
+                self.put(key, value)
+            loading.value = value
+            return value
+        except Exception as e:
+            loading.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.loading[key]
+            loading.event.set()
+
+    def invalidate(self, key):
+        """删除某个key的缓存"""
+        with self.lock:
+            self.entries.pop(key, None)
+        path = self._disk_path(key)
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """命中统计，用于调整缓存大小"""
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'coalesced': self.coalesced,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0
+            }
+
+    def _get_memory(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def _put_memory(self, key, expires, value):
+        self.entries[key] = (expires, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def _disk_path(self, key):
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _get_disk(self, key):
+        path = self._disk_path(key)
+        if not path:
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('expires', 0) <= time.time():
+            return None
+        return data['expires'], data['value']
+
+    def _put_disk(self, key, expires, value):
+        path = self._disk_path(key)
+        if not path:
+            return
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'expires': expires, 'value': value}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"写入元数据缓存失败: {key} - {str(e)}")
+
+
+class Loading:
+    """正在加载中的key：加载完成后event被设置，value或error是加载线程的结果"""
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
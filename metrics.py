@@ -0,0 +1,163 @@
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# 耗时直方图的分桶上限（秒）
+BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, float('inf'))
+
+
+def host_of(url):
+    return urlparse(url).netloc
+
+
+class Histogram:
+    """耗时分布：次数、总和、最大值和分桶计数"""
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+
+
+class MetricsRegistry:
+    """进程内的指标注册表：计数器和各阶段耗时，耗时记录会同时发送给所有sink"""
+    def __init__(self, sinks=None):
+        self.counters = {}  # (名称, 标签) -> 值
+        self.histograms = {}  # (名称, 标签) -> Histogram
+        self.sinks = list(sinks or [])
+        self.lock = threading.Lock()
+
+    def add_sink(self, sink):
+        """添加输出目标，sink需要实现emit(record)"""
+        self.sinks.append(sink)
+
+    def inc(self, name, value=1, **labels):
+        """计数器加value"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """记录一次耗时"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+        self.emit({'type': 'timing', 'name': name, 'seconds': round(seconds, 6), 'labels': labels})
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """计时上下文，退出时记录耗时（出错时也记录，并带上error标签）"""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(name, time.perf_counter() - start, error='1', **labels)
+            raise
+        self.observe(name, time.perf_counter() - start, **labels)
+
+    def emit(self, record):
+        record = dict(record, time=round(time.time(), 3))
+        for sink in self.sinks:
+            try:
+                sink.emit(record)
+            except Exception as e:
+                print(f"输出指标失败: {str(e)}")
+
+    def snapshot(self):
+        """当前所有指标的快照"""
+        with self.lock:
+            return {
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in self.counters.items()
+                ],
+                'timings': [
+                    {'name': name, 'labels': dict(labels), 'count': h.count,
+                     'sum': round(h.sum, 6), 'max': round(h.max, 6)}
+                    for (name, labels), h in self.histograms.items()
+                ]
+            }
+
+    def flush(self):
+        """把快照发送给所有sink"""
+        self.emit(dict(self.snapshot(), type='snapshot'))
+
+    def prometheus_text(self, prefix='bilibili_downloader'):
+        """Prometheus文本格式"""
+        def format_labels(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ''
+            return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+        
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        for name in sorted({name for (name, _), _ in counters}):
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            for (counter_name, labels), value in counters:
+                if counter_name == name:
+                    lines.append(f"{prefix}_{name}{format_labels(labels)} {value}")
+        for name in sorted({name for (name, _), _ in histograms}):
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            for (histogram_name, labels), h in histograms:
+                if histogram_name != name:
+                    continue
+                for bound, count in zip(BUCKETS, h.buckets):
+                    le = '+Inf' if bound == float('inf') else str(bound)
+                    lines.append(f"{prefix}_{name}_bucket{format_labels(labels, [('le', le)])} {count}")
+                lines.append(f"{prefix}_{name}_sum{format_labels(labels)} {h.sum}")
+                lines.append(f"{prefix}_{name}_count{format_labels(labels)} {h.count}")
+        return '\n'.join(lines) + '\n'
+
+
+class JsonLinesSink:
+    """把指标记录逐行写为JSON"""
+    def __init__(self, path=None, stream=None):
+        self.stream = stream or (open(path, 'a', encoding='utf-8') if path else sys.stderr)
+        self.lock = threading.Lock()
+
+    def emit(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self.lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+
+def start_prometheus_server(registry, port=9105, host='127.0.0.1'):
+    """在后台线程中提供 /metrics 接口，返回服务器对象"""
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+    
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,53 @@
+import threading
+from urllib.parse import urlparse
+
+
+class MirrorSet:
+    """同一个文件的主地址和备用镜像，按实测吞吐量选择最快的主机"""
+    def __init__(self, urls, max_errors=3):
+        self.urls = list(dict.fromkeys(urls))  # 去重并保持顺序，主地址在最前
+        self.max_errors = max_errors
+        self.speeds = {}  # url -> 吞吐量的指数滑动平均，字节/秒
+        self.errors = {url: 0 for url in self.urls}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.urls)
+
+    def healthy(self):
+        """错误次数未达到上限的地址，全部失效时返回所有地址"""
+        with self.lock:
+            urls = [url for url in self.urls if self.errors[url] < self.max_errors]
+        return urls or list(self.urls)
+
+    def pick(self, index=None):
+        """选择下载地址
+
+        index不为None时把各个分段轮流分配给还没有测速的镜像，让它们互相竞速；
+        否则返回错误最少、实测最快的地址。
+        """
+        urls = self.healthy()
+        with self.lock:
+            untested = [url for url in urls if url not in self.speeds]
+            if index is not None and untested:
+                return untested[index % len(untested)]
+            return min(urls, key=lambda url: (self.errors[url], -self.speeds.get(url, 0)))
+
+    def record(self, url, size, seconds):
+        """记录一次传输的吞吐量"""
+        if seconds <= 0:
+            return
+        speed = size / seconds
+        with self.lock:
+            old = self.speeds.get(url)
+            self.speeds[url] = speed if old is None else old * 0.7 + speed * 0.3
+
+    def fail(self, url):
+        """记录一次失败，失败过多的地址不再被选中"""
+        with self.lock:
+            self.errors[url] = self.errors.get(url, 0) + 1
+            # 失败的地址排到已测速地址的最后
+            self.speeds[url] = 0
+
+    def host(self, url):
+        return urlparse(url).netloc
@@ -0,0 +1,130 @@
+import os
+import re
+import threading
+
+# 文件名中需要替换的字符：Windows的非法字符、控制字符和常见的全角标点
+REPLACEMENTS = {
+    '\\': '-', '/': '-', ':': '-', '*': '-',
+    '?': '-', '"': '-', '<': '-', '>': '-',
+    '|': '-', '\n': ' ', '\r': ' ', '\t': ' ',
+    '《': '(', '》': ')', '【': '[', '】': ']',
+    '（': '(', '）': ')', '、': '-', '，': ',',
+    '。': '.', '！': '!', '？': '?', '：': '-',
+    '；': ';', '“': "'", '”': "'", '‘': "'",
+    '’': "'", '「': '[', '」': ']', '『': '[',
+    '』': ']', '〈': '(', '〉': ')', '…': '-',
+    '—': '-', '～': '~', '·': '-', '￥': '$',
+    '％': '%', '＃': '#', '＆': '&', '＊': '-',
+    '＋': '+', '－': '-', '／': '-', '＝': '=',
+    '＠': '@', '＼': '-', '＾': '^', '｜': '-',
+}
+REPLACEMENTS.update({chr(code): ' ' for code in range(32) if chr(code) not in REPLACEMENTS})
+TRANSLATE = str.maketrans(REPLACEMENTS)
+COLLAPSE = re.compile(r'([ -])\1+')  # 连续的空格或连字符只保留一个
+
+# Windows保留的设备名，不能作为文件名（不论扩展名）
+RESERVED = {'CON', 'PRN', 'AUX', 'NUL', *(f"COM{i}" for i in range(1, 10)), *(f"LPT{i}" for i in range(1, 10))}
+
+MAX_NAME_BYTES = 200  # 大多数文件系统限制文件名255字节，留出" (2)"和".part.json"等后缀
+MAX_PATH = 255  # Windows的MAX_PATH限制
+
+PAGE_TEMPLATE = '{index}-{part}'
+VIDEO_TEMPLATE = '{title}'
+
+
+def clean_name(name, default=''):
+    """清理文件名：一次translate替换所有非法字符，合并连续的空格和连字符，去掉首尾的空格、点和连字符"""
+    name = COLLAPSE.sub(r'\1', (name or '').translate(TRANSLATE)).strip(' .-')
+    if name.split('.')[0].upper() in RESERVED:
+        name = f"_{name}"
+    return name or default
+
+
+def truncate_bytes(name, limit=MAX_NAME_BYTES):
+    """按UTF-8编码后的字节数截断，中文标题每个字占3字节，不会切断一个字符"""
+    data = name.encode('utf-8')
+    if len(data) <= limit:
+        return name
+    return data[:limit].decode('utf-8', 'ignore').rstrip(' .-')
+
+
+def index_width(total):
+    """序号的位数：至少两位，超过99个分P时自动加宽，文件按名称排序时顺序不乱"""
+    return max(2, len(str(total)))
+
+
+def render(template, **fields):
+    """按模板生成文件名（不含扩展名），字符串字段先清理，结果按字节截断
+
+    模板字段：index（补零后的序号）、part（分P标题）、title（视频或合集标题）、bvid、cid
+    """
+    values = {key: clean_name(value) if isinstance(value, str) else value for key, value in fields.items()}
+    return truncate_bytes(clean_name(template.format(**values)))
+
+
+def collection_folder(title, root='downloads'):
+    """合集的下载目录"""
+    return os.path.join(root, truncate_bytes(clean_name(title, '未命名合集')))
+
+
+class NameIndex:
+    """一个目录中已分配的文件名，重名时依次追加" (2)"、" (3)"…，每个文件O(1)
+
+    同一个key（cid）总是得到同一个文件名，重新运行时断点续传和清单跳过仍然有效；
+    比较时不区分大小写（Windows和macOS的文件系统不区分）。
+    """
+    def __init__(self, folder, claimed=None):
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.names = {}  # key -> 文件名
+        self.used = set()  # 已使用的文件名（casefold）
+        self.next_suffix = {}  # 文件名（casefold） -> 下一个尝试的后缀
+        for key, name in (claimed or {}).items():
+            self.names[str(key)] = name
+            self.used.add(name.casefold())
+
+    def claim(self, key, stem, ext='.mp4'):
+        """为key分配文件名，返回完整路径"""
+        key = str(key)
+        with self.lock:
+            name = self.names.get(key)
+            if name is None:
+                stem = self.fit(stem, ext)
+                name = stem + ext
+                folded = name.casefold()
+                if folded in self.used:
+                    suffix = self.next_suffix.get(folded, 2)
+                    while self.suffixed(stem, suffix, ext).casefold() in self.used:
+                        suffix += 1
+                    self.next_suffix[folded] = suffix + 1
+                    name = self.suffixed(stem, suffix, ext)
+                self.names[key] = name
+                self.used.add(name.casefold())
+            return os.path.join(self.folder, name)
+
+    def fit(self, stem, ext, suffix=' (99)'):
+        """完整路径超过MAX_PATH时截短文件名，为重名后缀留出位置"""
+        room = MAX_PATH - len(os.path.join(self.folder, '')) - len(ext) - len(suffix)
+        if len(stem) > room:
+            stem = stem[:max(room, 1)].rstrip(' .-') or stem[:1]
+        return stem
+
+    def suffixed(self, stem, suffix, ext):
+        """带重名后缀的文件名；超过99个重名时后缀变长，文件名再截短一些"""
+        suffix = f" ({suffix})"
+        return self.fit(stem, ext, suffix) + suffix + ext
+
+
+def page_paths(index, pages, template=PAGE_TEMPLATE, title=None, bvid=None):
+    """合集中所有分P的保存路径（与pages顺序一致），按分P顺序分配，结果是确定的
+
+    ugc_season合集的分P带有各自的bvid，模板中的{bvid}使用分P自己的bvid。
+    """
+    width = index_width(len(pages))
+    paths = []
+    for number, page in enumerate(pages, 1):
+        part = clean_name(page['part'], f"视频{number}")
+        stem = render(template, index=f"{number:0{width}d}", part=part, title=title or '',
+                      bvid=page.get('bvid', bvid) or '', cid=page['cid']) or f"{number:0{width}d}"
+        paths.append(index.claim(page['cid'], stem))
+    return paths
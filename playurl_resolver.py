@@ -0,0 +1,93 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+
+
+def url_deadline(url, default_ttl=600):
+    """从签名CDN地址的deadline参数读取过期时间，没有该参数时按default_ttl估算"""
+    values = parse_qs(urlparse(url).query).get('deadline')
+    if values and values[0].isdigit():
+        return int(values[0])
+    return time.time() + default_ttl
+
+
+def streams_deadline(streams):
+    """一组durl分段中最早过期的时间，任一地址过期都需要重新获取"""
+    return min(url_deadline(url) for stream in streams for url in stream['urls'])
+
+
+class PlayurlResolver:
+    """下载地址解析器：缓存地址直到签名过期，并在后台预取后续分P的地址"""
+    def __init__(self, fetch, expires_at=url_deadline, prefetch_count=2,
+                 refresh_margin=60, max_workers=2):
+        self.fetch = fetch  # fetch(bvid, cid) -> 下载地址
+        self.expires_at = expires_at  # expires_at(下载地址) -> 过期的时间戳
+        self.prefetch_count = prefetch_count
+        self.refresh_margin = refresh_margin  # 距离过期不足该秒数时视为失效，重新获取
+        self.max_workers = max_workers
+        self.entries = {}  # (bvid, cid) -> (过期时间, 下载地址)
+        self.pending = {}  # (bvid, cid) -> Future，正在获取中的地址
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def resolve(self, bvid, cid):
+        """获取下载地址，优先使用未过期的缓存或正在进行的预取结果"""
+        key = (bvid, cid)
+        with self.lock:
+            value = self._get_fresh(key)
+            if value is not None:
+                return value
+            future = self.pending.get(key)
+        if future is not None:
+            try:
+                future.result()
+            except Exception:
+                pass  # 预取失败时在当前线程重新获取一次，抛出真实的错误
+            with self.lock:
+                value = self._get_fresh(key)
+            if value is not None:
+                return value
+        return self._load(key)
+
+    def prefetch(self, bvid, cids):
+        """在后台获取多个分P的下载地址，已缓存且未过期的跳过"""
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            for cid in cids:
+                key = (bvid, cid)
+                if key in self.pending or self._get_fresh(key) is not None:
+                    continue
+                future = self.executor.submit(self._load, key)
+                self.pending[key] = future
+                future.add_done_callback(lambda _, key=key: self._done(key))
+
+    def invalidate(self, bvid, cid):
+        """丢弃缓存的地址，例如下载时发现链接已失效"""
+        with self.lock:
+            self.entries.pop((bvid, cid), None)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def _get_fresh(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] - self.refresh_margin <= time.time():
+            del self.entries[key]  # 即将过期，需要刷新
+            return None
+        return entry[1]
+
+    def _load(self, key):
+        value = self.fetch(*key)
+        with self.lock:
+            self.entries[key] = (self.expires_at(value), value)
+        return value
+
+    def _done(self, key):
+        with self.lock:
+            self.pending.pop(key, None)
@@ -0,0 +1,135 @@
+import glob
+import os
+import shutil
+import threading
+import time
+
+MB = 1024 * 1024
+
+# 合集分P的下载顺序：list按分P顺序；largest先下大文件，总耗时最短（最后不会剩一个大文件单独下载）；
+# smallest先下小文件，最快得到能看的结果
+ORDERS = ('list', 'largest', 'smallest')
+
+DISK_RESERVE = 100 * MB  # 检查剩余空间时额外留出的余量，避免把磁盘写满
+
+
+class InsufficientSpaceError(Exception):
+    """下载目录所在磁盘的剩余空间不足以保存整个合集"""
+    def __init__(self, folder, needed, free):
+        super().__init__(
+            f"磁盘空间不足: 下载到 {folder} 需要 {needed / MB:.1f}MB，剩余 {free / MB:.1f}MB"
+        )
+        self.folder = folder
+        self.needed = needed
+        self.free = free
+
+
+def allocated_size(file_path):
+    """文件下载过程中已经在磁盘上的中间文件大小（预分配的.part、已完成的分段、DASH音视频流）
+
+    断点续传时这部分空间已经占用，不需要再留出。
+    """
+    base_path = os.path.splitext(file_path)[0]
+    paths = set(glob.glob(glob.escape(file_path) + '.*')) | set(glob.glob(glob.escape(base_path) + '.*.m4s*'))
+    return sum(os.path.getsize(path) for path in paths if not path.endswith('.json') and os.path.isfile(path))
+
+
+def check_disk_space(folder, needed, reserve=DISK_RESERVE):
+    """剩余空间不足needed加reserve字节时抛出InsufficientSpaceError，返回剩余字节数（目录还不存在时检查上级目录）"""
+    path = os.path.abspath(folder)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    free = shutil.disk_usage(path).free
+    if needed + reserve > free:
+        raise InsufficientSpaceError(folder, needed, free)
+    return free
+
+
+def order_pages(items, order='list'):
+    """按下载顺序排列[(序号, 分P, 大小), ...]；大小未知（None）的分P排在最后，保持原来的相对顺序"""
+    if order not in ORDERS:
+        raise ValueError(f"未知的下载顺序: {order}，可选 {', '.join(ORDERS)}")
+    if order == 'list':
+        return list(items)
+    known = [item for item in items if item[2] is not None]
+    unknown = [item for item in items if item[2] is None]
+    return sorted(known, key=lambda item: item[2], reverse=(order == 'largest')) + unknown
+
+
+def format_eta(seconds):
+    """剩余秒数 -> 'H:MM:SS' 或 'M:SS'"""
+    seconds = int(seconds + 0.5)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class CollectionProgress:
+    """整个合集的下载进度和预计剩余时间
+
+    总大小来自预检得到的各分P大小（按下载顺序）；某个分P开始下载后以下载时报告的实际大小为准（画质策略可能换了画质）。
+    速度由rate()给出（下载器最近几秒实测的总吞吐量，字节/秒），不受续传前已下载的部分和跳过的分P影响。
+    剩余时间按workers个并行下载模拟：只剩一个大文件时只有一个连接在下载，不能简单地用剩余字节除以总速度。
+    """
+    def __init__(self, sizes, callback, rate, workers=1, interval=1.0):
+        self.sizes = dict(sizes)  # 分P -> 字节数，顺序即下载顺序
+        self.done = {key: 0 for key in self.sizes}  # 分P -> 已下载字节数
+        self.callback = callback
+        self.rate = rate
+        self.workers = max(1, min(workers, len(self.sizes)))
+        self.interval = interval
+        self.last_report = 0
+        self.lock = threading.Lock()
+
+    def update(self, key, downloaded, total=None, force=False):
+        """分P key已下载downloaded字节（total为下载时报告的文件大小），force时立即回调"""
+        with self.lock:
+            if total:
+                self.sizes[key] = total
+            self.done[key] = downloaded
+            now = time.monotonic()
+            if not force and now - self.last_report < self.interval:
+                return
+            self.last_report = now
+            total = sum(self.sizes.values())
+            downloaded = sum(self.done.values())
+            # 正在下载的分P排在前面，其余按下载顺序
+            remaining = sorted(
+                ((self.done.get(key, 0) == 0, size - self.done.get(key, 0)) for key, size in self.sizes.items()
+                 if size > self.done.get(key, 0)),
+                key=lambda item: item[0]
+            )
+        speed = self.rate() or 0
+        self.callback({
+            'progress': downloaded / total * 100 if total else 0,
+            'total_size': total / MB,
+            'downloaded_size': downloaded / MB,
+            'speed': speed / MB,
+            'eta': self.estimate([size for _, size in remaining], speed) if speed > 0 else None
+        })
+
+    def estimate(self, remaining, speed):
+        """按顺序把剩余的字节分给workers个并行下载，返回全部完成的秒数
+
+        每个下载的速度按总速度除以workers估计：测速窗口内大部分时间所有并行下载都在进行。
+        """
+        if not remaining:
+            return 0.0
+        per_worker = speed / self.workers
+        finish_times = [0.0] * min(self.workers, len(remaining))
+        for size in remaining:
+            index = finish_times.index(min(finish_times))
+            finish_times[index] += size / per_worker
+        return max(finish_times)
+
+    def finish(self, key):
+        """分P下载完成或跳过"""
+        with self.lock:
+            size = self.sizes.get(key, 0)
+        self.update(key, size, force=True)
+
+    def drop(self, key):
+        """分P下载失败，不再计入合集的总大小"""
+        with self.lock:
+            self.sizes.pop(key, None)
+            self.done.pop(key, None)
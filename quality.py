@@ -0,0 +1,163 @@
+import collections
+import threading
+import time
+
+# 画质代码（qn）的参考码率（比特/秒），还没有从接口得到实际码率时用来估算文件大小
+NOMINAL_BITRATES = {
+    6: 0.2e6,     # 240P
+    16: 0.4e6,    # 360P
+    32: 0.8e6,    # 480P
+    64: 1.6e6,    # 720P
+    74: 2.4e6,    # 720P60
+    80: 3.0e6,    # 1080P
+    112: 6.0e6,   # 1080P+
+    116: 6.0e6,   # 1080P60
+    120: 15e6,    # 4K
+    125: 20e6,    # HDR
+    126: 20e6,    # 杜比视界
+    127: 40e6,    # 8K
+}
+
+
+def parse_deadline(value, now=None):
+    """'23:30'（下一次到达该时刻）或秒数'3600' -> 时间戳"""
+    now = time.time() if now is None else now
+    if ':' not in value:
+        return now + float(value)
+    hour, minute = (int(part) for part in value.split(':'))
+    local = time.localtime(now)
+    deadline = time.mktime((local.tm_year, local.tm_mon, local.tm_mday, hour, minute, 0, 0, 0, -1))
+    if deadline <= now:
+        deadline += 24 * 3600
+    return deadline
+
+
+def playurl_qualities(data):
+    """从下载地址接口的响应中读取可选画质和各画质的码率，返回(可选画质列表, {画质: 比特/秒})"""
+    data = data.get('data') or {}
+    accept = list(data.get('accept_quality') or [])
+    accept += [f['quality'] for f in data.get('support_formats') or [] if f.get('quality') not in accept]
+    bitrates = {}
+    dash = data.get('dash')
+    if dash:
+        audio = max((a.get('bandwidth', 0) for a in dash.get('audio') or []), default=0)
+        for video in dash.get('video') or []:
+            rate = video.get('bandwidth', 0) + audio
+            bitrates[video['id']] = max(bitrates.get(video['id'], 0), rate)
+    elif data.get('durl') and data.get('quality') and data.get('timelength'):
+        size = sum(d.get('size', 0) for d in data['durl'])
+        bitrates[data['quality']] = size * 8 / (data['timelength'] / 1000)
+    return accept, {q: rate for q, rate in bitrates.items() if rate > 0}
+
+
+class ThroughputMeter:
+    """最近window秒内所有下载的总吞吐量（字节/秒）"""
+    def __init__(self, window=10.0):
+        self.window = window
+        self.samples = collections.deque()  # (时间, 字节数)
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def add(self, size):
+        now = time.monotonic()
+        with self.lock:
+            self.samples.append((now, size))
+            self.total += size
+            self._trim(now)
+
+    def _trim(self, now):
+        while self.samples and self.samples[0][0] < now - self.window:
+            self.total -= self.samples.popleft()[1]
+
+    def rate(self):
+        """没有数据或数据不足1秒时返回None"""
+        now = time.monotonic()
+        with self.lock:
+            self._trim(now)
+            if not self.samples:
+                return None
+            span = now - self.samples[0][0]
+            if span < 1.0:
+                return None
+            return self.total / span
+
+
+class QualityPolicy:
+    """按实测吞吐量选择画质：在按时完成的前提下选最高的画质
+
+    - deadline: 所有已登记的视频需要在该时间戳前下载完成
+    - target_rate: 下载速度至少是播放速度的多少倍（例如10表示每秒下载10秒的视频）
+    - max_quality / min_quality: 画质范围（qn）
+    每个视频开始下载前调用choose，画质可以在合集的分P之间降低或提高；每次最多提高一档，避免来回切换。
+    两个目标都没有设置或还没有测到吞吐量时选max_quality以内的最高画质。
+    """
+    def __init__(self, deadline=None, target_rate=None, max_quality=80, min_quality=16, headroom=0.8):
+        self.deadline = deadline
+        self.target_rate = target_rate
+        self.max_quality = max_quality
+        self.min_quality = min_quality
+        self.headroom = headroom  # 只按实测吞吐量的这一比例规划，留出重试和速度波动的余量
+        self.accept = set()  # 接口返回过的可选画质
+        self.bitrates = {}  # 画质 -> 实际码率（比特/秒）
+        self.pending = {}  # 已登记还没开始下载的视频 -> 时长（秒）
+        self.current = None  # 上一次选择的画质
+        self.lock = threading.Lock()
+
+    def add(self, key, seconds):
+        """登记一个将要下载的视频及其时长，用于估算距离截止时间还剩多少工作"""
+        with self.lock:
+            self.pending[key] = seconds or 0
+
+    def discard(self, key):
+        """登记过的视频不需要下载（例如已经下载过）"""
+        with self.lock:
+            self.pending.pop(key, None)
+
+    def observe(self, data):
+        """记录下载地址接口返回的可选画质和码率"""
+        accept, bitrates = playurl_qualities(data)
+        with self.lock:
+            self.accept.update(accept)
+            self.bitrates.update(bitrates)
+
+    def estimate(self, quality):
+        """画质的码率：接口给出过的用实际值，其他画质按参考码率和已知画质的比例推算"""
+        if quality in self.bitrates:
+            return self.bitrates[quality]
+        known = [(rate, NOMINAL_BITRATES[q]) for q, rate in self.bitrates.items() if q in NOMINAL_BITRATES]
+        scale = sum(rate for rate, _ in known) / sum(nominal for _, nominal in known) if known else 1.0
+        return NOMINAL_BITRATES.get(quality, NOMINAL_BITRATES[80]) * scale
+
+    def allowed_bitrate(self, throughput, seconds):
+        """按目标允许的最高码率，没有目标或没有吞吐量数据时返回None（调用时持有锁）"""
+        if not throughput:
+            return None
+        usable = throughput * 8 * self.headroom
+        limits = []
+        if self.target_rate:
+            limits.append(usable / self.target_rate)
+        if self.deadline:
+            work = sum(self.pending.values()) + (seconds or 0)
+            if work > 0:
+                limits.append(usable * max(0.0, self.deadline - time.time()) / work)
+        return min(limits) if limits else None
+
+    def choose(self, key, throughput):
+        """为即将开始下载的视频选择画质（qn），throughput为实测的总吞吐量（字节/秒）"""
+        with self.lock:
+            seconds = self.pending.pop(key, None)
+            candidates = sorted(
+                (q for q in (self.accept or NOMINAL_BITRATES) if self.min_quality <= q <= self.max_quality),
+                reverse=True
+            )
+            if not candidates:
+                return self.max_quality
+            allowed = self.allowed_bitrate(throughput, seconds)
+            if allowed is None:
+                choice = candidates[0]
+            else:
+                choice = next((q for q in candidates if self.estimate(q) <= allowed), candidates[-1])
+            if self.current is not None and choice > self.current:
+                choice = min(q for q in candidates if q > self.current)
+            self.current = choice
+            return choice
@@ -0,0 +1,197 @@
+import random
+import threading
+import time
+from urllib.parse import urlparse
+from bandwidth import DownloadCancelled
+
+# 可以重试的错误类别：只有网络和服务器一侧的错误；本地磁盘错误（local）和程序错误（other）重试也不会成功
+RETRYABLE = {'timeout', 'reset', 'expired', 'throttled', 'server', 'incomplete', 'circuit_open'}
+
+# 这些库抛出的、没有归入其他类别的异常都是网络错误
+NETWORK_MODULES = ('requests', 'urllib3', 'http.client', 'ssl', 'socket')
+
+
+class CircuitOpenError(Exception):
+    """主机的熔断器处于打开状态，暂时不向它发送请求"""
+    def __init__(self, host, remaining):
+        super().__init__(f"主机 {host} 连续失败过多，{remaining:.0f}秒内暂停请求")
+        self.host = host
+        self.remaining = remaining
+
+
+class ThrottledError(Exception):
+    """接口返回了风控限流（HTTP 412/429，或JSON中的-412、-509、-799等错误码）"""
+    def __init__(self, code, message, retry_after=None):
+        super().__init__(f"请求被限流({code}): {message}")
+        self.code = code
+        self.retry_after = retry_after  # 服务器建议的等待秒数
+
+
+def status_of(error):
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None) or getattr(error, 'status', None)
+
+
+def classify(error, media=False):
+    """把异常归类：timeout、reset、expired、throttled、server、incomplete、client、circuit_open、cancelled、local、other
+
+    media为True表示视频文件（CDN）请求：403是签名的下载地址过期，可以重新获取地址后重试；
+    接口请求的403是没有权限，重试也不会成功。
+    """
+    if isinstance(error, DownloadCancelled):
+        return 'cancelled'
+    if isinstance(error, CircuitOpenError):
+        return 'circuit_open'
+    if isinstance(error, ThrottledError):
+        return 'throttled'
+    status = status_of(error)
+    if status:
+        if status == 403:
+            return 'expired' if media else 'client'
+        if status in (412, 429):
+            return 'throttled'
+        if status >= 500:
+            return 'server'
+        if status >= 400:
+            return 'client'
+    name = type(error).__name__
+    if 'Timeout' in name:
+        return 'timeout'
+    if any(word in name for word in ('Connect', 'ChunkedEncoding', 'Reset', 'BrokenPipe', 'Disconnect', 'Protocol')):
+        return 'reset'
+    if '不完整' in str(error) or '不匹配' in str(error):
+        return 'incomplete'
+    if type(error).__module__.startswith(NETWORK_MODULES):
+        return 'reset'
+    if isinstance(error, OSError):
+        return 'local'  # 磁盘已满、没有权限等本地文件错误
+    return 'other'
+
+
+def retry_after(error):
+    """读取响应中的Retry-After（秒），没有时返回None"""
+    if isinstance(error, ThrottledError):
+        return error.retry_after
+    # requests的异常带有response，其他异常可能直接带有headers
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or getattr(error, 'headers', None) or {}
+    value = headers.get('Retry-After')
+    if value and str(value).isdigit():
+        return int(value)
+    return None
+
+
+class CircuitBreaker:
+    """单个主机的熔断器：连续失败threshold次后打开，cooldown秒后放行一次试探请求"""
+    def __init__(self, threshold=10, cooldown=15):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def remaining(self):
+        """熔断剩余的秒数，0表示可以发送请求"""
+        if self.opened_at is None:
+            return 0
+        return max(0.0, self.opened_at + self.cooldown - time.time())
+
+
+class RetryPolicy:
+    """VideoDownloader所有网络请求共用的重试策略
+
+    按错误类别决定是否重试，使用带随机抖动的指数退避，并对每个主机做熔断。
+    """
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=30.0,
+                 throttle_delay=5.0, breaker_threshold=10, breaker_cooldown=15):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.throttle_delay = throttle_delay  # 被限流时的基础等待时间
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.breakers = {}  # 主机 -> CircuitBreaker
+        self.lock = threading.Lock()
+
+    def should_retry(self, category):
+        return category in RETRYABLE
+
+    def delay(self, attempt, error, media=False):
+        """第attempt次（从0开始）失败后的等待时间：指数退避加全抖动，优先遵守Retry-After"""
+        hint = retry_after(error)
+        if hint is not None:
+            return min(hint, self.max_delay * 4)
+        category = classify(error, media)
+        if category == 'circuit_open':
+            return error.remaining
+        if category == 'expired':
+            return 0  # 重新获取下载地址后立即重试
+        if isinstance(error, ThrottledError):
+            # 接口限流时api_limiter已经暂停并降低了请求速率，重试只需要少量抖动
+            return random.uniform(0, self.base_delay)
+        base = self.throttle_delay if category == 'throttled' else self.base_delay
+        cap = min(self.max_delay, base * (2 ** attempt))
+        return random.uniform(cap / 2, cap) if category == 'throttled' else random.uniform(0, cap)
+
+    def breaker(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            breaker = self.breakers.get(host)
+            if breaker is None:
+                breaker = self.breakers[host] = CircuitBreaker(self.breaker_threshold, self.breaker_cooldown)
+            return host, breaker
+
+    def check(self, url):
+        """请求前检查主机的熔断器，打开时抛出CircuitOpenError"""
+        host, breaker = self.breaker(url)
+        with self.lock:
+            remaining = breaker.remaining()
+            if remaining > 0:
+                raise CircuitOpenError(host, remaining)
+            if breaker.opened_at is not None:
+                # 冷却结束：只放行一个试探请求，其他请求继续等待
+                if breaker.probing:
+                    raise CircuitOpenError(host, 1)
+                breaker.probing = True
+
+    def record_success(self, url):
+        host, breaker = self.breaker(url)
+        with self.lock:
+            breaker.failures = 0
+            breaker.opened_at = None
+            breaker.probing = False
+
+    def record_failure(self, url, error=None):
+        """记录一次失败；客户端错误、过期链接和接口限流（由api_limiter降低并发）不算主机故障"""
+        if error is not None and classify(error) in ('client', 'expired', 'circuit_open', 'cancelled'):
+            return
+        if isinstance(error, ThrottledError):
+            return
+        host, breaker = self.breaker(url)
+        with self.lock:
+            breaker.failures += 1
+            breaker.probing = False
+            if breaker.failures >= breaker.threshold:
+                breaker.opened_at = time.time()
+
+    def call(self, func, url=None, max_attempts=None, on_retry=None, sleep=time.sleep):
+        """执行func()，失败时按策略重试；on_retry(attempt, error, delay)在每次等待前调用"""
+        max_attempts = max_attempts or self.max_attempts
+        for attempt in range(max_attempts):
+            try:
+                if url:
+                    self.check(url)
+                result = func()
+            except Exception as e:
+                if url:
+                    self.record_failure(url, e)
+                if attempt == max_attempts - 1 or not self.should_retry(classify(e)):
+                    raise
+                delay = self.delay(attempt, e)
+                if on_retry:
+                    on_retry(attempt, e, delay)
+                sleep(delay)
+                continue
+            if url:
+                self.record_success(url)
+            return result
@@ -0,0 +1,109 @@
+import threading
+import time
+import unittest
+
+from api_limiter import AdaptiveLimiter, throttle_error
+from retry_policy import ThrottledError
+
+
+class ThrottleErrorTest(unittest.TestCase):
+    """HTTP 412/429和JSON中的风控错误码都是限流，其他错误码不是"""
+
+    def test_status_codes(self):
+        error = throttle_error(429, {'Retry-After': '3'})
+        self.assertIsInstance(error, ThrottledError)
+        self.assertEqual((error.code, error.retry_after), (429, 3))
+        self.assertIsNotNone(throttle_error(412, {}))
+
+    def test_json_codes(self):
+        for code in (-412, -509, -799):
+            self.assertEqual(throttle_error(200, {}, {'code': code, 'message': ''}).code, code)
+        self.assertIsNone(throttle_error(200, {}, {'code': -404, 'message': '啥都木有'}))
+        self.assertIsNone(throttle_error(200, {}, {'code': 0}))
+
+
+class AdaptiveLimiterTest(unittest.TestCase):
+    """AIMD：成功时加性增加上限，被限流时乘性降低并暂停，降到最低后拉长请求间隔"""
+
+    def limiter(self, **options):
+        options.setdefault('pause', 0)
+        return AdaptiveLimiter(**options)
+
+    def succeed(self, limiter, count=1):
+        for _ in range(count):
+            with limiter.slot():
+                pass
+
+    def throttle(self, limiter, retry_after=None):
+        with limiter.slot() as slot:
+            slot.throttle(retry_after)
+
+    def test_success_increases_limit(self):
+        limiter = self.limiter(initial=4, max_limit=6)
+        self.succeed(limiter, 4)
+        self.assertAlmostEqual(limiter.limit, 5, delta=0.1)  # 约每一轮请求加1
+        self.succeed(limiter, 50)
+        self.assertEqual(limiter.limit, 6)
+
+    def test_throttle_halves_limit(self):
+        limiter = self.limiter(initial=8)
+        self.throttle(limiter)
+        self.assertEqual(limiter.limit, 4)
+        self.assertEqual(limiter.stats()['throttled'], 1)
+
+    def test_same_round_decreases_once(self):
+        limiter = self.limiter(initial=8)
+        slots = [limiter.slot() for _ in range(4)]
+        for slot in slots:
+            slot.throttle()
+            slot.__exit__(None, None, None)
+        self.assertEqual(limiter.limit, 4)
+        self.assertEqual(limiter.stats()['throttled'], 4)
+
+    def test_network_errors_do_not_change_limit(self):
+        limiter = self.limiter(initial=4)
+        with self.assertRaises(TimeoutError):
+            with limiter.slot():
+                raise TimeoutError()
+        self.assertEqual(limiter.limit, 4)
+
+    def test_interval_grows_at_min_limit(self):
+        limiter = self.limiter(initial=1, min_interval=0.01, interval_step=0.005)
+        self.throttle(limiter)
+        self.assertEqual(limiter.interval, 0.01)
+        self.throttle(limiter)
+        self.assertEqual(limiter.interval, 0.02)
+        # 成功的请求先缩短间隔，间隔为0后才增加并发
+        self.succeed(limiter, 4)
+        self.assertEqual(limiter.interval, 0)
+        self.assertEqual(limiter.limit, 1)
+        self.succeed(limiter)
+        self.assertEqual(limiter.limit, 2)
+
+    def test_retry_after_pauses_new_requests(self):
+        limiter = self.limiter(initial=4)
+        self.throttle(limiter, retry_after=0.3)
+        started = time.monotonic()
+        self.succeed(limiter)
+        self.assertGreaterEqual(time.monotonic() - started, 0.25)
+
+    def test_limit_bounds_concurrency(self):
+        limiter = self.limiter(initial=2)
+        first, second = limiter.slot(), limiter.slot()
+        acquired = threading.Event()
+
+        def third():
+            with limiter.slot():
+                acquired.set()
+
+        thread = threading.Thread(target=third)
+        thread.start()
+        self.assertFalse(acquired.wait(0.2))
+        first.__exit__(None, None, None)
+        self.assertTrue(acquired.wait(1))
+        thread.join()
+        second.__exit__(None, None, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
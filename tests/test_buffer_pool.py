@@ -0,0 +1,75 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from buffer_pool import BufferPool, WriteBehind
+
+
+class FailedWriteTest(unittest.TestCase):
+    """写入失败后提交的缓冲区也要归还缓冲池，否则缓冲区逐渐耗尽，所有下载阻塞在acquire()"""
+
+    def setUp(self):
+        self.pool = BufferPool(count=4, size=1024)
+        self.behind = WriteBehind(self.pool)
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown(self):
+        self.behind.close()
+        os.remove(self.path)
+
+    def acquire(self):
+        """缓冲区被泄漏时acquire()会一直等待，这里超时后报错"""
+        result = []
+        thread = threading.Thread(target=lambda: result.append(self.pool.acquire()), daemon=True)
+        thread.start()
+        thread.join(1)
+        if not result:
+            self.fail("缓冲池已耗尽")
+        return result[0]
+
+    def failing_writer(self):
+        """写入后的回调抛出异常，与磁盘写入失败一样由写线程记录为写入错误"""
+        def on_written(view):
+            raise OSError(28, '磁盘已满')
+        return self.behind.open(self.path, on_written)
+
+    def wait_for_error(self, writer):
+        deadline = time.monotonic() + 1
+        while time.monotonic() < deadline:
+            try:
+                writer.check()
+            except OSError:
+                return
+            time.sleep(0.01)
+        self.fail("写入错误没有报告")
+
+    def test_buffers_returned_after_write_error(self):
+        writer = self.failing_writer()
+        writer.write(0, self.acquire(), 1024)
+        self.wait_for_error(writer)
+
+        for offset in range(1, 10):
+            with self.assertRaises(OSError):
+                writer.write(offset * 1024, self.acquire(), 1024)
+        writer.close()
+        # 所有缓冲区都已归还
+        buffers = [self.acquire() for _ in range(4)]
+        self.assertEqual(len({id(buf) for buf in buffers}), 4)
+
+    def test_data_written_at_offsets(self):
+        writer = self.behind.open(self.path)
+        for offset, byte in ((1024, b'b'), (0, b'a')):
+            buf = self.acquire()
+            buf[:1024] = byte * 1024
+            writer.write(offset, buf, 1024)
+        writer.close()
+        writer.check()
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b'a' * 1024 + b'b' * 1024)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from job_store import JobStore, DOWNLOADING, FAILED, COMPLETED, MB
+
+
+class ProgressThrottleTest(unittest.TestCase):
+    """进度回调按间隔和字节数节流写入，任务结束时写入最后的进度"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = JobStore(os.path.join(self.directory, 'jobs.db'), progress_interval=60, progress_bytes=8 * MB)
+        self.store.add('BV1:1', 'BV1', 1, status=DOWNLOADING)
+        self.writes = []
+        self.store.conn.set_trace_callback(
+            lambda sql: self.writes.append(sql) if sql.lstrip().startswith('UPDATE') else None
+        )
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def report(self, downloaded_mb, **extra):
+        self.store.progress('BV1:1', dict(downloaded_size=downloaded_mb, total_size=100, **extra))
+
+    def test_progress_writes_are_throttled(self):
+        for downloaded in range(1, 8):
+            self.report(downloaded)
+        self.assertEqual(len(self.writes), 1)  # 只有第一次回调立即写入
+        self.assertEqual(self.store.get('BV1:1')['downloaded'], 1 * MB)
+
+        self.report(9)  # 距离上次写入超过progress_bytes
+        self.assertEqual(len(self.writes), 2)
+        self.assertEqual(self.store.get('BV1:1')['downloaded'], 9 * MB)
+
+    def test_errors_are_written_immediately(self):
+        self.report(1)
+        self.report(2, error='连接被重置', retry_count=1)
+        job = self.store.get('BV1:1')
+        self.assertEqual((job['retries'], job['error']), (1, '连接被重置'))
+
+    def test_failure_writes_pending_progress(self):
+        self.report(1)
+        self.report(5)
+        self.store.finish('BV1:1', FAILED, error='磁盘已满')
+        job = self.store.get('BV1:1')
+        self.assertEqual((job['status'], job['downloaded'], job['error']), (FAILED, 5 * MB, '磁盘已满'))
+
+    def test_completion_writes_final_size(self):
+        self.report(1)
+        self.report(5)
+        self.store.finish('BV1:1', COMPLETED, size=100 * MB)
+        job = self.store.get('BV1:1')
+        self.assertEqual((job['status'], job['downloaded'], job['total']), (COMPLETED, 100 * MB, 100 * MB))
+
+
+if __name__ == '__main__':
+    unittest.main()
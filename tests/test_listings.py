@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+import unittest
+
+from bench_server import MockConfig, MockServer
+from listings import ListingResolver, RateBudget, fetch_paginated, mixin_key, season_pages, wbi_sign
+from video_downloader import VideoDownloader
+
+IMG_KEY = '7cd084941338484aae1ad9425b84077c'
+SUB_KEY = '4932caff0ff746eab6f01bf08b70ac45'
+
+
+class WbiSignTest(unittest.TestCase):
+    """WBI签名与公开文档中的示例一致"""
+
+    def test_documented_example(self):
+        key = mixin_key(IMG_KEY, SUB_KEY)
+        self.assertEqual(key, 'ea1db124af3c7062474693fa704f4ff8')
+        params = wbi_sign({'foo': '114', 'bar': '514', 'zab': 1919810}, key, now=1702204169)
+        self.assertEqual(params['wts'], '1702204169')
+        self.assertEqual(params['w_rid'], '8f6f2b5b3d485fe1886cec6a0be8c5d4')
+
+    def test_strips_special_characters(self):
+        key = mixin_key(IMG_KEY, SUB_KEY)
+        self.assertEqual(wbi_sign({'keyword': "(a*b)!'"}, key, now=1), wbi_sign({'keyword': 'ab'}, key, now=1))
+
+
+class FetchPaginatedTest(unittest.TestCase):
+
+    def pages(self, total, size=10, fail=()):
+        def fetch_page(number):
+            if number in fail:
+                raise Exception("连接被重置")
+            first = (number - 1) * size
+            return list(range(first, min(first + size, total))), -(-total // size)
+        return fetch_page
+
+    def test_all_items(self):
+        self.assertEqual(sorted(fetch_paginated(self.pages(95), workers=4)), list(range(95)))
+        self.assertEqual(list(fetch_paginated(self.pages(5))), list(range(5)))
+
+    def test_first_page_yielded_before_others(self):
+        started = threading.Event()
+
+        def fetch_page(number):
+            if number > 1:
+                started.wait(1)
+            return [number], 3
+
+        items = fetch_paginated(fetch_page)
+        self.assertEqual(next(items), 1)  # 不等其他页
+        started.set()
+        self.assertEqual(sorted(items), [2, 3])
+
+    def test_failed_pages_reported_after_others(self):
+        items = []
+        with self.assertRaises(Exception) as context:
+            for item in fetch_paginated(self.pages(50, fail=(2, 4))):
+                items.append(item)
+        self.assertIn('第2、4页', str(context.exception))
+        self.assertEqual(sorted(items), list(range(10)) + list(range(20, 30)) + list(range(40, 50)))
+
+    def test_rate_budget(self):
+        started = time.monotonic()
+        list(fetch_paginated(self.pages(50), workers=5, budget=RateBudget(20)))
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)  # 5页，每秒20个请求
+
+
+class ListingResolverTest(unittest.TestCase):
+    """对模拟服务器分页获取UP主投稿（WBI签名）和合集列表"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockServer(MockConfig(listing=75, season=45)).start()
+        cls.downloader = VideoDownloader(api_base=cls.server.base_url)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.downloader.close()
+        cls.server.stop()
+
+    def resolver(self):
+        return ListingResolver(self.downloader, workers=3, rate=None, page_size=20, root='downloads')
+
+    def test_space_listing(self):
+        entries = list(self.resolver().entries('https://space.bilibili.com/123/video'))
+        self.assertEqual(sorted(entry['bvid'] for entry in entries), [f"BV1L{n:08d}" for n in range(1, 76)])
+        self.assertEqual({entry['folder'] for entry in entries}, {os.path.join('downloads', '基准测试UP主')})
+
+    def test_season_listing(self):
+        entries = list(self.resolver().entries('https://space.bilibili.com/123/lists/1?type=season'))
+        self.assertEqual(sorted(entry['bvid'] for entry in entries), [f"BV1S{n:08d}" for n in range(1, 46)])
+        self.assertEqual({entry['folder'] for entry in entries}, {os.path.join('downloads', '基准测试合集')})
+
+    def test_match(self):
+        resolver = self.resolver()
+        self.assertTrue(resolver.match('https://space.bilibili.com/123'))
+        self.assertFalse(resolver.match('https://www.bilibili.com/video/BV1xx411c7mD'))
+
+
+class SeasonPagesTest(unittest.TestCase):
+
+    def test_sections_prefix_titles(self):
+        season = {'sections': [
+            {'title': '正片', 'episodes': [{'bvid': 'BV1', 'cid': 1, 'title': '第一集', 'page': {'duration': 60}}]},
+            {'title': '番外', 'episodes': [{'bvid': 'BV2', 'title': '', 'page': {'cid': 2, 'part': '花絮'}}]},
+        ]}
+        self.assertEqual(season_pages(season), [
+            {'bvid': 'BV1', 'cid': 1, 'part': '正片-第一集', 'page': 1, 'duration': 60},
+            {'bvid': 'BV2', 'cid': 2, 'part': '番外-花絮', 'page': 2, 'duration': None},
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import threading
+import time
+import unittest
+
+from metadata_cache import MetadataCache
+
+
+class GetOrLoadTest(unittest.TestCase):
+    """同一个key并发加载时只调用一次loader，等待的线程使用加载线程的结果或异常"""
+
+    def setUp(self):
+        self.cache = MetadataCache()
+        self.calls = 0
+
+    def load_concurrently(self, loader, threads=8):
+        results = []
+        lock = threading.Lock()
+
+        def run():
+            try:
+                result = self.cache.get_or_load('BV1', loader, cacheable=lambda info: info.get('code') == 0)
+            except Exception as e:
+                result = e
+            with lock:
+                results.append(result)
+
+        workers = [threading.Thread(target=run) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return results
+
+    def slow(self, result):
+        def loader():
+            self.calls += 1
+            time.sleep(0.2)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return loader
+
+    def test_success_is_cached(self):
+        results = self.load_concurrently(self.slow({'code': 0}))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [{'code': 0}] * 8)
+        self.assertEqual(self.cache.get('BV1'), {'code': 0})
+
+    def test_waiters_share_uncacheable_result(self):
+        results = self.load_concurrently(self.slow({'code': -404}))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [{'code': -404}] * 8)
+        self.assertIsNone(self.cache.get('BV1'))
+
+    def test_waiters_share_exception(self):
+        error = ValueError('接口超时')
+        results = self.load_concurrently(self.slow(error))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [error] * 8)
+        # 失败不缓存，之后的调用重新加载
+        self.assertEqual(self.cache.get_or_load('BV1', self.slow({'code': 0})), {'code': 0})
+        self.assertEqual(self.calls, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
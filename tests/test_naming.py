@@ -0,0 +1,99 @@
+import os
+import unittest
+
+from naming import MAX_NAME_BYTES, NameIndex, clean_name, index_width, page_paths, truncate_bytes
+
+
+class NameIndexTest(unittest.TestCase):
+    """重名时追加序号后缀，不区分大小写，同一个cid总是得到同一个文件名"""
+
+    def setUp(self):
+        self.index = NameIndex('downloads')
+
+    def name(self, key, stem):
+        return os.path.basename(self.index.claim(key, stem))
+
+    def test_collisions_get_suffixes(self):
+        self.assertEqual(self.name(1, '第一集'), '第一集.mp4')
+        self.assertEqual(self.name(2, '第一集'), '第一集 (2).mp4')
+        self.assertEqual(self.name(3, '第一集'), '第一集 (3).mp4')
+
+    def test_same_key_same_name(self):
+        self.name(1, 'Intro')
+        self.name(2, 'Intro')
+        self.assertEqual(self.name(2, 'Intro'), 'Intro (2).mp4')
+        self.assertEqual(self.name(1, '改过的标题'), 'Intro.mp4')
+
+    def test_casefold(self):
+        self.assertEqual(self.name(1, 'Intro'), 'Intro.mp4')
+        self.assertEqual(self.name(2, 'INTRO'), 'INTRO (2).mp4')
+        self.assertEqual(self.name(3, 'intro'), 'intro (3).mp4')
+
+    def test_suffix_skips_taken_names(self):
+        self.name(1, 'Intro (2)')
+        self.name(2, 'Intro')
+        self.assertEqual(self.name(3, 'Intro'), 'Intro (3).mp4')
+
+    def test_suffix_past_99(self):
+        names = [self.name(cid, '片头') for cid in range(1, 151)]
+        self.assertEqual(len(set(names)), 150)
+        self.assertEqual(names[99], '片头 (100).mp4')
+        self.assertEqual(names[-1], '片头 (150).mp4')
+
+    def test_claimed_names_are_kept(self):
+        index = NameIndex('downloads', claimed={1: 'Intro.mp4'})
+        self.assertEqual(os.path.basename(index.claim(2, 'intro')), 'intro (2).mp4')
+        self.assertEqual(os.path.basename(index.claim(1, '别的标题')), 'Intro.mp4')
+
+    def test_long_folder_fits_max_path(self):
+        index = NameIndex(os.path.join('downloads', '合' * 200))
+        path = index.claim(1, '集' * 100)
+        self.assertLessEqual(len(path) + len(' (99)'), 255)
+        # 超过99个重名时后缀变长，路径仍不超过MAX_PATH
+        paths = [index.claim(cid, '集' * 100) for cid in range(2, 120)]
+        self.assertEqual(len(set(paths)), 118)
+        self.assertLessEqual(max(len(path) for path in paths), 255)
+
+
+class CleanNameTest(unittest.TestCase):
+
+    def test_illegal_characters(self):
+        self.assertEqual(clean_name('【合集】A/B：第1集？'), '[合集]A-B-第1集?')
+        self.assertEqual(clean_name('a  --  b'), 'a - b')
+        self.assertEqual(clean_name('CON'), '_CON')
+        self.assertEqual(clean_name(' .. ', '默认'), '默认')
+
+    def test_truncate_cjk_by_bytes(self):
+        title = '中文标题' * 30  # 每个字3字节，共360字节
+        truncated = truncate_bytes(title)
+        self.assertLessEqual(len(truncated.encode('utf-8')), MAX_NAME_BYTES)
+        self.assertEqual(len(truncated), MAX_NAME_BYTES // 3)  # 不会切断一个字符
+        self.assertTrue(title.startswith(truncated))
+        self.assertEqual(truncate_bytes('短标题'), '短标题')
+
+    def test_truncate_mixed_width(self):
+        truncated = truncate_bytes('a' + '字' * 100, limit=10)
+        self.assertEqual(truncated, 'a字字字')
+
+
+class PagePathsTest(unittest.TestCase):
+
+    def test_index_width_grows(self):
+        self.assertEqual(index_width(9), 2)
+        self.assertEqual(index_width(100), 3)
+        pages = [{'cid': cid, 'part': '片头'} for cid in range(1, 101)]
+        paths = page_paths(NameIndex('downloads'), pages)
+        self.assertEqual(os.path.basename(paths[0]), '001-片头.mp4')
+        self.assertEqual(os.path.basename(paths[-1]), '100-片头.mp4')
+
+    def test_duplicate_part_titles(self):
+        pages = [{'cid': 1, 'part': ''}, {'cid': 2, 'part': ''}]
+        paths = page_paths(NameIndex('downloads'), pages, template='{part}')
+        self.assertEqual([os.path.basename(path) for path in paths], ['视频1.mp4', '视频2.mp4'])
+        pages = [{'cid': 1, 'part': '正片'}, {'cid': 2, 'part': '正片'}]
+        paths = page_paths(NameIndex('downloads'), pages, template='{part}')
+        self.assertEqual([os.path.basename(path) for path in paths], ['正片.mp4', '正片 (2).mp4'])
+
+
+if __name__ == '__main__':
+    unittest.main()
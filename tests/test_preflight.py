@@ -0,0 +1,58 @@
+import unittest
+
+from preflight import CollectionProgress, format_eta, order_pages
+
+
+def items(*sizes):
+    return [(index, f"P{index + 1}", size) for index, size in enumerate(sizes)]
+
+
+def names(ordered):
+    return [page for _, page, _ in ordered]
+
+
+class OrderPagesTest(unittest.TestCase):
+    """按大小排列分P，大小未知的排在最后并保持原来的相对顺序"""
+
+    def test_list_keeps_order(self):
+        self.assertEqual(names(order_pages(items(3, None, 1), 'list')), ['P1', 'P2', 'P3'])
+
+    def test_largest_first(self):
+        self.assertEqual(names(order_pages(items(1, 2, 3, 6, 5, 4), 'largest')),
+                         ['P4', 'P5', 'P6', 'P3', 'P2', 'P1'])
+
+    def test_smallest_first(self):
+        self.assertEqual(names(order_pages(items(1, 2, 3, 6, 5, 4), 'smallest')),
+                         ['P1', 'P2', 'P3', 'P6', 'P5', 'P4'])
+
+    def test_unknown_sizes_last(self):
+        ordered = order_pages(items(None, 5, None, 9), 'largest')
+        self.assertEqual(names(ordered), ['P4', 'P2', 'P1', 'P3'])
+
+    def test_equal_sizes_stable(self):
+        self.assertEqual(names(order_pages(items(2, 2, 2), 'largest')), ['P1', 'P2', 'P3'])
+
+    def test_unknown_order(self):
+        with self.assertRaises(ValueError):
+            order_pages(items(1), 'random')
+
+
+class CollectionProgressTest(unittest.TestCase):
+    """合集的整体进度，剩余时间按并行下载数模拟"""
+
+    def test_progress_and_eta(self):
+        events = []
+        progress = CollectionProgress({'a': 100, 'b': 100}, events.append, rate=lambda: 10, workers=2, interval=0)
+        progress.update('a', 50, force=True)
+        event = events[-1]
+        self.assertEqual(event['progress'], 25)
+        # 两个连接各5字节/秒：a剩50字节、b剩100字节，b下载完需要20秒
+        self.assertAlmostEqual(event['eta'], 20)
+
+    def test_format_eta(self):
+        self.assertEqual(format_eta(65), '1:05')
+        self.assertEqual(format_eta(3725), '1:02:05')
+
+
+if __name__ == '__main__':
+    unittest.main()
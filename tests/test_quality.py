@@ -0,0 +1,81 @@
+import time
+import unittest
+
+from quality import QualityPolicy, parse_deadline, playurl_qualities
+
+MB = 1000 * 1000  # 吞吐量按字节/秒，1MB/s = 8Mbps
+
+
+def playurl(qualities, dash=None):
+    return {'code': 0, 'data': {'accept_quality': qualities, **({'dash': dash} if dash else {})}}
+
+
+class QualityPolicyTest(unittest.TestCase):
+    """按实测吞吐量选择画质：降低立即生效，提高每次最多一档"""
+
+    def policy(self, **options):
+        policy = QualityPolicy(**options)
+        policy.observe(playurl([80, 64, 32, 16]))
+        return policy
+
+    def test_highest_without_throughput(self):
+        policy = self.policy(target_rate=4)
+        self.assertEqual(policy.choose('BV1:1', None), 80)
+        self.assertEqual(self.policy(target_rate=4, max_quality=64).choose('BV1:1', None), 64)
+
+    def test_target_rate(self):
+        # 可用8Mbps * 0.8 = 6.4Mbps，4倍速时每个视频最多1.6Mbps，即720P的参考码率
+        self.assertEqual(self.policy(target_rate=4).choose('BV1:1', 1 * MB), 64)
+        self.assertEqual(self.policy(target_rate=1).choose('BV1:1', 1 * MB), 80)
+        # 吞吐量太低时取最低画质，不低于min_quality
+        self.assertEqual(self.policy(target_rate=4, min_quality=32).choose('BV1:1', 1000), 32)
+
+    def test_steps_up_one_level_at_a_time(self):
+        policy = self.policy(target_rate=4)
+        self.assertEqual(policy.choose('BV1:1', 0.1 * MB), 16)
+        self.assertEqual([policy.choose(f"BV1:{cid}", 10 * MB) for cid in range(2, 6)], [32, 64, 80, 80])
+
+    def test_steps_down_immediately(self):
+        policy = self.policy(target_rate=4)
+        self.assertEqual(policy.choose('BV1:1', 10 * MB), 80)
+        self.assertEqual(policy.choose('BV1:2', 0.1 * MB), 16)
+
+    def test_deadline_counts_pending_work(self):
+        policy = self.policy(deadline=time.time() + 100)
+        for cid in range(1, 4):
+            policy.add(f"BV1:{cid}", 100)
+        # 剩余300秒视频、100秒时间：6.4Mbps / 3 ≈ 2.1Mbps，只够720P
+        self.assertEqual(policy.choose('BV1:1', 1 * MB), 64)
+        # 已经下载过的视频不再计入剩余工作
+        policy.discard('BV1:3')
+        self.assertEqual(policy.choose('BV1:2', 1 * MB), 80)
+
+    def test_measured_bitrates_scale_estimates(self):
+        policy = self.policy(target_rate=4)
+        # 实测1080P是参考码率的两倍，其他画质按同一比例推算
+        policy.observe(playurl([80, 64, 32, 16], dash={'video': [{'id': 80, 'bandwidth': 6_000_000}], 'audio': []}))
+        self.assertEqual(policy.estimate(64), 3_200_000)
+        self.assertEqual(policy.choose('BV1:1', 1 * MB), 32)
+
+
+class PlayurlQualitiesTest(unittest.TestCase):
+
+    def test_durl_bitrate(self):
+        data = {'data': {'accept_quality': [80, 64], 'quality': 80, 'timelength': 10_000,
+                         'durl': [{'size': 2_500_000}, {'size': 1_250_000}]}}
+        self.assertEqual(playurl_qualities(data), ([80, 64], {80: 3_000_000}))
+
+    def test_dash_adds_audio(self):
+        dash = {'video': [{'id': 80, 'bandwidth': 2_000_000}, {'id': 80, 'bandwidth': 2_500_000}],
+                'audio': [{'bandwidth': 100_000}]}
+        self.assertEqual(playurl_qualities(playurl([80], dash))[1], {80: 2_600_000})
+
+    def test_parse_deadline(self):
+        now = time.mktime((2024, 1, 1, 22, 0, 0, 0, 0, -1))
+        self.assertEqual(parse_deadline('3600', now), now + 3600)
+        self.assertEqual(parse_deadline('23:30', now), now + 5400)
+        self.assertEqual(parse_deadline('21:00', now), now + 23 * 3600)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import socket
+import time
+import unittest
+
+import requests
+
+from bandwidth import DownloadCancelled
+from retry_policy import RetryPolicy, CircuitOpenError, ThrottledError, classify
+
+URL = 'https://upos.example.com/video.flv'
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status} Error", response=response)
+
+
+class ClassifyTest(unittest.TestCase):
+    """只有网络和服务器一侧的错误可以重试，本地磁盘错误和程序错误不重试"""
+
+    def test_status_codes(self):
+        self.assertEqual(classify(http_error(503)), 'server')
+        self.assertEqual(classify(http_error(429)), 'throttled')
+        self.assertEqual(classify(http_error(404)), 'client')
+        # 403只有视频文件请求是下载地址过期，接口请求是没有权限
+        self.assertEqual(classify(http_error(403), media=True), 'expired')
+        self.assertEqual(classify(http_error(403)), 'client')
+
+    def test_network_errors(self):
+        self.assertEqual(classify(requests.Timeout()), 'timeout')
+        self.assertEqual(classify(requests.ConnectionError()), 'reset')
+        self.assertEqual(classify(requests.exceptions.ChunkedEncodingError()), 'reset')
+        self.assertEqual(classify(ConnectionResetError()), 'reset')
+        self.assertEqual(classify(socket.gaierror()), 'reset')
+        self.assertEqual(classify(Exception("文件大小不匹配，可能下载不完整")), 'incomplete')
+
+    def test_local_and_program_errors(self):
+        self.assertEqual(classify(OSError(28, '磁盘已满')), 'local')
+        self.assertEqual(classify(PermissionError()), 'local')
+        self.assertEqual(classify(KeyError('durl')), 'other')
+        policy = RetryPolicy()
+        for category in ('local', 'other', 'client', 'cancelled'):
+            self.assertFalse(policy.should_retry(category))
+        for category in ('timeout', 'reset', 'expired', 'throttled', 'server', 'incomplete'):
+            self.assertTrue(policy.should_retry(category))
+
+    def test_special_errors(self):
+        self.assertEqual(classify(DownloadCancelled('BV1:1')), 'cancelled')
+        self.assertEqual(classify(CircuitOpenError('example.com', 5)), 'circuit_open')
+        self.assertEqual(classify(ThrottledError(-799, '请求过于频繁')), 'throttled')
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    """连续失败threshold次后熔断，冷却后只放行一个试探请求，成功后关闭"""
+
+    def setUp(self):
+        self.policy = RetryPolicy(breaker_threshold=3, breaker_cooldown=0.2)
+
+    def record_failures(self, count, error=None):
+        for _ in range(count):
+            self.policy.record_failure(URL, error or requests.ConnectionError())
+
+    def test_opens_after_threshold(self):
+        self.record_failures(2)
+        self.policy.check(URL)
+        self.record_failures(1)
+        with self.assertRaises(CircuitOpenError):
+            self.policy.check(URL)
+        # 其他主机不受影响
+        self.policy.check('https://cn-gotcha.example.com/video.flv')
+
+    def test_half_open_allows_one_probe(self):
+        self.record_failures(3)
+        time.sleep(0.25)
+        self.policy.check(URL)  # 试探请求
+        with self.assertRaises(CircuitOpenError):
+            self.policy.check(URL)
+        self.policy.record_success(URL)
+        self.policy.check(URL)
+        self.policy.check(URL)
+
+    def test_failed_probe_reopens(self):
+        self.record_failures(3)
+        time.sleep(0.25)
+        self.policy.check(URL)
+        self.record_failures(1)
+        with self.assertRaises(CircuitOpenError):
+            self.policy.check(URL)
+
+    def test_client_errors_do_not_count(self):
+        self.record_failures(5, http_error(404))
+        self.record_failures(5, http_error(403))
+        self.record_failures(5, ThrottledError(-412, '请求被拦截'))
+        self.policy.check(URL)
+
+    def test_call_stops_on_non_retryable(self):
+        calls = []
+
+        def disk_full():
+            calls.append(1)
+            raise OSError(28, '磁盘已满')
+
+        with self.assertRaises(OSError):
+            self.policy.call(disk_full, URL, sleep=lambda delay: None)
+        self.assertEqual(len(calls), 1)
+
+    def test_call_retries_network_errors(self):
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise requests.ConnectionError()
+            return 'ok'
+
+        self.assertEqual(self.policy.call(flaky, URL, sleep=lambda delay: None), 'ok')
+        self.assertEqual(len(calls), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
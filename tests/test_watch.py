@@ -0,0 +1,110 @@
+import os
+import random
+import shutil
+import tempfile
+import time
+import unittest
+
+from manifest import Manifest
+from watch import SyncState, WatchSchedule, diff_pages, parse_interval
+
+
+class DiffPagesTest(unittest.TestCase):
+    """按清单和文件大小把分P分为新增、变化、未变，并找出已经删除的分P"""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.manifest = Manifest(self.folder)
+        for cid in (1, 2, 3):
+            path = self.write(cid, b'x' * 100)
+            self.manifest.put(cid, path, {'size': 100, 'crc32': []})
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, cid, data):
+        path = os.path.join(self.folder, f"{cid:02d}-第{cid}集.mp4")
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def pages(self, *cids):
+        return [{'cid': cid, 'part': f"第{cid}集"} for cid in cids]
+
+    def cids(self, pages):
+        return [page['cid'] for page in pages]
+
+    def test_unchanged(self):
+        diff = diff_pages(self.pages(1, 2, 3), self.manifest)
+        self.assertEqual(self.cids(diff['unchanged']), [1, 2, 3])
+        self.assertEqual(diff['new'] + diff['changed'] + diff['removed'], [])
+
+    def test_new_pages(self):
+        diff = diff_pages(self.pages(1, 2, 3, 4, 5), self.manifest)
+        self.assertEqual(self.cids(diff['new']), [4, 5])
+
+    def test_missing_or_resized_files_changed(self):
+        os.remove(os.path.join(self.folder, '01-第1集.mp4'))
+        self.write(2, b'x' * 50)
+        diff = diff_pages(self.pages(1, 2, 3), self.manifest)
+        self.assertEqual(self.cids(diff['changed']), [1, 2])
+        self.assertEqual(self.cids(diff['unchanged']), [3])
+
+    def test_removed_pages(self):
+        diff = diff_pages(self.pages(1, 3), self.manifest, previous=[1, 2, 3])
+        self.assertEqual(diff['removed'], [2])
+        # 没有上次同步的记录时不报告删除
+        self.assertEqual(diff_pages(self.pages(1, 3), self.manifest)['removed'], [])
+
+
+class SyncStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, '.sync.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_collection_folder_pinned(self):
+        SyncState(self.path).record('BV1', 'downloads/合集-更新至第3集', '合集', [1, 2, 3])
+        state = SyncState(self.path)  # 重新读取文件
+        self.assertEqual(state.folder('BV1'), 'downloads/合集-更新至第3集')
+        self.assertEqual(state.get('BV1')['cids'], [1, 2, 3])
+        self.assertIsNone(state.folder('BV2'))
+
+    def test_single_video_folder_not_pinned(self):
+        state = SyncState(self.path)
+        state.record('BV1', 'downloads', '单个视频', [1], collection=False)
+        self.assertIsNone(state.folder('BV1'))
+
+
+class WatchScheduleTest(unittest.TestCase):
+
+    def test_first_checks_spread_within_jitter(self):
+        start = time.time()
+        schedule = WatchSchedule([f"BV{i}" for i in range(100)], 100, jitter=0.1, rng=random.Random(1))
+        self.assertEqual(len(schedule), 100)
+        self.assertEqual(schedule.due(start - 1), [])
+        self.assertEqual(len(schedule.due(start + 10.01)), 100)
+
+    def test_reschedule_with_jitter(self):
+        schedule = WatchSchedule(['BV1', 'BV1', 'BV2'], 100, jitter=0.1, rng=random.Random(1))
+        self.assertEqual(len(schedule), 2)  # 重复的视频只检查一次
+        now = time.time() + 20
+        keys = schedule.due(now)
+        schedule.reschedule(keys, now)
+        self.assertEqual(schedule.due(now + 89), [])
+        self.assertEqual(sorted(schedule.due(now + 111)), ['BV1', 'BV2'])
+
+    def test_parse_interval(self):
+        self.assertEqual(parse_interval('90'), 90)
+        self.assertEqual(parse_interval('30m'), 1800)
+        self.assertEqual(parse_interval('2h'), 7200)
+        self.assertEqual(parse_interval('1d'), 86400)
+        with self.assertRaises(ValueError):
+            parse_interval('soon')
+
+
+if __name__ == '__main__':
+    unittest.main()
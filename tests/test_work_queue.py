@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from work_queue import WorkQueue, QUEUED, LEASED, COMPLETED, FAILED
+
+
+def task(cid, bvid='BV1'):
+    return {'bvid': bvid, 'cid': cid, 'title': f"第{cid}集", 'path': f"downloads/{cid}.mp4"}
+
+
+class WorkQueueTest(unittest.TestCase):
+    """租约到期后任务交给其他工作进程，过期次数用完后标记失败，异常退出的进程立即放回任务"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.queue = WorkQueue(os.path.join(self.directory, 'tasks.db'), lease_seconds=0.2, max_attempts=2)
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.directory)
+
+    def expire(self):
+        time.sleep(self.queue.lease_seconds + 0.05)
+
+    def test_lease_order_and_duplicates(self):
+        self.assertEqual(self.queue.enqueue_many([task(3), task(1), task(2)]), [True, True, True])
+        self.assertFalse(self.queue.enqueue(task(1)))  # 等待中的任务不重复加入
+        self.assertEqual([self.queue.lease('a')['cid'] for _ in range(3)], [3, 1, 2])
+        self.assertIsNone(self.queue.lease('a'))
+
+    def test_active_lease_is_not_shared(self):
+        self.queue.enqueue(task(1))
+        self.assertEqual(self.queue.lease('a')['task_id'], 'BV1:1')
+        self.assertIsNone(self.queue.lease('b'))
+
+    def test_expired_lease_is_taken_over(self):
+        self.queue.enqueue(task(1))
+        self.queue.lease('a')
+        self.expire()
+        leased = self.queue.lease('b')
+        self.assertEqual((leased['task_id'], leased['attempts']), ('BV1:1', 2))
+        # 原来的进程续约失败，完成记录也不会覆盖新租户
+        self.assertFalse(self.queue.heartbeat('BV1:1', 'a'))
+        self.queue.complete('BV1:1', 'a')
+        self.assertEqual(self.queue.stats()[LEASED], 1)
+        self.queue.complete('BV1:1', 'b')
+        self.assertEqual(self.queue.stats()[COMPLETED], 1)
+
+    def test_heartbeat_keeps_lease(self):
+        self.queue.enqueue(task(1))
+        self.queue.lease('a')
+        for _ in range(3):
+            time.sleep(self.queue.lease_seconds / 2)
+            self.assertTrue(self.queue.heartbeat('BV1:1', 'a'))
+        self.assertIsNone(self.queue.lease('b'))
+
+    def test_repeatedly_expired_task_fails(self):
+        self.queue.enqueue(task(1))
+        self.queue.lease('a')
+        self.expire()
+        self.queue.lease('b')
+        self.expire()
+        self.assertIsNone(self.queue.lease('c'))
+        self.assertEqual(self.queue.stats()[FAILED], 1)
+        self.assertFalse(self.queue.active())
+
+    def test_release_worker(self):
+        self.queue.enqueue_many([task(1), task(2)])
+        self.queue.lease('a')
+        self.queue.lease('b')
+        self.queue.release_worker('a')
+        self.assertEqual(self.queue.stats()[QUEUED], 1)
+        leased = self.queue.lease('c')  # 不必等租约到期
+        self.assertEqual(leased['cid'], 1)
+        self.assertIsNone(self.queue.lease('d'))
+
+    def test_failed_task_requeued_until_attempts_used(self):
+        self.queue.enqueue(task(1))
+        self.queue.lease('a')
+        self.queue.fail('BV1:1', 'a', '连接被重置')
+        self.assertEqual(self.queue.stats()[QUEUED], 1)
+        self.queue.lease('a')
+        self.queue.fail('BV1:1', 'a', '连接被重置')
+        self.assertEqual(self.queue.stats()[FAILED], 1)
+        # 已结束的任务再次加入时重新排队
+        self.assertTrue(self.queue.enqueue(task(1)))
+        self.assertEqual(self.queue.lease('a')['attempts'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
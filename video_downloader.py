@@ -1,16 +1,357 @@
-import requests
 import os
 import json
 import re
-from urllib.parse import urlparse
 import time
+import threading
+import zlib
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http_client import HttpClient
+from metadata_cache import MetadataCache
+from playurl_resolver import PlayurlResolver, streams_deadline
+from mirrors import MirrorSet
+from dash import DashPolicy, parse_dash, track_paths, finish_tracks
+from metrics import MetricsRegistry, host_of
+from manifest import Manifest, file_crc, file_checksum
+from buffer_pool import BufferPool, WriteBehind, read_into
+from bandwidth import BandwidthScheduler, DownloadCancelled, PRIORITY_NORMAL, PRIORITY_BACKGROUND
+from job_store import DOWNLOADING, COMPLETED, SKIPPED, FAILED
+from naming import (NameIndex, PAGE_TEMPLATE, VIDEO_TEMPLATE, clean_name, collection_folder,
+                    page_paths, render, truncate_bytes)
+from retry_policy import RetryPolicy, classify
+from api_limiter import AdaptiveLimiter, throttle_error
+from quality import ThroughputMeter
+from preflight import ORDERS, CollectionProgress, allocated_size, check_disk_space, order_pages
+from watch import SyncState, diff_pages
+from listings import season_pages
 
-class VideoDownloader:
-    def __init__(self):
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Referer': 'https://www.bilibili.com'
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Referer': 'https://www.bilibili.com'
+}
+
+API_BASE = 'https://api.bilibili.com'
+DEFAULT_QUALITY = 80  # 没有画质策略时请求的画质（1080P）
+
+
+class DownloadProgress:
+    """多个分段共享的下载进度，汇总后统一回调"""
+    def __init__(self, total_size, callback=None, retry=0, interval=0.5, downloaded=0):
+        self.total_size = total_size
+        self.callback = callback
+        self.retry = retry
+        self.interval = interval
+        self.downloaded = downloaded  # 断点续传时从已下载的字节数开始
+        self.last_downloaded = downloaded
+        self.last_time = time.time()
+        self.lock = threading.Lock()
+
+    def add(self, size):
+        """累加已下载字节数，每interval秒回调一次"""
+        with self.lock:
+            self.downloaded += size
+            if not self.callback:
+                return
+            current_time = time.time()
+            if current_time - self.last_time < self.interval:
+                return
+            speed = (self.downloaded - self.last_downloaded) / (current_time - self.last_time) / (1024 * 1024)  # MB/s
+            progress = (self.downloaded / self.total_size) * 100 if self.total_size else 0
+            self.last_time = current_time
+            self.last_downloaded = self.downloaded
+            data = {
+                'progress': progress,
+                'total_size': self.total_size / (1024 * 1024),  # MB
+                'downloaded_size': self.downloaded / (1024 * 1024),  # MB
+                'speed': speed,
+                'retry_count': self.retry
+            }
+        self.callback(data)
+
+
+class CombinedProgress:
+    """把多个durl分段各自的进度回调汇总为整个视频的一个进度"""
+    def __init__(self, total_size, callback):
+        self.total_size = total_size  # 字节
+        self.callback = callback
+        self.parts = {}  # 分段序号 -> 最近一次回调的数据
+        self.lock = threading.Lock()
+
+    def part_callback(self, index):
+        """返回第index个分段使用的回调函数"""
+        def callback(data):
+            with self.lock:
+                self.parts[index] = data
+                downloaded = sum(p['downloaded_size'] for p in self.parts.values())
+                total = self.total_size / (1024 * 1024) or sum(p['total_size'] for p in self.parts.values())
+                combined = dict(data)
+                combined.update({
+                    'progress': downloaded / total * 100 if total else 0,
+                    'total_size': total,
+                    'downloaded_size': downloaded,
+                    'speed': sum(p['speed'] for p in self.parts.values() if 'error' not in p)
+                })
+            self.callback(combined)
+        return callback
+
+
+class PartState:
+    """.part文件旁的断点续传状态记录，保存每个字节区间已下载的字节数和这些字节的CRC32"""
+    def __init__(self, path, total_size, ranges, save_interval=1.0):
+        self.path = path
+        self.total_size = total_size
+        self.ranges = ranges  # [[start, end, done, crc], ...]
+        self.save_interval = save_interval
+        self.last_save = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, total_size):
+        """读取状态记录，文件大小变化或记录损坏时返回None"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data['total_size'] != total_size:
+                return None
+            return cls(path, total_size, [list(r) for r in data['ranges']])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def downloaded(self):
+        """已下载的总字节数"""
+        with self.lock:
+            return sum(r[2] for r in self.ranges)
+
+    def pending(self):
+        """尚未下载完成的区间序号"""
+        with self.lock:
+            return [i for i, (start, end, done, crc) in enumerate(self.ranges)
+                    if done < end - start + 1]
+
+    def advance(self, index, data):
+        """记录某个区间新写入的数据，累加CRC32并按间隔落盘"""
+        # 每个区间同一时间只有一个线程写入，CRC在锁外计算
+        crc = zlib.crc32(data, self.ranges[index][3])
+        with self.lock:
+            self.ranges[index][2] += len(data)
+            self.ranges[index][3] = crc
+            if time.time() - self.last_save >= self.save_interval:
+                self._save()
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+    def checksum(self):
+        """下载完成后的校验记录：{'size', 'crc32': [[start, end, crc], ...]}"""
+        with self.lock:
+            return {
+                'size': self.total_size,
+                'crc32': [[start, end, crc] for start, end, done, crc in self.ranges]
+            }
+
+    def _save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'total_size': self.total_size, 'ranges': self.ranges}, f)
+        os.replace(tmp_path, self.path)
+        self.last_save = time.time()
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def parse_playurl(data, dash_policy=None):
+    """解析下载地址接口返回的所有durl分段，返回[{'order', 'size', 'urls'}, ...]
+
+    urls的第一个是主地址，其余是backup_url中的备用镜像。
+    指定dash_policy且接口返回了DASH数据时，返回按策略选出的视频流和音频流（带'kind'字段）。
+    """
+    if data['code'] != 0:
+        raise Exception(f"获取下载地址失败: {data['message']}")
+    if dash_policy is not None and data['data'].get('dash'):
+        return parse_dash(data['data'], dash_policy)
+    streams = []
+    for durl in sorted(data['data']['durl'], key=lambda d: d.get('order', 0)):
+        streams.append({
+            'order': durl.get('order', len(streams) + 1),
+            'size': durl.get('size', 0),
+            'urls': [durl['url']] + list(durl.get('backup_url') or [])
+        })
+    return streams
+
+
+def parse_collection_info(video_info, season=True):
+    """从视频信息判断是否是合集：多P视频，或者（season为True时）视频所属的合集（ugc_season）
+
+    ugc_season合集中每一集是一个单独的视频，pages中的每一项带有自己的bvid。两种下载引擎共用。
+    """
+    if video_info['code'] != 0:
+        raise Exception(f"获取视频信息失败: {video_info['message']}")
+    data = video_info['data']
+    if data['videos'] > 1:  # 是合集
+        return {
+            'is_collection': True,
+            'title': data['title'],
+            'pages': data['pages']
         }
+    if season and data.get('ugc_season'):
+        pages = season_pages(data['ugc_season'])
+        if len(pages) > 1:
+            return {
+                'is_collection': True,
+                'title': data['ugc_season']['title'],
+                'pages': pages,
+                'season_id': data['ugc_season']['id']
+            }
+    return {'is_collection': False}
+
+
+def concat_files(paths, file_path):
+    """按顺序把多个分段文件拼接为一个文件，完成后原子地替换到最终路径，返回最终文件的校验记录"""
+    part_path = file_path + '.part'
+    size = 0
+    crc = 0
+    with open(part_path, 'wb') as out:
+        for path in paths:
+            with open(path, 'rb') as f:
+                while True:
+                    data = f.read(1024 * 1024)
+                    if not data:
+                        break
+                    out.write(data)
+                    crc = zlib.crc32(data, crc)  # 拼接时顺便计算校验值
+                    size += len(data)
+    os.replace(part_path, file_path)
+    for path in paths:
+        os.remove(path)
+    return {'size': size, 'crc32': [[0, size - 1, crc]]}
+
+
+def split_ranges(total_size, segments, min_segment_size):
+    """按分段数和最小分段大小切分字节范围，返回[(start, end), ...]"""
+    count = min(segments, total_size // min_segment_size)
+    count = max(1, count)
+    segment_size = total_size // count
+    ranges = []
+    for i in range(count):
+        start = i * segment_size
+        end = total_size - 1 if i == count - 1 else start + segment_size - 1
+        ranges.append((start, end))
+    return ranges
+
+
+def parse_probe(status_code, headers):
+    """解析Range探测请求的响应，返回(文件大小, 是否支持Range)"""
+    content_range = headers.get('content-range', '')
+    if status_code == 206 and '/' in content_range:
+        total = content_range.rsplit('/', 1)[1]
+        if total.isdigit():
+            return int(total), True
+    return int(headers.get('content-length', 0)), False
+
+
+def prepare_part(file_path, total_size, ranges):
+    """读取.part文件的续传状态，没有可用记录时按ranges新建预分配大小的.part文件"""
+    part_path = file_path + '.part'
+    state_path = part_path + '.json'
+    state = PartState.load(state_path, total_size)
+    if state is not None and os.path.exists(part_path):
+        for r in state.ranges:
+            if len(r) == 3:
+                # 旧版本的记录没有CRC，从已下载的数据补算
+                r.append(file_crc(part_path, r[0], r[2]))
+        return part_path, state
+    
+    state = PartState(state_path, total_size, [[start, end, 0, 0] for start, end in ranges])
+    with open(part_path, 'wb') as f:
+        f.truncate(total_size)
+        if hasattr(os, 'posix_fallocate') and total_size:
+            # 预先分配磁盘空间，空间不足时在下载前就失败，也避免写入时产生碎片
+            os.posix_fallocate(f.fileno(), 0, total_size)
+    state.save()
+    return part_path, state
+
+
+class VideoDownloader:
+    def __init__(self, segments=4, min_segment_size=8 * 1024 * 1024,
+                 connect_timeout=10, read_timeout=30, max_workers=3,
+                 cache_size=256, cache_ttl=600, cache_dir=None, prefetch_count=2,
+                 dash=False, dash_policy=None, api_base=API_BASE, metrics=None,
+                 retry_policy=None, buffer_count=16, bandwidth=None, job_store=None, api_limiter=None,
+                 page_template=PAGE_TEMPLATE, video_template=VIDEO_TEMPLATE, quality_policy=None,
+                 preflight=False, order='list', preflight_workers=8, sync_state=None):
+        self.headers = dict(DEFAULT_HEADERS)
+        self.api_base = api_base  # 接口地址，基准测试时指向本地模拟服务器
+        # 各阶段耗时和计数器，可以添加JSON行或Prometheus输出
+        self.metrics = metrics or MetricsRegistry()
+        # 所有网络请求共用的重试策略：按错误类别退避重试，并对连续失败的主机熔断
+        self.retry_policy = retry_policy or RetryPolicy()
+        # 接口请求的自适应并发上限：被风控限流时减半，请求顺利时逐渐增加
+        self.api_limiter = api_limiter or AdaptiveLimiter()
+        # 分段下载设置：最多同时使用的连接数和每段的最小字节数
+        self.segments = max(1, segments)
+        self.min_segment_size = max(1, min_segment_size)
+        self.block_size = 1024 * 1024  # 1MB
+        # 所有下载共用的缓冲池和后台写线程：网络读取不等待磁盘写入，下载数据占用的内存不超过buffer_count个块
+        self.buffer_pool = BufferPool(buffer_count, self.block_size)
+        self.write_behind = WriteBehind(self.buffer_pool)
+        # 所有传输共用的带宽调度：全局和每个任务的速率上限、优先级、限速时间段
+        self.bandwidth = bandwidth or BandwidthScheduler()
+        # 合集下载时同时下载的分P数量
+        self.max_workers = max(1, max_workers)
+        # DASH模式：分别下载视频流和音频流后合并，不启用时使用传统的durl格式
+        self.dash_policy = (dash_policy or DashPolicy()) if dash else None
+        # 所有请求共用一个带连接池的会话，避免每次请求重新进行TCP+TLS握手
+        self.http = HttpClient(
+            self.headers,
+            pool_size=self.pool_size(),
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout
+        )
+        # 任务记录（job_store.JobStore），崩溃或重启后可以恢复未完成的下载；None表示不记录
+        self.job_store = job_store
+        # 每个下载目录的已完成文件清单，重新运行时跳过已下载且校验通过的文件
+        self.manifests = {}
+        self.manifest_lock = threading.Lock()
+        # 文件名模板（字段见naming.render）和每个目录已分配的文件名，同一目录中重名的文件追加序号
+        self.page_template = page_template
+        self.video_template = video_template
+        self.name_indexes = {}
+        # 画质策略（quality.QualityPolicy）：按实测吞吐量为每个视频选择画质，None表示固定使用DEFAULT_QUALITY
+        self.quality_policy = quality_policy
+        self.throughput = ThroughputMeter()  # 所有下载的总吞吐量
+        self.qualities = {}  # (bvid, cid) -> 选定的画质
+        self.job_qualities = {}  # bvid -> 最近选定的画质，预取后续分P时使用
+        self.requested_qualities = {}  # (bvid, cid) -> 缓存的下载地址请求时的画质
+        self.quality_lock = threading.Lock()
+        # 合集预检：下载前并发获取所有分P的大小，检查磁盘空间并按order排列下载顺序（见preflight.ORDERS）
+        if order not in ORDERS:
+            raise ValueError(f"未知的下载顺序: {order}，可选 {', '.join(ORDERS)}")
+        self.order = order
+        self.preflight = preflight or order != 'list'  # 按大小排序需要先预检
+        self.preflight_workers = max(1, preflight_workers)
+        # 增量同步的记录（watch.SyncState）：同步过的合集固定使用第一次同步时的目录
+        self.sync_state = sync_state or SyncState()
+        # 视频信息缓存，同一个BV号短时间内只请求一次接口
+        self.metadata_cache = MetadataCache(cache_size, cache_ttl, cache_dir)
+        # 下载地址缓存到签名过期前，合集下载时预取后续分P的地址
+        self.playurl_resolver = PlayurlResolver(
+            self.fetch_video_streams,
+            expires_at=streams_deadline,
+            prefetch_count=prefetch_count
+        )
+    
+    def pool_size(self):
+        """每个主机需要的连接数：同时下载的分P数乘以每个文件的分段数，再预留一个给API请求"""
+        return self.max_workers * self.segments + 1
+    
+    def close(self):
+        """释放连接池、预取线程和写线程"""
+        self.playurl_resolver.close()
+        self.http.close()
+        self.write_behind.close()
         
     def extract_video_id(self, url):
         """从URL中提取视频ID"""
@@ -20,120 +361,634 @@ class VideoDownloader:
             return match.group()
         return None
         
-    def get_video_info(self, bvid):
-        """获取视频信息"""
-        api_url = f"https://api.bilibili.com/x/web-interface/view?bvid={bvid}"
-        response = requests.get(api_url, headers=self.headers)
-        return response.json()
+    def get_video_info(self, bvid, use_cache=True):
+        """获取视频信息，成功的结果会被缓存"""
+        if not use_cache:
+            return self.fetch_video_info(bvid)
+        # 错误响应不缓存
+        return self.metadata_cache.get_or_load(
+            bvid, lambda: self.fetch_video_info(bvid), cacheable=lambda info: info.get('code') == 0
+        )
+    
+    def refresh_video_info(self, bvid):
+        """绕过缓存重新获取视频信息，成功时更新缓存，之后的下载直接使用缓存而不再请求接口"""
+        video_info = self.fetch_video_info(bvid)
+        if video_info.get('code') == 0:
+            self.metadata_cache.put(bvid, video_info)
+        return video_info
+
+    def fetch_video_info(self, bvid):
+        """请求视频信息接口"""
+        api_url = f"{self.api_base}/x/web-interface/view?bvid={bvid}"
+        return self.api_get(api_url, 'api_lookup')
+
+    def api_get(self, api_url, phase):
+        """请求接口并解析JSON，超时、限流和服务器错误按重试策略重试
+
+        同时进行的请求数由api_limiter自适应调整，被限流（-412、-799等）时降低并发并暂停。
+        """
+        def request():
+            with self.metrics.timer('phase_seconds', phase='api_wait'):
+                slot = self.api_limiter.slot()
+            with slot, self.metrics.timer('phase_seconds', phase=phase):
+                response = self.http.get(api_url)
+                error = throttle_error(response.status_code, response.headers)
+                if error is None:
+                    response.raise_for_status()
+                    data = response.json()
+                    error = throttle_error(response.status_code, response.headers, data)
+                if error is not None:
+                    slot.throttle(error.retry_after)
+                    self.metrics.inc('throttled_total', phase=phase)
+                    raise error
+                return data
+        return self.retry_policy.call(request, url=api_url, on_retry=self.count_retry, sleep=self.backoff)
+
+    def count_retry(self, attempt, error, delay, media=False):
+        """记录一次重试及其原因，media表示视频文件请求"""
+        print(f"请求失败，{delay:.1f}秒后进行第{attempt + 1}次重试: {str(error)}")
+        self.metrics.inc('retries_total', cause=classify(error, media))
+
+    def backoff(self, delay):
+        """重试前等待，等待时间计入retry_backoff阶段"""
+        with self.metrics.timer('phase_seconds', phase='retry_backoff'):
+            time.sleep(delay)
         
     def get_video_url(self, bvid, cid):
-        """获取视频下载地址"""
-        api_url = f"https://api.bilibili.com/x/player/playurl?bvid={bvid}&cid={cid}&qn=80"
-        response = requests.get(api_url, headers=self.headers)
-        data = response.json()
-        if data['code'] != 0:
-            raise Exception(f"获取下载地址失败: {data['message']}")
-        return data['data']['durl'][0]['url']
+        """获取视频下载地址（第一个分段的主地址）"""
+        return self.get_video_streams(bvid, cid)[0]['urls'][0]
+    
+    def get_video_streams(self, bvid, cid):
+        """获取视频的所有durl分段及其备用镜像，使用未过期的缓存或预取结果
+
+        缓存的地址与当前选定的画质不同时重新获取。
+        """
+        key = (bvid, cid)
+        with self.quality_lock:
+            stale = key in self.requested_qualities and self.requested_qualities[key] != self.quality_for(bvid, cid)
+        if stale:
+            self.playurl_resolver.invalidate(bvid, cid)
+        return self.playurl_resolver.resolve(bvid, cid)
+    
+    def quality_for(self, bvid, cid):
+        """视频选定的画质，没有画质策略时返回None"""
+        return self.qualities.get((bvid, cid), self.job_qualities.get(bvid))
+
+    def playurl_api(self, bvid, cid, quality=None):
+        """下载地址接口的URL，DASH模式下请求dash格式（包含所有画质，按策略选择）"""
+        api_url = f"{self.api_base}/x/player/playurl?bvid={bvid}&cid={cid}"
+        if self.dash_policy is not None:
+            return f"{api_url}&qn=0&fnval=16&fourk=1"
+        return f"{api_url}&qn={quality or DEFAULT_QUALITY}"
+    
+    def fetch_video_streams(self, bvid, cid):
+        """请求下载地址接口，有画质策略时同时记录接口返回的可选画质和码率"""
+        with self.quality_lock:
+            quality = self.quality_for(bvid, cid)
+        data = self.api_get(self.playurl_api(bvid, cid, quality), 'playurl')
+        if self.quality_policy is not None and data.get('code') == 0:
+            self.quality_policy.observe(data)
+        dash_policy = self.dash_policy.capped(quality) if self.dash_policy is not None else None
+        streams = parse_playurl(data, dash_policy)
+        with self.quality_lock:
+            self.requested_qualities[(bvid, cid)] = quality
+        return streams
+
+    def choose_quality(self, bvid, cid):
+        """按画质策略和实测吞吐量为即将下载的视频选择画质"""
+        quality = self.quality_policy.choose(f"{bvid}:{cid}", self.throughput.rate())
+        with self.quality_lock:
+            self.qualities[(bvid, cid)] = quality
+            self.job_qualities[bvid] = quality
+        self.metrics.inc('quality_selected_total', quality=quality)
+        return quality
+
+    def plan_quality(self, bvid, pages):
+        """把将要下载的分P及其时长登记到画质策略，用于按截止时间估算剩余工作量"""
+        if self.quality_policy is not None:
+            for page in pages:
+                self.quality_policy.add(f"{page.get('bvid', bvid)}:{page['cid']}", page.get('duration'))
+
+    def unplan_quality(self, bvid, cid):
+        """登记过的分P不需要下载（已下载过）"""
+        if self.quality_policy is not None:
+            self.quality_policy.discard(f"{bvid}:{cid}")
+
+    def streams_size(self, streams):
+        """下载地址中所有流的总字节数：durl分段带有size，DASH流（或缺少size的分段）用Range请求探测"""
+        return sum(stream.get('size') or self.probe_size(stream['urls'][0])[0] for stream in streams)
+
+    def size_pages(self, video_id, pages, folder):
+        """预检：并发获取合集中未下载分P的下载地址和大小，返回{cid: 字节数}
+
+        获取到的下载地址留在缓存中，开始下载时直接使用；获取失败的分P大小为None，下载时再重试。
+        接口请求的并发由api_limiter控制，被限流时自动放慢。
+        """
+        manifest = self.manifest(folder)
+        pending = [page for page in pages if manifest.get(page['cid']) is None]
         
-    def get_collection_info(self, bvid):
-        """获取合集信息"""
-        video_info = self.get_video_info(bvid)
-        if video_info['code'] != 0:
-            raise Exception(f"获取视频信息失败: {video_info['message']}")
-            
-        data = video_info['data']
-        if data['videos'] > 1:  # 是合集
-            pages = data['pages']
-            collection_title = data['title']
-            return {
-                'is_collection': True,
-                'title': collection_title,
-                'pages': pages
-            }
-        return {'is_collection': False}
+        def size_of(page):
+            try:
+                return self.streams_size(self.get_video_streams(page.get('bvid', video_id), page['cid']))
+            except Exception as e:
+                print(f"获取分P大小失败: {page['part']} - {str(e)}")
+                return None
+        
+        if not pending:
+            return {}
+        with self.metrics.timer('phase_seconds', phase='preflight'):
+            with ThreadPoolExecutor(max_workers=min(len(pending), self.preflight_workers)) as executor:
+                return dict(zip((page['cid'] for page in pending), executor.map(size_of, pending)))
+
+    def refresher(self, bvid, cid):
+        """返回重新获取下载地址的函数：参数是一个流，返回这个流的新地址列表，用于签名过期（403）时"""
+        def refresh(stream):
+            key = 'kind' if 'kind' in stream else 'order'
+            self.playurl_resolver.invalidate(bvid, cid)
+            for fresh in self.get_video_streams(bvid, cid):
+                if fresh.get(key) == stream[key]:
+                    return fresh['urls']
+            return stream['urls']
+        return refresh
+        
+    def get_collection_info(self, bvid, season=True):
+        """获取合集信息：多P视频，或者（season为True时）视频所属的合集（ugc_season）"""
+        return parse_collection_info(self.get_video_info(bvid), season)
     
-    def download_with_progress(self, url, file_path, callback=None, max_retries=3):
-        """带进度的文件下载"""
+    def open_media(self, url, **kwargs):
+        """发起视频文件请求，记录从发出请求到收到响应头的耗时（连接+首字节）"""
+        with self.metrics.timer('phase_seconds', phase='connect', host=host_of(url)):
+            return self.http.get(url, stream=True, **kwargs)
+
+    def mark_failed(self, mirrors, url, error=None):
+        """记录某个镜像的一次失败，同时计入该主机的熔断器；任务被取消不算失败"""
+        if isinstance(error, DownloadCancelled):
+            return
+        mirrors.fail(url)
+        self.retry_policy.record_failure(url, error)
+        self.metrics.inc('failures_total', host=host_of(url))
+
+    def probe_size(self, url):
+        """探测文件大小以及服务器是否支持Range请求"""
+        response = self.open_media(url, headers={'Range': 'bytes=0-0'})
+        try:
+            response.raise_for_status()
+            return parse_probe(response.status_code, response.headers)
+        finally:
+            response.close()
+
+    def probe_mirrors(self, mirrors):
+        """同时探测所有镜像，按响应速度给镜像打分，返回最先成功的探测结果
+
+        不等待其余的探测：卡住的镜像不会拖慢开始下载，它们结束时记为失败，不再被优先选中。
+        """
+        decided = threading.Event()
+
+        def probe(url):
+            start_time = time.time()
+            try:
+                self.retry_policy.check(url)
+                result = self.probe_size(url)
+            except Exception as e:
+                self.mark_failed(mirrors, url, e)
+                raise
+            self.retry_policy.record_success(url)
+            if decided.is_set():
+                # 比最快的镜像慢得多，只在这个文件的镜像中降级，不计入主机熔断
+                mirrors.fail(url)
+            else:
+                # 用首字节时间粗略估计吞吐量，真正下载后会被实测值取代
+                mirrors.record(url, 1, time.time() - start_time)
+            return result
+        
+        urls = mirrors.healthy()
+        if len(urls) == 1:
+            return probe(urls[0])
+        errors = []
+        executor = ThreadPoolExecutor(max_workers=len(urls))
+        try:
+            futures = [executor.submit(probe, url) for url in urls]
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors.append(e)
+                else:
+                    decided.set()
+                    return result
+        finally:
+            executor.shutdown(wait=False)
+        raise errors[0]
+
+    def split_ranges(self, total_size):
+        """按分段数和最小分段大小切分字节范围，返回[(start, end), ...]"""
+        return split_ranges(total_size, self.segments, self.min_segment_size)
+
+    def download_range(self, mirrors, part_path, state, index, progress, first=False, job=None):
+        """下载一个字节区间，当前镜像出错或已熔断时换到其他镜像从断点继续"""
+        # 首轮分段分散到未测速的镜像上竞速，之后都使用最快的镜像
+        url = mirrors.pick(index if first else None)
+        for attempt in range(len(mirrors)):
+            try:
+                self.retry_policy.check(url)
+                self.fetch_range(url, mirrors, part_path, state, index, progress, job)
+                self.retry_policy.record_success(url)
+                return
+            except DownloadCancelled:
+                raise
+            except Exception as e:
+                self.mark_failed(mirrors, url, e)
+                if attempt == len(mirrors) - 1:
+                    raise
+                url = mirrors.pick()
+
+    def fetch_range(self, url, mirrors, part_path, state, index, progress, job=None):
+        """从断点处继续下载一个字节区间，由写线程写入文件中对应的偏移位置"""
+        start, end, done, crc = state.ranges[index]
+        headers = {'Range': f'bytes={start + done}-{end}'}
+        response = self.open_media(url, headers=headers)
+        host = host_of(url)
+        transfer_start = time.perf_counter()
+        writer = None
+        last_time = time.time()
+        
+        def on_read(size):
+            nonlocal last_time
+            self.metrics.inc('bytes_total', size, host=host)
+            progress.add(size)
+            current_time = time.time()
+            mirrors.record(url, size, current_time - last_time)
+            last_time = current_time
+        
+        try:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise Exception(f"分段请求失败，状态码: {response.status_code}")
+            remaining = end - start + 1 - done
+            # 写线程把数据写入文件后才记录进度和CRC
+            writer = self.write_behind.open(part_path, partial(state.advance, index))
+            try:
+                # 最多读取remaining字节，防止服务器多返回数据覆盖下一个分段
+                received = self.pump(response, writer, start + done, remaining, on_read, job)
+            finally:
+                writer.close()
+            writer.check()
+            if received < remaining:
+                raise Exception(f"分段 {start}-{end} 下载不完整")
+        finally:
+            response.close()
+            self.observe_transfer(host, time.perf_counter() - transfer_start, writer.disk_time if writer else 0.0)
+
+    def pump(self, response, writer, offset, limit, on_read, job=None):
+        """把响应数据读入缓冲池的缓冲区，交给写线程从offset开始写入，返回读取的字节数
+
+        limit为None时读到连接结束。缓冲区全部在等待写入时读取暂停，内存占用不超过缓冲池大小；
+        每次读取后向带宽调度器申请配额，超过job或全局的速率上限时等待。
+        """
+        received = 0
+        wait_time = 0.0
+        throttle_time = 0.0  # 每次传输只记录一次，不在每个分块上计时（限速时分块很小）
+        try:
+            while limit is None or received < limit:
+                self.bandwidth.check(job)
+                wait_start = time.perf_counter()
+                buf = self.buffer_pool.acquire()
+                wait_time += time.perf_counter() - wait_start
+                size = len(buf) if limit is None else min(len(buf), limit - received)
+                size = self.bandwidth.chunk_size(job, size)
+                try:
+                    n = read_into(response.raw, buf, size)
+                except BaseException:
+                    self.buffer_pool.release(buf)
+                    raise
+                if not n:
+                    self.buffer_pool.release(buf)
+                    break
+                writer.write(offset + received, buf, n)
+                received += n
+                on_read(n)
+                self.throughput.add(n)
+                throttle_start = time.perf_counter()
+                self.bandwidth.acquire(job, n)
+                throttle_time += time.perf_counter() - throttle_start
+            return received
+        finally:
+            self.metrics.observe('phase_seconds', wait_time, phase='buffer_wait')
+            self.metrics.observe('phase_seconds', throttle_time, phase='throttle')
+
+    def observe_transfer(self, host, seconds, disk_time):
+        """记录一次传输的网络耗时和写线程写入磁盘的耗时（两者同时进行）"""
+        self.metrics.observe('phase_seconds', seconds, phase='transfer', host=host)
+        self.metrics.observe('phase_seconds', disk_time, phase='disk_flush')
+
+    def download_ranges(self, mirrors, part_path, state, progress, job=None):
+        """多连接并行下载所有未完成的区间"""
+        pending = state.pending()
+        if not pending:
+            return
+        try:
+            with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+                futures = [
+                    executor.submit(self.download_range, mirrors, part_path, state, index, progress, True, job)
+                    for index in pending
+                ]
+                for future in futures:
+                    future.result()
+        finally:
+            state.save()  # 无论成功失败都保存进度，供下次续传
+
+    def download_stream(self, url, part_path, progress, job=None):
+        """单连接流式下载（服务器不支持Range时使用，无法续传），返回写入数据的CRC32"""
+        response = self.open_media(url)
+        host = host_of(url)
+        transfer_start = time.perf_counter()
+        writer = None
+        crc = 0
+        
+        def on_written(data):
+            nonlocal crc
+            crc = zlib.crc32(data, crc)  # 写线程按顺序写入，CRC按顺序累加
+        
+        def on_read(size):
+            self.metrics.inc('bytes_total', size, host=host)
+            progress.add(size)
+        
+        try:
+            response.raise_for_status()
+            if not progress.total_size:
+                progress.total_size = int(response.headers.get('content-length', 0))
+            writer = self.write_behind.open(part_path, on_written, truncate=True)
+            try:
+                self.pump(response, writer, 0, None, on_read, job)
+            finally:
+                writer.close()
+            writer.check()
+            return crc
+        finally:
+            response.close()
+            self.observe_transfer(host, time.perf_counter() - transfer_start, writer.disk_time if writer else 0.0)
+
+    def prepare_part(self, file_path, total_size):
+        """读取或新建.part文件的续传状态"""
+        return prepare_part(file_path, total_size, self.split_ranges(total_size))
+
+    def download_with_progress(self, url, file_path, callback=None, max_retries=None, refresh=None, job=None):
+        """带进度的文件下载，写入.part文件，支持Range时分段并行下载并断点续传
+
+        url可以是单个地址，也可以是[主地址, 备用镜像...]列表，出错或较慢时自动切换到更快的镜像。
+        失败时按重试策略退避重试；refresh()返回新的地址列表，在下载地址过期（403）时调用。
+        成功时返回文件的校验记录{'size', 'crc32'}，CRC32在写入数据时逐块计算。
+        job是带宽调度器中的任务，决定这个文件的速率上限和优先级。
+        """
+        max_retries = max_retries or self.retry_policy.max_attempts
+        mirrors = MirrorSet([url] if isinstance(url, str) else url)
+        expired = False
         for retry in range(max_retries):
+            total_size = 0
+            downloaded = 0
+            state = None
             try:
-                response = requests.get(url, headers=self.headers, stream=True)
-                total_size = int(response.headers.get('content-length', 0))
-                block_size = 1024 * 1024  # 1MB
+                if expired:
+                    # 签名过期时重新获取下载地址，已下载的.part文件继续使用
+                    mirrors = MirrorSet(refresh())
+                    expired = False
+                total_size, accept_ranges = self.probe_mirrors(mirrors)
                 
-                start_time = time.time()
-                last_time = start_time
-                downloaded = 0
-                last_downloaded = 0
-                
-                with open(file_path, 'wb') as f:
-                    for data in response.iter_content(block_size):
-                        downloaded += len(data)
-                        f.write(data)
-                        
-                        if callback:
-                            current_time = time.time()
-                            # 每0.5秒更新一次速度
-                            if current_time - last_time >= 0.5:
-                                speed = (downloaded - last_downloaded) / (current_time - last_time) / (1024 * 1024)  # MB/s
-                                progress = (downloaded / total_size) * 100
-                                callback({
-                                    'progress': progress,
-                                    'total_size': total_size / (1024 * 1024),  # MB
-                                    'downloaded_size': downloaded / (1024 * 1024),  # MB
-                                    'speed': speed,
-                                    'retry_count': retry
-                                })
-                                last_time = current_time
-                                last_downloaded = downloaded
+                if accept_ranges and total_size:
+                    part_path, state = self.prepare_part(file_path, total_size)
+                    downloaded = state.downloaded()
+                    progress = DownloadProgress(total_size, callback, retry, downloaded=downloaded)
+                    self.download_ranges(mirrors, part_path, state, progress, job)
+                else:
+                    part_path, state = file_path + '.part', None
+                    progress = DownloadProgress(total_size, callback, retry)
+                    stream_url = mirrors.pick()
+                    try:
+                        self.retry_policy.check(stream_url)
+                        crc = self.download_stream(stream_url, part_path, progress, job)
+                    except Exception as e:
+                        self.mark_failed(mirrors, stream_url, e)
+                        raise
+                    self.retry_policy.record_success(stream_url)
+                    total_size = progress.total_size
                 
-                # 验证文件大小
-                if os.path.getsize(file_path) == total_size:
-                    return True  # 下载成功
+                # 验证下载完整后再原子地替换为最终文件；分段下载的.part文件已预分配，只能按状态记录判断
+                if state is not None:
+                    complete = not state.pending() and state.downloaded() == total_size
                 else:
+                    complete = os.path.getsize(part_path) == total_size
+                if not complete:
                     raise Exception("文件大小不匹配，可能下载不完整")
+                os.replace(part_path, file_path)
+                if state is None:
+                    return {'size': total_size, 'crc32': [[0, total_size - 1, crc]]}
+                state.remove()
+                return state.checksum()  # 下载成功
                 
             except Exception as e:
-                if retry < max_retries - 1:  # 如果还有重试次数
-                    if callback:
-                        callback({
-                            'progress': 0,
-                            'total_size': total_size / (1024 * 1024) if 'total_size' in locals() else 0,
-                            'downloaded_size': 0,
-                            'speed': 0,
-                            'retry_count': retry + 1,
-                            'error': str(e)
-                        })
-                    print(f"下载失败，正在进行第{retry + 1}次重试: {str(e)}")
-                    time.sleep(2)  # 等待2秒后重试
-                    continue
-                else:
-                    raise  # 重试次数用完，抛出异常
+                cause = classify(e, media=True)
+                if retry == max_retries - 1 or not self.retry_policy.should_retry(cause):
+                    raise  # 重试次数用完或错误不可重试，抛出异常
+                expired = cause == 'expired' and refresh is not None
+                delay = self.retry_policy.delay(retry, e, media=True)
+                if callback:
+                    if state is not None:
+                        downloaded = state.downloaded()
+                    callback({
+                        'progress': (downloaded / total_size) * 100 if total_size else 0,
+                        'total_size': total_size / (1024 * 1024),
+                        'downloaded_size': downloaded / (1024 * 1024),
+                        'speed': 0,
+                        'retry_count': retry + 1,
+                        'max_retries': max_retries,
+                        'error': str(e)
+                    })
+                self.count_retry(retry, e, delay, media=True)
+                self.backoff(delay)
         
         return False
     
-    def download_single_video(self, bvid, cid, title, save_path, callback=None, max_retries=3):
-        """下载单个视频"""
+    def download_single_video(self, bvid, cid, title, save_path, callback=None, max_retries=None,
+                              priority=PRIORITY_NORMAL):
+        """下载单个视频，失败时保留.part文件以便下次续传，完成后记入save_path目录的清单
+
+        下载期间在带宽调度器中登记为任务"bvid:cid"，可以用bandwidth.set_job_rate单独限速。
+        """
+        # 清理文件名（调用者通常已经用video_path或page_paths生成了文件名，清理不会改变它）
+        clean_title = truncate_bytes(clean_name(title, str(cid)))
+        if self.quality_policy is not None:
+            quality = self.choose_quality(bvid, cid)
+            if callback:
+                callback({'quality': quality})  # 选定画质时回调一次，没有进度字段
+        streams = self.get_video_streams(bvid, cid)
+        file_path = os.path.join(save_path, f"{clean_title}.mp4")
+        
+        # 确保目录存在
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        
+        refresh = self.refresher(bvid, cid)
+        job = self.bandwidth.job(f"{bvid}:{cid}", priority)
+        self.bandwidth.check(job)
+        if self.job_store is not None:
+            self.job_store.add(job.job_id, bvid, cid, clean_title, file_path, status=DOWNLOADING)
+            callback = self.track_job(job.job_id, callback)
         try:
-            # 清理文件名
-            clean_title = title.replace('\\', '-').replace('/', '-')
-            video_url = self.get_video_url(bvid, cid)
-            file_path = os.path.join(save_path, f"{clean_title}.mp4")
-            
-            # 确保目录存在
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            
-            success = self.download_with_progress(video_url, file_path, callback, max_retries)
-            if success:
-                return file_path
+            if 'kind' in streams[0]:
+                file_path = self.download_dash(streams, file_path, callback, max_retries, refresh, job)
+                # ffmpeg合并后的文件是新写出的内容，只能读一遍计算校验值
+                checksum = file_checksum(file_path)
+            elif len(streams) == 1:
+                checksum = self.download_with_progress(
+                    streams[0]['urls'], file_path, callback, max_retries, partial(refresh, streams[0]), job
+                )
             else:
+                checksum = self.download_streams(streams, file_path, callback, max_retries, refresh, job)
+            if not checksum:
                 raise Exception("下载失败，已达到最大重试次数")
         except Exception as e:
-            if os.path.exists(file_path):
-                try:
-                    os.remove(file_path)  # 删除不完整的文件
-                except:
-                    pass
+            # 下载地址可能已失效，下次重试时重新获取
+            self.playurl_resolver.invalidate(bvid, cid)
+            if self.job_store is not None and not isinstance(e, DownloadCancelled):
+                # 取消的任务保持未完成状态，之后可以恢复
+                self.job_store.finish(job.job_id, FAILED, error=str(e))
             raise
+        finally:
+            self.bandwidth.finish(job)
+            with self.quality_lock:
+                self.qualities.pop((bvid, cid), None)
+                self.requested_qualities.pop((bvid, cid), None)
+        self.manifest(save_path).put(cid, file_path, checksum)
+        if self.job_store is not None:
+            self.job_store.finish(job.job_id, COMPLETED, path=file_path, size=checksum['size'])
+        return file_path
+
+    def track_job(self, job_id, callback):
+        """包装进度回调，同时把已下载字节数、重试次数和错误写入任务记录"""
+        def track(data):
+            if 'progress' in data:
+                self.job_store.progress(job_id, data)
+            if callback:
+                callback(data)
+        return track
+
+    def unfinished_jobs(self):
+        """上次运行中断或尚未开始的顶层任务（单独的视频和合集），没有任务记录时返回空列表"""
+        if self.job_store is None:
+            return []
+        return self.job_store.recover()
+
+    def manifest(self, folder):
+        """目录的下载清单，同一目录的多个工作线程共用一个实例"""
+        key = os.path.abspath(folder)
+        with self.manifest_lock:
+            manifest = self.manifests.get(key)
+            if manifest is None:
+                manifest = self.manifests[key] = Manifest(folder)
+            return manifest
+
+    def name_index(self, folder):
+        """目录的文件名索引，已记入清单的文件保持原来的文件名"""
+        key = os.path.abspath(folder)
+        manifest = self.manifest(folder)
+        with self.manifest_lock:
+            index = self.name_indexes.get(key)
+            if index is None:
+                index = self.name_indexes[key] = NameIndex(folder, manifest.names())
+            return index
+
+    def video_path(self, bvid, cid, title, folder='downloads'):
+        """单个视频的保存路径：按video_template生成文件名，与目录中其他视频重名时追加序号"""
+        stem = render(self.video_template, title=clean_name(title, bvid), bvid=bvid, cid=cid, index='', part='')
+        return self.name_index(folder).claim(cid, stem or bvid)
+
+    def page_paths(self, video_id, collection_info, folder=None):
+        """合集中所有分P的保存路径，按page_template生成，序号位数随分P数量加宽"""
+        folder = folder or self.folder_for(video_id, collection_info['title'])
+        return page_paths(self.name_index(folder), collection_info['pages'], self.page_template,
+                          collection_info['title'], video_id)
+
+    def folder_for(self, video_id, title):
+        """合集的下载目录：同步过的合集使用记录的目录，否则按标题生成"""
+        return self.sync_state.folder(video_id) or collection_folder(title)
+
+    def sync_diff(self, video_id, title, pages, folder, collection=True):
+        """按cid比较视频当前的分P列表和folder中已下载的文件，记录同步状态，返回watch.diff_pages的结果
+
+        上次同步时还是单个视频、现在变成了合集时，先把已下载的文件移到合集目录，不重新下载。
+        """
+        previous = self.sync_state.get(video_id)
+        if collection and previous and not previous.get('collection', True):
+            for page in pages:
+                self.adopt_file(page['cid'], previous['folder'], folder)
+        diff = diff_pages(pages, self.manifest(folder), previous['cids'] if previous else None)
+        self.sync_state.record(video_id, folder, title, [page['cid'] for page in pages], collection)
+        return diff
+
+    def adopt_file(self, cid, source_folder, folder):
+        """把source_folder中已下载的cid连同清单记录移到folder，文件名不变；没有下载过时不做任何事"""
+        source = self.manifest(source_folder)
+        entry = source.get(cid)
+        file_path = source.present(cid)
+        if file_path is None or os.path.abspath(source_folder) == os.path.abspath(folder):
+            return
+        os.makedirs(folder, exist_ok=True)
+        target = os.path.join(folder, os.path.basename(file_path))
+        if os.path.exists(target):
+            return
+        os.replace(file_path, target)
+        self.manifest(folder).put(cid, target, entry)
+        source.remove(cid)
+
+    def find_downloaded(self, cid, folder):
+        """cid已下载完成且文件校验通过时返回文件路径，不发出任何网络请求"""
+        return self.manifest(folder).verify(cid)
+    
+    def download_streams(self, streams, file_path, callback=None, max_retries=None, refresh=None, job=None):
+        """并行下载多个durl分段，全部完成后按顺序拼接为一个文件，返回拼接后文件的校验记录"""
+        progress = CombinedProgress(sum(stream['size'] for stream in streams), callback) if callback else None
+        paths = [f"{file_path}.seg{stream['order']}" for stream in streams]
+        with ThreadPoolExecutor(max_workers=min(len(streams), self.segments)) as executor:
+            # 分段文件只在校验通过后才出现，已存在的分段说明上次已经下载完成
+            futures = [
+                executor.submit(
+                    self.download_with_progress,
+                    stream['urls'],
+                    path,
+                    progress.part_callback(index) if progress else None,
+                    max_retries,
+                    partial(refresh, stream) if refresh else None,
+                    job
+                )
+                for index, (stream, path) in enumerate(zip(streams, paths))
+                if not os.path.exists(path)
+            ]
+            results = [future.result() for future in futures]
+        if not all(results):
+            return False
+        return concat_files(paths, file_path)
+    
+    def download_dash(self, streams, file_path, callback=None, max_retries=None, refresh=None, job=None):
+        """同时下载DASH视频流和音频流，再用ffmpeg直接复制流合并为mp4（没有ffmpeg时保留单独的音视频文件）"""
+        paths = track_paths(file_path)
+        progress = CombinedProgress(0, callback) if callback else None
+        with ThreadPoolExecutor(max_workers=len(streams)) as executor:
+            futures = [
+                executor.submit(
+                    self.download_with_progress,
+                    stream['urls'],
+                    paths[stream['kind']],
+                    progress.part_callback(index) if progress else None,
+                    max_retries,
+                    partial(refresh, stream) if refresh else None,
+                    job
+                )
+                for index, stream in enumerate(streams)
+                if not os.path.exists(paths[stream['kind']])
+            ]
+            results = [future.result() for future in futures]
+        if not all(results):
+            raise Exception("下载失败，已达到最大重试次数")
+        return finish_tracks(paths, file_path, has_audio=len(streams) > 1)
     
     def download_video(self, url, callback=None):
         """下载视频（支持合集）"""
@@ -154,39 +1009,15 @@ class VideoDownloader:
             'info': collection_info
         }
     
-    def download_collection(self, video_id, collection_info, callback=None):
-        """下载整个合集"""
-        # 使用更完整的文件名清理方法
-        def clean_path(name):
-            # 基础清理，处理最基本的非法字符
-            invalid_chars = {
-                '\\': '-', '/': '-', ':': '-', '*': '-', 
-                '?': '-', '"': '-', '<': '-', '>': '-', 
-                '|': '-', '\n': ' ', '\r': ' ', '\t': ' ',
-                '《': '(', '》': ')', '【': '[', '】': ']',
-                '（': '(', '）': ')', '、': '-', '，': ',',
-                '。': '.', '！': '!', '？': '?', '：': '-'
-            }
-            for char, replacement in invalid_chars.items():
-                name = name.replace(char, replacement)
-            # 移除连续的特殊字符和空格
-            while '  ' in name:
-                name = name.replace('  ', ' ')
-            while '--' in name:
-                name = name.replace('--', '-')
-            return name.strip(' .-')
+    def download_collection(self, video_id, collection_info, callback=None, priority=PRIORITY_BACKGROUND):
+        """下载整个合集，最多同时下载max_workers个分P，回调事件中的page_id用于区分各个分P
 
+        清单中已完成且校验通过的分P直接跳过，不发出网络请求；文件损坏的分P重新下载。
+        合集默认以后台优先级下载，全局带宽不够时让位于单独下载的视频。
+        ugc_season合集的分P带有各自的bvid，按各自的视频下载。
+        """
         try:
-            # 清理合集标题
-            clean_collection_title = clean_path(collection_info['title'])
-            if not clean_collection_title:
-                clean_collection_title = "未命名合集"
-            
-            folder_name = os.path.join('downloads', clean_collection_title)
-            
-            # 确保路径长度不超过系统限制
-            if len(folder_name) > 200:
-                folder_name = folder_name[:200]
+            folder_name = self.folder_for(video_id, collection_info['title'])
             
             # 创建目录，使用exist_ok=True避免竞争条件
             try:
@@ -196,82 +1027,165 @@ class VideoDownloader:
             
             total_videos = len(collection_info['pages'])
             failed_videos = []
+            cancelled = []  # 被取消的分P
+            skipped_videos = []
             retry_count = {}  # 记录每个视频的重试次数
+            lock = threading.Lock()  # 保护多个工作线程共享的失败记录
             
-            for index, page in enumerate(collection_info['pages'], 1):
+            pages = collection_info['pages']
+            manifest = self.manifest(folder_name)
+            paths = self.page_paths(video_id, collection_info, folder_name)
+            self.plan_quality(video_id, pages)
+            sizes = {}
+            progress = None
+            if self.preflight:
+                sizes = self.size_pages(video_id, pages, folder_name)
+                # 写入任何数据之前检查剩余空间，已经预分配的.part文件不重复计算
+                needed = sum(
+                    max(0, sizes[page['cid']] - allocated_size(path))
+                    for page, path in zip(pages, paths) if sizes.get(page['cid'])
+                )
+                check_disk_space(folder_name, needed)
+            schedule = order_pages(
+                [(index, page, sizes.get(page['cid'])) for index, page in enumerate(pages, 1)], self.order
+            )
+            if self.preflight and callback:
+                known = {page['cid']: size for _, page, size in schedule if size is not None}
+                progress = CollectionProgress(
+                    known, lambda data: callback('collection_progress', data), self.throughput.rate, self.max_workers
+                )
+                callback('preflight', {
+                    'total_size': sum(known.values()) / (1024 * 1024),
+                    'needed_size': needed / (1024 * 1024),
+                    'unknown': len(sizes) - len(known)
+                })
+            collection_job = f"{video_id}:collection"
+            store = self.job_store
+            if store is not None:
+                # 先登记所有分P，中途崩溃时也知道还有哪些分P没有下载
+                store.add(collection_job, video_id, title=collection_info['title'], path=folder_name,
+                          kind='collection', status=DOWNLOADING)
+                for page, path in zip(pages, paths):
+                    bvid = page.get('bvid', video_id)
+                    store.add(f"{bvid}:{page['cid']}", bvid, page['cid'], page['part'], path, parent=collection_job)
+            
+            def download_page(position, index, page):
+                # 用cid区分并行下载中的各个分P
+                page_id = page['cid']
+                bvid = page.get('bvid', video_id)
+                existing = self.find_downloaded(page_id, folder_name)
+                if existing:
+                    self.unplan_quality(bvid, page_id)
+                    if progress:
+                        progress.finish(page_id)
+                    with lock:
+                        skipped_videos.append(page['part'])
+                    if store is not None:
+                        store.finish(f"{bvid}:{page_id}", SKIPPED, path=existing,
+                                     size=manifest.get(page_id)['size'])
+                    if callback:
+                        callback('video_complete', {
+                            'page_id': page_id,
+                            'title': page['part'],
+                            'status': '已下载',
+                            'path': existing,
+                            'progress': '100%'
+                        })
+                    return
+                # 当前分P下载期间，后台预取即将开始且尚未下载的分P的下载地址
+                ahead = self.max_workers + self.playurl_resolver.prefetch_count
+                upcoming = [p for _, p, _ in schedule[position + 1:position + 1 + ahead]]
+                for p in upcoming:
+                    if manifest.get(p['cid']) is None:
+                        self.playurl_resolver.prefetch(p.get('bvid', video_id), [p['cid']])
                 try:
-                    # 清理视频标题
-                    clean_title = clean_path(page['part'])
-                    if not clean_title:
-                        clean_title = f"视频{index}"
-                    
-                    # 添加序号前缀，确保文件名唯一
-                    file_name = f"{index:02d}-{clean_title}.mp4"
-                    file_path = os.path.join(folder_name, file_name)
-                    
-                    # 确保单个视频的完整路径不超过系统限制
-                    if len(file_path) > 255:  # Windows的MAX_PATH限制
-                        base_path = os.path.dirname(file_path)
-                        ext = os.path.splitext(file_name)[1]
-                        new_name = f"{index:02d}-视频{index}{ext}"
-                        file_path = os.path.join(base_path, new_name)
+                    file_path = paths[index - 1]
                     
                     if callback:
                         callback('new_video', {
+                            'page_id': page_id,
                             'title': page['part'],
                             'status': '下载中',
                             'path': file_path
                         })
                     
-                    max_retries = 3
-                    for retry in range(max_retries):
-                        try:
-                            self.download_single_video(
-                                video_id,
-                                page['cid'],
-                                f"{index:02d}-{clean_title}",
-                                folder_name,
-                                lambda p: callback('progress', p) if callback else None
-                            )
-                            
-                            # 通知UI更新视频状态为完成
+                    def report(p):
+                        # 重试由download_with_progress按重试策略完成，这里只转发重试事件
+                        if 'error' in p:
+                            with lock:
+                                retry_count[page['part']] = p['retry_count']
                             if callback:
-                                callback('video_complete', {
+                                callback('retry', {
+                                    'page_id': page_id,
                                     'title': page['part'],
-                                    'status': '完成',
-                                    'path': file_path,
-                                    'progress': '100%'
+                                    'retry_count': p['retry_count'],
+                                    'max_retries': p['max_retries'],
+                                    'error': p['error']
                                 })
-                            break  # 下载成功，跳出重试循环
-                            
-                        except Exception as e:
-                            retry_count[page['part']] = retry + 1
-                            if retry < max_retries - 1:
-                                if callback:
-                                    callback('retry', {
-                                        'title': page['part'],
-                                        'retry_count': retry + 1,
-                                        'error': str(e)
-                                    })
-                                print(f"下载失败，正在进行第{retry + 1}次重试: {page['part']} - {str(e)}")
-                                time.sleep(2)  # 等待2秒后重试
-                                continue
-                            else:
-                                print(f"下载失败: {page['part']} - {str(e)}")
-                                failed_videos.append(page['part'])
-                                if callback:
-                                    callback('video_failed', {
-                                        'title': page['part'],
-                                        'error': str(e)
-                                    })
+                        if callback:
+                            callback('progress', dict(p, page_id=page_id))
+                        if progress and 'downloaded_size' in p:
+                            progress.update(page_id, p['downloaded_size'] * 1024 * 1024, p['total_size'] * 1024 * 1024)
+                    
+                    try:
+                        self.download_single_video(
+                            bvid,
+                            page['cid'],
+                            os.path.splitext(os.path.basename(file_path))[0],
+                            folder_name,
+                            report,
+                            priority=priority
+                        )
+                        
+                        if progress:
+                            progress.finish(page_id)
+                        # 通知UI更新视频状态为完成
+                        if callback:
+                            callback('video_complete', {
+                                'page_id': page_id,
+                                'title': page['part'],
+                                'status': '完成',
+                                'path': file_path,
+                                'progress': '100%'
+                            })
+                    except Exception as e:
+                        print(f"下载失败: {page['part']} - {str(e)}")
+                        if progress:
+                            progress.drop(page_id)
+                        with lock:
+                            failed_videos.append(page['part'])
+                            if isinstance(e, DownloadCancelled):
+                                cancelled.append(page_id)
+                        if callback:
+                            callback('video_failed', {
+                                'page_id': page_id,
+                                'title': page['part'],
+                                'error': str(e)
+                            })
                 except Exception as e:
                     print(f"处理视频失败: {page['part']} - {str(e)}")
-                    failed_videos.append(page['part'])
-                    continue
+                    with lock:
+                        failed_videos.append(page['part'])
+            
+            # 有界线程池：最多同时下载max_workers个分P
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [
+                    executor.submit(download_page, position, index, page)
+                    for position, (index, page, _) in enumerate(schedule)
+                ]
+                for future in futures:
+                    future.result()
+            
+            if store is not None and not cancelled:  # 取消的合集保持未完成状态，之后可以恢复
+                if failed_videos:
+                    store.finish(collection_job, FAILED, error=f"{len(failed_videos)}个分P下载失败")
+                else:
+                    store.finish(collection_job, COMPLETED)
             
             return {
                 'success': len(collection_info['pages']) - len(failed_videos),
                 'failed': failed_videos,
+                'skipped': skipped_videos,
                 'retry_info': retry_count
             }
         except Exception as e:
@@ -0,0 +1,633 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+from video_downloader import VideoDownloader
+from naming import PAGE_TEMPLATE, VIDEO_TEMPLATE, render
+from metrics import MetricsRegistry, JsonLinesSink, start_prometheus_server
+from bandwidth import BandwidthScheduler, parse_rate, parse_window
+from job_store import JobStore
+from work_queue import WorkQueue, Heartbeat, worker_name
+from quality import QualityPolicy, parse_deadline
+from preflight import ORDERS, allocated_size, check_disk_space, order_pages
+from watch import WatchSchedule, parse_interval
+from listings import ListingResolver
+from naming import collection_folder
+
+
+class JsonLinesReporter:
+    """把下载事件逐行输出为JSON，供其他程序解析；context中的字段附加到每个事件（如工作进程名）"""
+    def __init__(self, stream=None, progress=True, **context):
+        self.stream = stream or sys.stdout
+        self.progress = progress
+        self.context = context
+        self.lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        if event == 'progress' and not self.progress:
+            return
+        fields = dict(event=event, time=round(time.time(), 3), **self.context, **fields)
+        line = json.dumps(fields, ensure_ascii=False)
+        with self.lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+
+def read_inputs(paths):
+    """从文件或标准输入（-）逐行读取视频链接或BV号，忽略空行和#开头的注释"""
+    for path in paths:
+        f = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+        try:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield line
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+class BatchDownloader:
+    """两级流水线：解析线程获取视频信息并拆分为分P任务，经有界队列交给下载线程
+
+    指定work_queue时分P任务不在本进程下载，而是加入共享任务队列，由工作进程（run_worker）下载。
+    sync为True时重新获取视频信息，只下载新增的分P和文件缺失或大小不符的分P（增量同步）。
+    输入可以是UP主空间或合集列表的地址（需要listings），列表分页获取，每获取一页就把其中的视频交给解析线程；
+    seasons为True时属于合集（ugc_season）的视频展开为整个合集；同一个合集只展开一次，列表中的视频不再展开。
+    同一个分P（bvid:cid）在一次运行中只下载一次。
+    """
+    def __init__(self, downloader, reporter, resolvers=4, workers=3, queue_size=100,
+                 max_retries=None, work_queue=None, sync=False, listings=None, seasons=False):
+        self.downloader = downloader
+        self.reporter = reporter
+        self.resolvers = max(1, resolvers)
+        self.workers = max(1, workers)
+        self.max_retries = max_retries
+        self.work_queue = work_queue
+        self.sync = sync
+        self.listings = listings
+        self.seasons = seasons
+        self.pending_ids = queue.Queue(maxsize=max(1, queue_size))
+        self.tasks = queue.Queue(maxsize=max(1, queue_size))  # 队列满时解析线程等待下载线程
+        self.lock = threading.Lock()
+        self.completed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.queued = 0
+        self.resolve_failed = 0
+        self.season_ids = set()  # 已经展开过的合集
+        self.task_keys = set()  # 已经生成下载任务的分P
+
+    def run(self, inputs):
+        """下载所有输入，返回失败的数量"""
+        resolve_threads = [threading.Thread(target=self.resolve_worker, daemon=True)
+                           for _ in range(self.resolvers)]
+        # 队列模式下任务由解析线程直接加入共享队列，不需要下载线程
+        download_threads = [threading.Thread(target=self.download_worker, daemon=True)
+                            for _ in range(self.workers if self.work_queue is None else 0)]
+        for thread in resolve_threads + download_threads:
+            thread.start()
+        
+        # 边读取输入边解析，标准输入不必等到结束才开始下载
+        seen = set()
+        for line in inputs:
+            if self.listings is not None and self.listings.match(line):
+                self.expand(line, seen)
+                continue
+            bvid = self.downloader.extract_video_id(line)
+            if not bvid:
+                self.reporter.emit('invalid', input=line)
+                with self.lock:
+                    self.resolve_failed += 1
+                continue
+            if bvid in seen:
+                continue
+            seen.add(bvid)
+            self.pending_ids.put((bvid, None))
+        
+        # 输入读完后依次给解析线程、下载线程发送结束标记
+        for _ in resolve_threads:
+            self.pending_ids.put(None)
+        for thread in resolve_threads:
+            thread.join()
+        for _ in download_threads:
+            self.tasks.put(None)
+        for thread in download_threads:
+            thread.join()
+        
+        summary = dict(videos=len(seen), completed=self.completed, skipped=self.skipped,
+                       failed=self.failed, resolve_failed=self.resolve_failed)
+        if self.work_queue is not None:
+            summary['queued'] = self.queued
+        self.reporter.emit('summary', **summary)
+        return self.failed + self.resolve_failed
+
+    def expand(self, url, seen):
+        """UP主空间或合集列表：分页获取的同时把每个视频交给解析线程，不等整个列表获取完"""
+        count = 0
+        try:
+            for entry in self.listings.entries(url):
+                count += 1
+                if entry['bvid'] in seen:
+                    continue
+                seen.add(entry['bvid'])
+                self.pending_ids.put((entry['bvid'], entry['folder']))
+        except Exception as e:
+            with self.lock:
+                self.resolve_failed += 1
+            self.reporter.emit('listing_failed', input=url, error=str(e))
+        self.reporter.emit('listing', input=url, videos=count)
+
+    def resolve_worker(self):
+        while True:
+            item = self.pending_ids.get()
+            if item is None:
+                return
+            bvid, folder = item
+            try:
+                tasks = self.resolve(bvid, folder)
+                if self.work_queue is not None:
+                    # 同一个视频的任务由本线程在一个事务中加入，保持预检排好的顺序
+                    self.enqueue(tasks)
+                    continue
+                for task in tasks:
+                    self.tasks.put(task)
+            except Exception as e:
+                with self.lock:
+                    self.resolve_failed += 1
+                self.reporter.emit('resolve_failed', bvid=bvid, error=str(e))
+
+    def resolve(self, bvid, folder=None):
+        """获取视频信息，返回每个分P的下载任务；folder是UP主或合集列表的下载目录
+
+        列表中的视频（folder不为None）不展开为合集：合集列表本身就是合集的每一集，UP主的合集也都在投稿列表中。
+        """
+        if self.sync:
+            video_info = self.downloader.refresh_video_info(bvid)
+        else:
+            video_info = self.downloader.get_video_info(bvid)
+        if video_info['code'] != 0:
+            raise Exception(f"获取视频信息失败: {video_info['message']}")
+        data = video_info['data']
+        # 使用缓存，不再请求接口
+        info = self.downloader.get_collection_info(bvid, season=self.seasons and folder is None)
+        if 'season_id' in info:
+            with self.lock:
+                if info['season_id'] in self.season_ids:
+                    return []  # 同一个合集的另一集已经展开过
+                self.season_ids.add(info['season_id'])
+        if info['is_collection']:
+            title, pages = info['title'], info['pages']
+            # 列表中的多P视频放在列表目录下的子目录中
+            target = collection_folder(title, folder) if folder else self.downloader.folder_for(bvid, title)
+        else:
+            title, pages = data['title'], [{'cid': data['cid'], 'part': data['title'], 'duration': data.get('duration')}]
+            target = folder or 'downloads'
+        self.reporter.emit('resolved', bvid=bvid, title=title, pages=len(pages))
+        todo = {page['cid'] for page in pages}
+        if self.sync:
+            # 先比较再生成路径：第一次同步时记下合集目录，之后标题改变也同步到原来的目录
+            diff = self.downloader.sync_diff(bvid, title, pages, target, collection=info['is_collection'])
+            todo = {page['cid'] for page in diff['new'] + diff['changed']}
+            self.reporter.emit('sync', bvid=bvid, new=len(diff['new']), changed=len(diff['changed']),
+                               unchanged=len(diff['unchanged']), removed=diff['removed'])
+            if not todo:
+                return []
+        
+        if info['is_collection']:
+            paths = self.downloader.page_paths(bvid, info, target)
+        else:
+            paths = [self.downloader.video_path(bvid, data['cid'], data['title'], target)]
+        with self.lock:
+            selected = []
+            for page, path in zip(pages, paths):
+                key = f"{page.get('bvid', bvid)}:{page['cid']}"
+                if page['cid'] in todo and key not in self.task_keys:
+                    self.task_keys.add(key)
+                    selected.append((page, path))
+        if not selected:
+            return []
+        pages, paths = zip(*selected)
+        tasks = [
+            {'bvid': page.get('bvid', bvid), 'cid': page['cid'], 'title': page['part'], 'path': path}
+            for page, path in zip(pages, paths)
+        ]
+        if self.work_queue is None:
+            # 队列模式下由工作进程下载，各进程的画质策略只按自己的吞吐量选择
+            self.downloader.plan_quality(bvid, pages)
+        if info['is_collection'] and self.downloader.preflight:
+            tasks = self.preflight(bvid, pages, tasks)
+        return tasks
+
+    def preflight(self, bvid, pages, tasks):
+        """获取合集所有分P的大小，检查磁盘空间，按下载器的order排列任务"""
+        folder = os.path.dirname(tasks[0]['path'])
+        sizes = self.downloader.size_pages(bvid, pages, folder)
+        needed = sum(
+            max(0, sizes[task['cid']] - allocated_size(task['path']))
+            for task in tasks if sizes.get(task['cid'])
+        )
+        check_disk_space(folder, needed)
+        known = [size for size in sizes.values() if size is not None]
+        self.reporter.emit('preflight', bvid=bvid, total_mb=round(sum(known) / (1024 * 1024), 2),
+                           needed_mb=round(needed / (1024 * 1024), 2), unknown=len(sizes) - len(known))
+        ordered = order_pages([(index, task, sizes.get(task['cid'])) for index, task in enumerate(tasks)],
+                              self.downloader.order)
+        return [task for _, task, _ in ordered]
+
+    def download_worker(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            self.download(task)
+
+    def enqueue(self, tasks):
+        if not tasks:
+            return
+        try:
+            added = self.work_queue.enqueue_many(tasks)
+        except Exception as e:
+            with self.lock:
+                self.failed += len(tasks)
+            for task in tasks:
+                self.reporter.emit('failed', bvid=task['bvid'], cid=task['cid'], error=f"加入任务队列失败: {e}")
+            return
+        for task, ok in zip(tasks, added):
+            if ok:
+                with self.lock:
+                    self.queued += 1
+                self.reporter.emit('queued', bvid=task['bvid'], cid=task['cid'], path=task['path'])
+
+    def download(self, task):
+        """下载一个分P任务，返回错误信息，完成或跳过时返回None"""
+        bvid, cid = task['bvid'], task['cid']
+        folder, file_name = os.path.split(task['path'])
+        # 清单中已完成且校验通过的文件不再下载
+        existing = self.downloader.find_downloaded(cid, folder)
+        if existing:
+            self.downloader.unplan_quality(bvid, cid)
+            with self.lock:
+                self.skipped += 1
+            self.reporter.emit('skipped', bvid=bvid, cid=cid, path=existing)
+            return None
+        self.reporter.emit('start', bvid=bvid, cid=cid, title=task['title'], path=task['path'])
+        
+        def callback(data):
+            if 'quality' in data:
+                self.reporter.emit('quality', bvid=bvid, cid=cid, quality=data['quality'])
+                return
+            self.reporter.emit(
+                'progress', bvid=bvid, cid=cid,
+                progress=round(data['progress'], 2),
+                downloaded_mb=round(data['downloaded_size'], 2),
+                total_mb=round(data['total_size'], 2),
+                speed_mbps=round(data['speed'], 2),
+                retry=data.get('retry_count', 0)
+            )
+        
+        try:
+            path = self.downloader.download_single_video(
+                bvid, cid, os.path.splitext(file_name)[0], folder, callback, self.max_retries
+            )
+            with self.lock:
+                self.completed += 1
+            self.reporter.emit('complete', bvid=bvid, cid=cid, path=path)
+            return None
+        except Exception as e:
+            with self.lock:
+                self.failed += 1
+            self.reporter.emit('failed', bvid=bvid, cid=cid, error=str(e))
+            return str(e) or type(e).__name__
+
+
+def build_quality_policy(args):
+    """设置了截止时间或目标速度时按吞吐量自动选择画质，否则使用默认画质（1080P）"""
+    if args.deadline is None and args.target_rate is None:
+        return None
+    return QualityPolicy(
+        deadline=parse_deadline(args.deadline) if args.deadline else None,
+        target_rate=args.target_rate,
+        max_quality=args.max_quality,
+        min_quality=args.min_quality
+    )
+
+
+def build_listings(args, downloader):
+    return ListingResolver(downloader, workers=args.listing_workers, rate=args.listing_rate)
+
+
+def build_downloader(args, metrics):
+    return VideoDownloader(
+        segments=args.segments,
+        max_workers=args.workers,
+        cache_dir=args.cache_dir,
+        dash=args.dash,
+        metrics=metrics,
+        bandwidth=BandwidthScheduler(args.limit_rate, args.job_rate, args.limit_window),
+        job_store=JobStore(args.job_db) if args.job_db else None,
+        page_template=args.page_template,
+        video_template=args.video_template,
+        quality_policy=build_quality_policy(args),
+        preflight=args.preflight,
+        order=args.order
+    )
+
+
+def close_downloader(downloader):
+    downloader.close()
+    if downloader.job_store is not None:
+        downloader.job_store.close()
+
+
+def work_loop(batch, work_queue, worker, poll=1.0):
+    """工作进程中的一个下载线程：反复租用任务，用正常的下载流程下载，直到队列中没有等待或下载中的任务"""
+    while True:
+        task = work_queue.lease(worker)
+        if task is None:
+            if not work_queue.active():
+                return
+            time.sleep(poll)  # 其他进程正在下载的任务可能因租约过期重新分配
+            continue
+        with Heartbeat(work_queue, task['task_id'], worker):
+            error = batch.download(task)
+        if error is None:
+            work_queue.complete(task['task_id'], worker)
+        else:
+            work_queue.fail(task['task_id'], worker, error)
+
+
+def run_worker(args, slot=0):
+    """工作进程入口：每个进程有自己的VideoDownloader，用args.workers个线程下载共享队列中的任务
+
+    第slot个工作进程的Prometheus接口使用 --metrics-port + 1 + slot 端口。
+    """
+    sys.stdout = sys.stderr  # 与主进程一样，标准输出只保留JSON行
+    metrics = MetricsRegistry()
+    if args.metrics_jsonl:
+        metrics.add_sink(JsonLinesSink(args.metrics_jsonl))
+    if args.metrics_port:
+        start_prometheus_server(metrics, args.metrics_port + 1 + slot)
+    worker = worker_name()
+    downloader = build_downloader(args, metrics)
+    reporter = JsonLinesReporter(sys.__stdout__, progress=not args.no_progress, worker=worker)
+    batch = BatchDownloader(downloader, reporter, workers=args.workers, max_retries=args.retries)
+    work_queue = WorkQueue(args.queue, lease_seconds=args.lease)
+    threads = [threading.Thread(target=work_loop, args=(batch, work_queue, worker), daemon=True)
+               for _ in range(batch.workers)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        pass  # 主进程负责把未完成的任务放回队列
+    finally:
+        close_downloader(downloader)
+        work_queue.close()
+        metrics.flush()
+
+
+def run_workers(args, work_queue, reporter):
+    """启动args.processes个工作进程并等待它们结束
+
+    工作进程异常退出时立即把它持有的任务放回队列，并在队列还有任务时启动新的进程代替它。
+    其他机器上的工作进程崩溃时，它的任务在租约到期后重新分配。
+    """
+    host = socket.gethostname()
+    processes = {}  # slot -> Process
+    restarts = 0
+
+    def start(slot):
+        process = multiprocessing.Process(target=run_worker, args=(args, slot))
+        process.start()
+        processes[slot] = process
+        reporter.emit('worker_started', worker=f"{host}:{process.pid}")
+
+    for slot in range(args.processes):
+        start(slot)
+    try:
+        while processes:
+            multiprocessing.connection.wait([process.sentinel for process in processes.values()])
+            for slot, process in list(processes.items()):
+                if process.is_alive():
+                    continue
+                process.join()
+                del processes[slot]
+                if process.exitcode == 0:
+                    continue
+                worker = f"{host}:{process.pid}"
+                work_queue.release_worker(worker)
+                reporter.emit('worker_died', worker=worker, exitcode=process.exitcode)
+                if work_queue.active() and restarts < args.processes * 3:
+                    restarts += 1
+                    start(slot)
+    except KeyboardInterrupt:
+        for process in processes.values():
+            process.join()
+            work_queue.release_worker(f"{host}:{process.pid}")
+        raise
+
+
+def run_queue(args):
+    """--queue模式：把输入解析为分P任务加入共享队列，再启动工作进程下载队列中的任务"""
+    work_queue = WorkQueue(args.queue, lease_seconds=args.lease)
+    reporter = JsonLinesReporter(sys.stdout, progress=not args.no_progress)
+    sys.stdout = sys.stderr
+    failures = 0
+    try:
+        if args.inputs or args.resume:
+            downloader = build_downloader(args, MetricsRegistry())
+            batch = BatchDownloader(
+                downloader, reporter,
+                resolvers=args.resolvers,
+                queue_size=args.queue_size,
+                work_queue=work_queue,
+                sync=args.sync,
+                listings=build_listings(args, downloader),
+                seasons=args.season
+            )
+            resumed = [job['bvid'] for job in downloader.unfinished_jobs()] if args.resume else []
+            try:
+                failures = batch.run(itertools.chain(resumed, read_inputs(args.inputs)))
+            finally:
+                close_downloader(downloader)  # 工作进程各自创建下载器
+        if args.processes:
+            run_workers(args, work_queue, reporter)
+            stats = work_queue.stats()
+            reporter.emit('queue_summary', **stats)
+            failures += stats['failed']
+    except KeyboardInterrupt:
+        reporter.emit('interrupted')
+        return 130
+    finally:
+        work_queue.close()
+    return 1 if failures else 0
+
+
+def run_watch(args, downloader, reporter):
+    """--watch模式：定期增量同步输入中的所有视频，每轮只下载新增或文件缺失的分P，直到被中断
+
+    每个视频按自己的时间表检查（--interval，加±--jitter的随机抖动）；没有变化的视频每次只请求一次视频信息接口。
+    UP主空间和合集列表每次检查时重新获取列表，列表中的每个视频各请求一次视频信息。
+    """
+    listings = build_listings(args, downloader)
+    inputs = []
+    for line in read_inputs(args.inputs):
+        if listings.match(line) or downloader.extract_video_id(line):
+            inputs.append(line)
+        else:
+            reporter.emit('invalid', input=line)
+    schedule = WatchSchedule(inputs, args.interval, args.jitter)
+    reporter.emit('watch', videos=len(schedule), interval=args.interval, jitter=args.jitter)
+    while True:
+        due = schedule.wait()
+        if not due:
+            return 0
+        batch = BatchDownloader(
+            downloader, reporter,
+            resolvers=args.resolvers,
+            workers=args.workers,
+            queue_size=args.queue_size,
+            max_retries=args.retries,
+            sync=True,
+            listings=listings,
+            seasons=args.season
+        )
+        batch.run(due)
+        schedule.reschedule(due)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Bilibili视频批量下载（命令行版）")
+    parser.add_argument('inputs', nargs='*',
+                        help="包含视频链接或BV号的文件，每行一个；- 表示标准输入（默认）")
+    parser.add_argument('--resolvers', type=int, default=4, help="同时获取视频信息的线程数")
+    parser.add_argument('--workers', type=int, default=3, help="同时下载的视频数")
+    parser.add_argument('--queue-size', type=int, default=100, help="解析与下载之间的任务队列长度")
+    parser.add_argument('--segments', type=int, default=4, help="每个文件的分段并行连接数")
+    parser.add_argument('--retries', type=int, default=None, help="每个文件的最大尝试次数，默认使用重试策略的设置")
+    parser.add_argument('--dash', action='store_true', help="使用DASH格式下载并合并音视频")
+    parser.add_argument('--page-template', default=PAGE_TEMPLATE,
+                        help="合集分P的文件名模板，字段：{index} {part} {title} {bvid} {cid}")
+    parser.add_argument('--video-template', default=VIDEO_TEMPLATE, help="单个视频的文件名模板，字段同上")
+    parser.add_argument('--deadline', help="所有视频的完成时间，例如 23:30 或秒数 3600；按实测速度自动降低画质以按时完成")
+    parser.add_argument('--target-rate', type=float,
+                        help="下载速度至少为播放速度的多少倍，例如 4；按实测速度选择满足要求的最高画质")
+    parser.add_argument('--max-quality', type=int, default=80, help="自动选择画质时的最高画质代码（qn），默认80即1080P")
+    parser.add_argument('--min-quality', type=int, default=16, help="自动选择画质时的最低画质代码（qn），默认16即360P")
+    parser.add_argument('--preflight', action='store_true',
+                        help="下载合集前获取所有分P的大小并检查磁盘空间，空间不足时不下载该合集")
+    parser.add_argument('--order', choices=ORDERS, default='list',
+                        help="合集分P的下载顺序：list按分P顺序，largest先下大文件（总耗时最短），smallest先下小文件；"
+                             "按大小排序时自动预检")
+    parser.add_argument('--season', action='store_true',
+                        help="视频属于合集（ugc_season）时下载整个合集；输入也可以是UP主空间或合集列表的地址")
+    parser.add_argument('--listing-workers', type=int, default=4, help="同时获取UP主或合集列表的页数")
+    parser.add_argument('--listing-rate', type=float, default=5.0, help="获取每个列表时每秒最多请求的页数")
+    parser.add_argument('--sync', action='store_true',
+                        help="增量同步：重新获取视频信息，只下载新增的分P和文件缺失或大小不符的分P")
+    parser.add_argument('--watch', action='store_true',
+                        help="持续跟踪输入中的视频，按--interval定期增量同步，直到Ctrl+C")
+    parser.add_argument('--interval', type=parse_interval, default=3600,
+                        help="--watch模式下每个视频的检查间隔，例如 30m、2h，默认1小时")
+    parser.add_argument('--jitter', type=float, default=0.1,
+                        help="检查间隔的随机抖动比例，默认0.1即±10%%，避免所有请求集中在同一时刻")
+    parser.add_argument('--cache-dir', help="视频信息的磁盘缓存目录")
+    parser.add_argument('--limit-rate', type=parse_rate, help="全局下载速率上限，例如 2M、500K")
+    parser.add_argument('--job-rate', type=parse_rate, help="每个视频的下载速率上限")
+    parser.add_argument('--limit-window', type=parse_window, action='append', default=[],
+                        help="时间段内的全局速率上限，例如 09:00-18:00=1M，可以重复指定")
+    parser.add_argument('--job-db', help="把任务状态记录到该SQLite文件，中断后可以用--resume继续")
+    parser.add_argument('--resume', action='store_true', help="先继续--job-db中上次未完成的下载")
+    parser.add_argument('--queue', help="共享任务队列（SQLite文件）：分P任务加入队列，由工作进程下载；"
+                                            "多台机器可以共用共享目录中的同一个队列")
+    parser.add_argument('--processes', type=int, help="--queue模式下启动的工作进程数（默认1），0表示只把任务加入队列；"
+                                                     "--workers为每个进程的下载线程数")
+    parser.add_argument('--lease', type=float, default=60, help="任务租约的秒数，工作进程停止续约超过该时间后任务重新分配")
+    parser.add_argument('--no-progress', action='store_true', help="不输出progress事件")
+    parser.add_argument('--metrics-jsonl', help="把各阶段耗时和指标快照追加到JSON行文件")
+    parser.add_argument('--metrics-port', type=int, help="在该端口提供Prometheus格式的 /metrics 接口")
+    args = parser.parse_args(argv)
+    if args.resume and not args.job_db:
+        parser.error("--resume 需要同时指定 --job-db")
+    for option in ('page_template', 'video_template'):
+        try:
+            render(getattr(args, option), index='01', part='', title='', bvid='', cid=0)
+        except (KeyError, IndexError, ValueError) as e:
+            parser.error(f"--{option.replace('_', '-')} 模板无效: {e}")
+    if args.deadline is not None:
+        try:
+            parse_deadline(args.deadline)
+        except ValueError as e:
+            parser.error(f"--deadline 格式无效: {e}")
+    if args.min_quality > args.max_quality:
+        parser.error("--min-quality 不能大于 --max-quality")
+    if args.watch and args.queue:
+        parser.error("--watch 不能与 --queue 同时使用")
+    if not 0 <= args.jitter <= 1:
+        parser.error("--jitter 应在0到1之间")
+    if args.processes is not None and not args.queue:
+        parser.error("--processes 需要同时指定 --queue")
+    if args.processes is None:
+        args.processes = 1
+    if not args.inputs:
+        # 队列模式下没有输入时只下载队列中已有的任务，需要读取标准输入时显式指定 -
+        args.inputs = [] if args.resume or args.queue else ['-']
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.queue:
+        return run_queue(args)
+    metrics = MetricsRegistry()
+    if args.metrics_jsonl:
+        metrics.add_sink(JsonLinesSink(args.metrics_jsonl))
+    if args.metrics_port:
+        start_prometheus_server(metrics, args.metrics_port)
+    downloader = build_downloader(args, metrics)
+    reporter = JsonLinesReporter(sys.stdout, progress=not args.no_progress)
+    # 标准输出只保留JSON行，下载器中的print日志改为输出到标准错误
+    sys.stdout = sys.stderr
+    if args.watch:
+        try:
+            return run_watch(args, downloader, reporter)
+        except KeyboardInterrupt:
+            reporter.emit('interrupted')
+            return 130
+        finally:
+            close_downloader(downloader)
+            metrics.flush()
+    batch = BatchDownloader(
+        downloader, reporter,
+        resolvers=args.resolvers,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        max_retries=args.retries,
+        sync=args.sync,
+        listings=build_listings(args, downloader),
+        seasons=args.season
+    )
+    # 上次未完成的视频重新解析后下载：已完成的分P按清单跳过，未完成的文件从断点续传
+    resumed = [job['bvid'] for job in downloader.unfinished_jobs()] if args.resume else []
+    try:
+        failures = batch.run(itertools.chain(resumed, read_inputs(args.inputs)))
+    except KeyboardInterrupt:
+        reporter.emit('interrupted')
+        return 130
+    finally:
+        close_downloader(downloader)
+        metrics.flush()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
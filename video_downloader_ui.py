@@ -3,12 +3,20 @@ from tkinter import ttk
 import ttkbootstrap as ttk
 from ttkbootstrap.constants import *
 import threading
+import queue
 import requests
 from PIL import Image, ImageTk
 import os
 from video_downloader import VideoDownloader
+from naming import clean_name
+from preflight import format_eta
+from bandwidth import PRIORITY_INTERACTIVE
+from job_store import JobStore, QUEUED, DOWNLOADING, COMPLETED, SKIPPED, FAILED
 from tkinter import messagebox
 
+# 任务记录中的状态在下载列表中的显示文字
+STATUS_TEXT = {QUEUED: "等待中", DOWNLOADING: "下载中", COMPLETED: "完成", SKIPPED: "已下载", FAILED: "失败"}
+
 class VideoDownloaderUI:
     def __init__(self, root):
         self.root = root
@@ -51,7 +59,10 @@ class VideoDownloaderUI:
                                             variable=self.shutdown_var)
         self.shutdown_check.pack(pady=5)
         
-        self.downloader = VideoDownloader()
+        # 任务记录保存在SQLite中，崩溃、断电或自动关机后可以继续未完成的下载
+        self.job_store = JobStore(os.path.join('downloads', 'jobs.db'))
+        # 合集下载前预检大小：空间不足时不开始下载，合集的下载记录显示整体进度和剩余时间
+        self.downloader = VideoDownloader(job_store=self.job_store, preflight=True)
         
         # 修改下载列表的创建
         self.download_list = ttk.Treeview(
@@ -72,59 +83,102 @@ class VideoDownloaderUI:
         
         # 添加滚动条
         scrollbar = ttk.Scrollbar(self.list_frame, orient="vertical", command=self.download_list.yview)
-        self.download_list.configure(yscrollcommand=scrollbar.set)
+        self.download_list.configure(yscrollcommand=lambda first, last: self.on_list_scroll(scrollbar, first, last))
         
         self.download_list.pack(side=LEFT, fill=BOTH, expand=True, padx=5, pady=5)
         scrollbar.pack(side=RIGHT, fill=Y)
         
-        # 添加一个字典来跟踪下载项
+        # 下载项按任务ID跟踪：job_id -> 列表项ID，job_id -> 当前显示的各列值
         self.download_items = {}
+        self.item_values = {}
+        # 历史记录分页读取：已读取的记录数，每页的记录数，是否还有更多记录
+        self.history_offset = 0
+        self.history_page = 50
+        self.history_more = True
+        self.history_rows = 0  # 列表顶部历史记录的行数，本次运行新增的下载排在它们后面
+        
+        # 下载线程只往队列里放事件，由Tk主循环定时取出并统一刷新界面
+        self.events = queue.SimpleQueue()
+        self.tick_ms = 100
+        self.root.after(self.tick_ms, self.drain_events)
+        
+        self.load_history()
+        # 界面显示后在后台继续上次未完成的下载
+        self.root.after(500, self.resume_unfinished)
+        
+    def job_id(self, bvid, cid):
+        """下载任务的稳定ID，不受标题重复的影响"""
+        return f"{bvid}:{cid}"
+
+    def post(self, type, data=None):
+        """下载线程调用：把界面更新事件放入队列"""
+        self.events.put((type, data))
+
+    def call_in_main(self, func, *args):
+        """下载线程调用：在主线程中执行func并等待返回值（用于弹出对话框）"""
+        done = threading.Event()
+        result = {}
+        def call():
+            try:
+                result['value'] = func(*args)
+            finally:
+                done.set()
+        self.post('call', call)
+        done.wait()
+        return result.get('value')
+
+    def drain_events(self):
+        """主线程定时执行：取出所有事件，每个任务的多个进度事件只刷新最后一个"""
+        events = []
+        try:
+            while True:
+                events.append(self.events.get_nowait())
+        except queue.Empty:
+            pass
         
-    def clean_filename(self, filename):
-        """清理文件名，移除或替换非法字符"""
-        # Windows文件系统中的非法字符和其他需要处理的特殊字符
-        invalid_chars = {
-            '\\': '-', '/': '-', ':': '-', '*': '-', 
-            '?': '-', '"': '-', '<': '-', '>': '-', 
-            '|': '-', '\n': ' ', '\r': ' ', '\t': ' ',
-            '《': '(', '》': ')', '【': '[', '】': ']',
-            '（': '(', '）': ')', '、': '-', '，': ',',
-            '。': '.', '！': '!', '？': '?', '：': '-',
-            '；': ';', '"': '"', '"': '"', ''': "'",
-            ''': "'", '「': '[', '」': ']', '『': '[',
-            '』': ']', '〈': '<', '〉': '>', '…': '-',
-            '—': '-', '～': '~', '·': '-', '￥': '$',
-            '％': '%', '＃': '#', '＆': '&', '＊': '*',
-            '＋': '+', '－': '-', '／': '/', '＝': '=',
-            '＠': '@', '＼': '\\', '＾': '^', '｜': '|',
-            '～': '~'
-        }
-        
-        # 替换所有特殊字符
-        for char, replacement in invalid_chars.items():
-            filename = filename.replace(char, replacement)
-        
-        # 移除连续的空格和特殊字符
-        while '  ' in filename:
-            filename = filename.replace('  ', ' ')
-        while '--' in filename:
-            filename = filename.replace('--', '-')
-        
-        # 移除首尾空格、点和特殊字符
-        filename = filename.strip(' .-')
-        
-        # 如果文件名为空，使用默认名称
-        if not filename:
-            filename = "video"
-        
-        # 限制文件名长度（Windows最大路径长度限制）
-        if len(filename) > 200:
-            # 保留扩展名
-            name, ext = os.path.splitext(filename)
-            filename = name[:196] + ext if ext else name[:200]
-        
-        return filename
+        # 找出每个任务最后一个进度事件的位置，之前的进度事件直接丢弃
+        last_progress = {}
+        for index, (type, data) in enumerate(events):
+            if type == 'progress':
+                last_progress[data.get('job_id')] = index
+        last_bar = max(last_progress.values(), default=-1)
         
+        for index, (type, data) in enumerate(events):
+            if type == 'progress' and last_progress[data.get('job_id')] != index:
+                continue
+            try:
+                self.handle_event(type, data, update_bar=(index == last_bar))
+            except Exception as e:
+                print(f"更新界面失败: {str(e)}")
+        self.root.after(self.tick_ms, self.drain_events)
+
+    def handle_event(self, type, data, update_bar=True):
+        """主线程中处理一个界面事件"""
+        if type == 'progress':
+            if 'quality' in data:
+                self.update_status(f"画质: {data['quality']}")
+                return
+            if update_bar:
+                self.update_progress(data)
+                if data.get('retry_count', 0) > 0:
+                    self.update_status(f"第{data['retry_count']}次重试下载中...")
+            if data.get('job_id'):
+                self.update_download_progress(data['job_id'], data)
+        elif type == 'status':
+            self.update_status(data)
+        elif type == 'record':
+            self.add_download_record(**data)
+        elif type == 'remove':
+            if data in self.download_items:
+                self.download_list.delete(self.download_items.pop(data))
+                self.item_values.pop(data, None)
+        elif type == 'button':
+            self.download_btn["state"] = data
+        elif type == 'reset_bar':
+            self.progress_bar["value"] = 0
+        elif type == 'call':
+            data()
+
     def update_progress(self, data):
         """更新进度条和状态标签"""
         progress = data['progress']
@@ -138,94 +192,139 @@ class VideoDownloaderUI:
             f"({downloaded_size:.1f}MB/{total_size:.1f}MB) "
             f"- {speed:.1f}MB/s"
         )
-        self.root.update_idletasks()
         
     def update_status(self, text):
         """更新状态标签"""
         self.status_label["text"] = text
-        self.root.update_idletasks()
         
-    def update_download_progress(self, title, data):
+    def update_download_progress(self, job_id, data):
         """更新下载列表中的进度"""
-        if title in self.download_items:
-            item_id = self.download_items[title]
-            current_values = list(self.download_list.item(item_id)['values'])
+        if job_id in self.download_items:
             progress = data['progress']
             downloaded_size = data.get('downloaded_size', 0)
             total_size = data.get('total_size', 0)
             speed = data.get('speed', 0)
             
-            current_values[1] = (
+            values = self.item_values[job_id]
+            values[1] = (
                 f"{progress:.1f}% "
                 f"({downloaded_size:.1f}MB/{total_size:.1f}MB) "
                 f"- {speed:.1f}MB/s"
             )
-            current_values[2] = "下载中"
-            self.download_list.item(item_id, values=current_values)
-            self.download_list.see(item_id)
+            values[2] = "下载中"
+            self.download_list.item(self.download_items[job_id], values=values)
+
+    def on_list_scroll(self, scrollbar, first, last):
+        """下载列表滚动到底部时读取下一页历史记录"""
+        scrollbar.set(first, last)
+        if float(last) >= 1.0 and self.history_more:
+            self.root.after_idle(self.load_history)
+
+    def load_history(self):
+        """从任务记录中读取下一页历史记录，插入到本次运行新增的下载之前"""
+        if not self.history_more:
+            return
+        rows = self.job_store.history(self.history_offset, self.history_page)
+        self.history_offset += len(rows)
+        self.history_more = len(rows) == self.history_page
+        for row in rows:
+            if row['job_id'] in self.download_items:
+                continue  # 本次运行中已经显示的任务
+            title = f"合集：{row['title']}" if row['kind'] == 'collection' else row['title']
+            if row['status'] in (COMPLETED, SKIPPED):
+                progress = "100%"
+            elif row['total']:
+                progress = f"{row['downloaded'] / row['total'] * 100:.1f}%"
+            else:
+                progress = "0%"
+            values = [title, progress, STATUS_TEXT.get(row['status'], row['status']), row['path'] or ""]
+            item_id = self.download_list.insert("", self.history_rows, values=values)
+            self.history_rows += 1
+            self.download_items[row['job_id']] = item_id
+            self.item_values[row['job_id']] = values
+
+    def resume_unfinished(self):
+        """继续上次运行中断的下载：合集中已完成的分P按清单跳过，未完成的文件从.part断点续传"""
+        jobs = self.downloader.unfinished_jobs()
+        if not jobs:
+            return
+        
+        def resume():
+            self.post('status', f"正在继续上次未完成的{len(jobs)}个下载...")
+            for job in jobs:
+                try:
+                    if job['kind'] == 'collection':
+                        info = self.downloader.get_collection_info(job['bvid'])
+                        self.download_whole_collection(job['bvid'], info, job['path'])
+                    else:
+                        self.download_one(job['bvid'], job['cid'], job['title'])
+                except Exception as e:
+                    print(f"继续下载失败: {job['title']} - {str(e)}")
+                    self.record(job['job_id'], job['title'], "失败")
+            self.post('status', "上次未完成的下载已处理完毕")
+        
+        threading.Thread(target=resume, daemon=True).start()
 
-    def add_download_record(self, title, status="等待中", save_path="", progress="0%"):
+    def add_download_record(self, job_id, title, status="等待中", save_path="", progress="0%"):
         """添加或更新下载记录"""
-        if title in self.download_items:
-            item_id = self.download_items[title]
-            current_values = list(self.download_list.item(item_id)['values'])
+        if job_id in self.download_items:
+            item_id = self.download_items[job_id]
+            values = self.item_values[job_id]
             # 只更新需要更新的值
             if progress != "0%":
-                current_values[1] = progress
+                values[1] = progress
             if status != "等待中":
-                current_values[2] = status
+                values[2] = status
             if save_path != "":
-                current_values[3] = save_path
-            self.download_list.item(item_id, values=current_values)
+                values[3] = save_path
+            self.download_list.item(item_id, values=values)
         else:
-            item_id = self.download_list.insert("", "end", values=(title, progress, status, save_path))
-            self.download_items[title] = item_id
-        self.download_list.see(item_id)
+            values = [title, progress, status, save_path]
+            item_id = self.download_list.insert("", "end", values=values)
+            self.download_items[job_id] = item_id
+            self.item_values[job_id] = values
+            self.download_list.see(item_id)
 
-    def download_callback(self, type, data):
-        """下载回调函数"""
-        if type == 'progress':
-            self.update_progress(data)
-            # 更新当前下载项的进度
-            if hasattr(self, 'current_download_title'):
-                if 'retry_count' in data and data['retry_count'] > 0:
-                    self.update_status(f"第{data['retry_count']}次重试下载中...")
-                self.update_download_progress(self.current_download_title, data)
-        elif type == 'retry':
-            # 显示重试信息
-            self.update_status(f"下载失败，正在进行第{data['retry_count']}次重试...")
-            self.add_download_record(
-                data['title'],
-                f"重试 ({data['retry_count']}/3)",
-                "",
-                "0%"
-            )
-        elif type == 'status':
-            self.update_status(data)
-        elif type == 'new_video':
-            # 添加新的视频下载记录
-            self.current_download_title = data['title']
-            self.add_download_record(
-                data['title'],
-                data['status'],
-                data['path']
-            )
-        elif type == 'video_complete':
-            # 更新视频下载完成状态
-            self.add_download_record(
-                data['title'],
-                data['status'],
-                data['path'],
-                data['progress']
-            )
-        elif type == 'video_failed':
-            # 更新视频下载失败状态
-            self.add_download_record(
-                data['title'],
-                "失败",
-                "N/A",
-                "0%"
-            )
+    def record(self, job_id, title, status="等待中", save_path="", progress="0%"):
+        """下载线程调用：添加或更新下载记录"""
+        self.post('record', {
+            'job_id': job_id, 'title': title, 'status': status,
+            'save_path': save_path, 'progress': progress
+        })
+
+    def collection_callback(self, video_id, pages):
+        """合集下载的回调：把page_id换成任务ID后放入事件队列
+
+        ugc_season合集的分P属于各自的视频，任务ID使用分P自己的bvid，与任务记录中的ID一致。
+        """
+        bvids = {page['cid']: page.get('bvid', video_id) for page in pages}
+
+        def callback(type, data):
+            job_id = self.job_id(bvids.get(data['page_id'], video_id), data['page_id']) if 'page_id' in data else None
+            if type == 'progress':
+                self.post('progress', dict(data, job_id=job_id))
+            elif type == 'retry':
+                self.post('status', f"下载失败，正在进行第{data['retry_count']}次重试...")
+                self.record(job_id, data['title'], f"重试 ({data['retry_count']}/{data['max_retries']})")
+            elif type == 'status':
+                self.post('status', data)
+            elif type == 'new_video':
+                self.record(job_id, data['title'], data['status'], data['path'])
+            elif type == 'video_complete':
+                self.record(job_id, data['title'], data['status'], data['path'], data['progress'])
+            elif type == 'video_failed':
+                self.record(job_id, data['title'], "失败", "N/A", "0%")
+            elif type == 'preflight':
+                self.post('status', f"合集共{data['total_size']:.1f}MB，还需要{data['needed_size']:.1f}MB磁盘空间")
+            elif type == 'collection_progress':
+                eta = f"，剩余 {format_eta(data['eta'])}" if data['eta'] is not None else ""
+                self.record(self.job_id(video_id, 'collection'), "", f"下载中{eta}", "",
+                            f"{data['progress']:.1f}%")
+        return callback
+
+    def progress_callback(self, job_id):
+        """单个视频下载的进度回调"""
+        return lambda data: self.post('progress', dict(data, job_id=job_id))
 
     def start_download(self):
         url = self.url_entry.get()
@@ -238,10 +337,11 @@ class VideoDownloaderUI:
         download_thread.start()
         
     def download_video(self, url):
-        """实际的下载处理函数"""
+        """实际的下载处理函数（在下载线程中运行，界面更新都通过事件队列）"""
+        current_job = None  # 出错时需要标记为失败的(任务ID, 标题)
         try:
-            self.update_status("正在获取视频信息...")
-            self.download_btn["state"] = "disabled"
+            self.post('status', "正在获取视频信息...")
+            self.post('button', "disabled")
             
             # 确保下载目录存在
             if not os.path.exists('downloads'):
@@ -249,24 +349,28 @@ class VideoDownloaderUI:
             
             # 获取视频信息
             result = self.downloader.download_video(url)
+            video_id = self.downloader.extract_video_id(url)
             
             if result['is_collection']:
                 collection_info = result['info']
                 total_videos = len(collection_info['pages'])
-                collection_title = self.clean_filename(collection_info['title'])
+                collection_title = clean_name(collection_info['title'], '未命名合集')
+                collection_job = self.job_id(video_id, 'collection')
                 
-                # 创建合集目录
-                folder_path = os.path.join('downloads', collection_title)
+                # 创建合集目录（与下载器使用同一个目录名）
+                folder_path = self.downloader.folder_for(video_id, collection_info['title'])
                 if not os.path.exists(folder_path):
                     os.makedirs(folder_path)
                 
-                self.add_download_record(
+                self.record(
+                    collection_job,
                     f"合集：{collection_title}",
                     "下载中",
                     folder_path
                 )
                 
-                answer = messagebox.askyesno(
+                answer = self.call_in_main(
+                    messagebox.askyesno,
                     "发现合集",
                     f"该视频属于合集《{collection_title}》\n"
                     f"共有 {total_videos} 个视频\n"
@@ -274,116 +378,106 @@ class VideoDownloaderUI:
                 )
                 
                 if answer:
-                    video_id = self.downloader.extract_video_id(url)
-                    # 清理每个视频的文件名
-                    for page in collection_info['pages']:
-                        page['part'] = self.clean_filename(page['part'])
-                    result = self.downloader.download_collection(
-                        video_id,
-                        collection_info,
-                        self.download_callback
-                    )
-                    
-                    # 更新合集下载状态
-                    status = "完成"
-                    if result['failed']:
-                        status = f"部分完成 (失败: {len(result['failed'])}个)"
-                    self.add_download_record(
-                        f"合集：{collection_title}",
-                        status,
-                        folder_path,
-                        "100%"
-                    )
+                    self.download_whole_collection(video_id, collection_info, folder_path)
                 else:
                     # 删除合集记录，只下载单个视频
-                    self.download_list.delete(self.download_items[f"合集：{collection_title}"])
-                    del self.download_items[f"合集：{collection_title}"]
-                    
-                    video_info = collection_info['pages'][0]
-                    clean_title = self.clean_filename(video_info['part'])
-                    save_path = os.path.join('downloads', f"{clean_title}.mp4")
-                    self.current_download_title = clean_title
-                    
-                    # 添加单个视频记录
-                    self.add_download_record(
-                        clean_title,  # 使用清理后的标题
-                        "下载中",
-                        save_path
-                    )
-                    
-                    self.downloader.download_single_video(
-                        self.downloader.extract_video_id(url),
-                        video_info['cid'],
-                        clean_title,  # 使用清理后的标题
-                        'downloads',
-                        lambda p: self.download_callback('progress', p)
-                    )
-                    
-                    # 更新状态为完成
-                    self.add_download_record(
-                        clean_title,  # 使用清理后的标题
-                        "完成",
-                        save_path,
-                        "100%"
-                    )
+                    self.post('remove', collection_job)
+                    if 'season_id' in collection_info:
+                        # ugc_season合集：下载输入的这个视频本身，不是合集的第一集
+                        video_info = self.downloader.get_video_info(video_id)['data']
+                        current_job = self.download_one(video_id, video_info['cid'], video_info['title'])
+                    else:
+                        video_info = collection_info['pages'][0]
+                        current_job = self.download_one(video_id, video_info['cid'], video_info['part'])
             else:
-                video_id = self.downloader.extract_video_id(url)
                 video_info = self.downloader.get_video_info(video_id)['data']
-                clean_title = self.clean_filename(video_info['title'])
-                save_path = os.path.join('downloads', f"{clean_title}.mp4")
-                self.current_download_title = clean_title
-                
-                # 添加下载记录
-                self.add_download_record(
-                    clean_title,  # 使用清理后的标题
-                    "下载中",
-                    save_path
-                )
-                
-                self.downloader.download_single_video(
-                    video_id,
-                    video_info['cid'],
-                    clean_title,  # 使用清理后的标题
-                    'downloads',
-                    lambda p: self.download_callback('progress', p)
-                )
-                
-                # 更新状态为完成
-                self.add_download_record(
-                    clean_title,  # 使用清理后的标题
-                    "完成",
-                    save_path,
-                    "100%"
-                )
+                current_job = self.download_one(video_id, video_info['cid'], video_info['title'])
             
-            self.update_status("下载完成！")
-            messagebox.showinfo("完成", "视频下载完成！")
+            self.post('status', "下载完成！")
+            self.post('call', lambda: messagebox.showinfo("完成", "视频下载完成！"))
             
             if self.shutdown_var.get():
                 os.system("shutdown /s /t 60")
-                messagebox.showwarning("自动关机", "系统将在60秒后关机，取消请运行 'shutdown /a'")
+                self.post('call', lambda: messagebox.showwarning(
+                    "自动关机", "系统将在60秒后关机，取消请运行 'shutdown /a'"))
         
         except ValueError as e:
-            self.handle_error(str(e), url)
+            self.handle_error(str(e), (url, url))
         except Exception as e:
-            self.handle_error(f"下载失败: {str(e)}", 
-                             self.current_download_title if hasattr(self, 'current_download_title') else None)
+            self.handle_error(f"下载失败: {str(e)}", getattr(e, 'job', current_job))
         finally:
-            self.download_btn["state"] = "normal"
-            self.progress_bar["value"] = 0
+            self.post('button', "normal")
+            self.post('reset_bar')
+
+    def download_whole_collection(self, video_id, collection_info, folder_path):
+        """下载整个合集并更新合集的下载记录（在下载线程中运行）"""
+        collection_title = clean_name(collection_info['title'], '未命名合集')
+        collection_job = self.job_id(video_id, 'collection')
+        self.record(collection_job, f"合集：{collection_title}", "下载中", folder_path)
+        
+        # 分P的文件名由下载器按模板生成
+        result = self.downloader.download_collection(
+            video_id,
+            collection_info,
+            self.collection_callback(video_id, collection_info['pages'])
+        )
+        
+        # 更新合集下载状态
+        status = "完成"
+        if result['failed']:
+            status = f"部分完成 (失败: {len(result['failed'])}个)"
+        self.record(
+            collection_job,
+            f"合集：{collection_title}",
+            status,
+            folder_path,
+            "100%"
+        )
+
+    def download_one(self, video_id, cid, title):
+        """下载单个视频并更新下载列表，返回(任务ID, 标题)"""
+        # 与downloads中其他视频重名时文件名自动追加序号
+        save_path = self.downloader.video_path(video_id, cid, title)
+        clean_title = os.path.splitext(os.path.basename(save_path))[0]
+        job = (self.job_id(video_id, cid), clean_title)
+        
+        # 已下载且校验通过的视频不再重复下载
+        existing = self.downloader.find_downloaded(cid, 'downloads')
+        if existing:
+            self.record(job[0], clean_title, "已下载", existing, "100%")
+            return job
+        
+        # 添加下载记录
+        self.record(job[0], clean_title, "下载中", save_path)
+        try:
+            save_path = self.downloader.download_single_video(
+                video_id,
+                cid,
+                clean_title,  # 使用清理后的标题
+                'downloads',
+                self.progress_callback(job[0]),
+                priority=PRIORITY_INTERACTIVE  # 单独下载的视频优先于后台的合集下载
+            )
+        except Exception as e:
+            e.job = job  # 交给download_video把这条记录标记为失败
+            raise
+        
+        # 更新状态为完成
+        self.record(job[0], clean_title, "完成", save_path, "100%")
+        return job
 
-    def handle_error(self, error_msg, title=None):
-        """统一处理错误"""
+    def handle_error(self, error_msg, job=None):
+        """统一处理错误（可在下载线程中调用）"""
         # 提取更有用的错误信息
         if "创建目录失败" in error_msg:
             error_msg = f"无法创建下载目录，请检查:\n1. 文件夹名称是否包含特殊字符\n2. 是否有写入权限\n3. 路径是否过长\n\n详细错误: {error_msg}"
         elif "文件名或目录名太长" in error_msg:
             error_msg = "文件名或路径过长，请尝试使用更短的文件名"
         
-        messagebox.showerror("错误", error_msg)
-        if title:
-            self.add_download_record(title, "失败", "N/A", "0%")
-        self.update_status(f"错误: {error_msg}")
+        self.post('call', lambda: messagebox.showerror("错误", error_msg))
+        if job:
+            self.record(job[0], job[1], "失败", "N/A", "0%")
+        self.post('status', f"错误: {error_msg}")
 
 if __name__ == "__main__":
     root = ttk.Window(themename="darkly")
@@ -0,0 +1,131 @@
+import heapq
+import json
+import os
+import random
+import re
+import threading
+import time
+from manifest import file_lock
+
+SYNC_STATE_PATH = os.path.join('downloads', '.sync.json')
+
+
+def parse_interval(value):
+    """'90'、'30m'、'2h'、'1d' -> 秒"""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*', str(value).lower())
+    if not match:
+        raise ValueError(f"无法解析的时间间隔: {value}")
+    return float(match.group(1)) * {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+
+
+def diff_pages(pages, manifest, previous=None):
+    """按cid比较当前的分P列表和目录清单，只比较文件大小，不读取文件内容
+
+    返回{'new': 没有下载过的分P, 'changed': 下载过但文件缺失或大小不符的分P,
+         'unchanged': 已下载的分P, 'removed': 上次同步时有、现在已经不在列表中的cid}
+    """
+    diff = {'new': [], 'changed': [], 'unchanged': [], 'removed': []}
+    for page in pages:
+        if manifest.get(page['cid']) is None:
+            diff['new'].append(page)
+        elif manifest.present(page['cid']) is None:
+            diff['changed'].append(page)
+        else:
+            diff['unchanged'].append(page)
+    if previous:
+        current = {page['cid'] for page in pages}
+        diff['removed'] = [cid for cid in previous if cid not in current]
+    return diff
+
+
+class SyncState:
+    """增量同步的记录：BV号 -> {'folder', 'title', 'cids', 'collection', 'synced'}
+
+    合集第一次同步时记下下载目录，之后标题改变（例如"更新至第N集"）仍然同步到原来的目录；
+    单个视频的目录只用于找到已下载的文件，不固定：视频之后增加了分P时按合集标题新建目录；
+    cids用于发现被删除的分P。多个进程同时写时在文件锁内重新读取后合并。
+    """
+    def __init__(self, path=SYNC_STATE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = None  # 第一次使用时读取
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, bvid):
+        with self.lock:
+            if self.entries is None:
+                self.entries = self.load()
+            return self.entries.get(bvid)
+
+    def folder(self, bvid):
+        """上次同步时合集的下载目录，没有同步过或上次还是单个视频时返回None"""
+        entry = self.get(bvid)
+        return entry['folder'] if entry and entry.get('collection', True) else None
+
+    def record(self, bvid, folder, title, cids, collection=True):
+        entry = {'folder': folder, 'title': title, 'cids': list(cids), 'collection': collection,
+                 'synced': time.time()}
+        with self.lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with file_lock(self.path + '.lock'):
+                self.entries = self.load()
+                self.entries[bvid] = entry
+                tmp_path = self.path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.entries, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+
+
+class WatchSchedule:
+    """跟踪列表的轮询计划：每个视频大约每interval秒检查一次
+
+    每次检查后的下一次时间加上±jitter比例的随机抖动，第一次检查分散在开始后的jitter*interval秒内，
+    几百个视频的请求不会集中在同一时刻发出，也不会每个周期都按相同的顺序撞在一起。
+    """
+    def __init__(self, keys, interval, jitter=0.1, rng=None):
+        self.interval = interval
+        self.jitter = min(max(jitter, 0.0), 1.0)
+        self.random = rng or random.Random()
+        now = time.time()
+        self.heap = [(now + self.random.uniform(0, self.interval * self.jitter), key) for key in dict.fromkeys(keys)]
+        heapq.heapify(self.heap)
+
+    def __len__(self):
+        return len(self.heap)
+
+    def next_time(self):
+        return self.heap[0][0] if self.heap else None
+
+    def due(self, now=None):
+        """取出所有已经到时间的视频"""
+        now = time.time() if now is None else now
+        keys = []
+        while self.heap and self.heap[0][0] <= now:
+            keys.append(heapq.heappop(self.heap)[1])
+        return keys
+
+    def reschedule(self, keys, now=None):
+        """检查完成后安排下一次检查"""
+        now = time.time() if now is None else now
+        for key in keys:
+            delay = self.interval * self.random.uniform(1 - self.jitter, 1 + self.jitter)
+            heapq.heappush(self.heap, (now + delay, key))
+
+    def wait(self, stop=None):
+        """等到至少一个视频到时间后返回这些视频；stop（threading.Event）被设置时返回空列表"""
+        stop = stop or threading.Event()
+        while self.heap and not stop.is_set():
+            keys = self.due()
+            if keys:
+                return keys
+            stop.wait(max(0.0, self.next_time() - time.time()))
+        return []
@@ -0,0 +1,235 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+QUEUED = 'queued'
+LEASED = 'leased'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,       -- "bvid:cid"
+    bvid TEXT NOT NULL,
+    cid INTEGER NOT NULL,
+    title TEXT,
+    path TEXT NOT NULL,             -- 视频文件路径
+    status TEXT NOT NULL,
+    worker TEXT,                    -- 持有租约的工作进程
+    lease_until REAL,               -- 租约到期时间，到期未续约的任务会被重新分配
+    attempts INTEGER DEFAULT 0,
+    error TEXT,
+    seq INTEGER,                    -- 加入队列的顺序，按它租用任务
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS tasks_order ON tasks (status, seq);
+"""
+
+
+def worker_name():
+    """工作进程的标识：主机名:进程号，多台机器共用队列时也不会重复"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkQueue:
+    """多个下载进程共用的任务队列，保存在SQLite文件中
+
+    工作进程租用任务并定期续约；进程崩溃或卡住时租约到期，任务自动交给其他进程。
+    数据库使用默认的回滚日志而不是WAL，放在多台机器共享的文件系统上也可以使用。
+    每个进程各自打开一个WorkQueue，进程内的下载线程和续约线程共用一个连接，由锁串行化。
+    """
+    def __init__(self, path, lease_seconds=60, max_attempts=3):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # 自动提交模式，事务由BEGIN IMMEDIATE显式开始；其他进程持有写锁时最多等待30秒
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.executescript(SCHEMA)
+            columns = {row['name'] for row in self.conn.execute("PRAGMA table_info(tasks)")}
+            if 'seq' not in columns:
+                # 旧版本创建的队列文件没有seq列，其中的任务排在新任务之前
+                self.conn.execute("ALTER TABLE tasks ADD COLUMN seq INTEGER")
+            self.conn.executescript(INDEXES)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def transaction(self):
+        """立即取得写锁的事务，保证租用任务时不会有两个进程拿到同一个任务"""
+        return Transaction(self.conn, self.lock)
+
+    def enqueue(self, task):
+        """加入一个分P任务{'bvid', 'cid', 'title', 'path'}，返回是否加入"""
+        return self.enqueue_many([task])[0]
+
+    def enqueue_many(self, tasks):
+        """在一个事务中按顺序加入多个分P任务，返回每个任务是否加入
+
+        等待中或正在下载的任务不重复加入；已结束的任务重新排队，完成的文件由工作进程按清单跳过。
+        同一批任务按加入的顺序租用（预检排好的合集下载顺序），不会与其他线程加入的任务交错。
+        """
+        now = time.time()
+        added = []
+        with self.transaction():
+            seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM tasks").fetchone()[0]
+            for task in tasks:
+                cursor = self.conn.execute(
+                    """INSERT INTO tasks (task_id, bvid, cid, title, path, status, seq, created, updated)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                       ON CONFLICT(task_id) DO UPDATE SET
+                           status = excluded.status, worker = NULL, attempts = 0, error = NULL,
+                           seq = excluded.seq, updated = excluded.updated
+                       WHERE status IN (?, ?)""",
+                    (f"{task['bvid']}:{task['cid']}", task['bvid'], task['cid'], task['title'],
+                     task['path'], QUEUED, seq, now, now, COMPLETED, FAILED)
+                )
+                seq += 1
+                added.append(cursor.rowcount > 0)
+        return added
+
+    def lease(self, worker):
+        """租用一个等待中或租约已过期的任务，没有可租用的任务时返回None"""
+        now = time.time()
+        with self.transaction():
+            # 租约多次过期（每次都让工作进程崩溃或卡住）的任务不再分配
+            self.conn.execute(
+                """UPDATE tasks SET status = ?, error = '工作进程的租约过期', updated = ?
+                   WHERE status = ? AND lease_until < ? AND attempts >= ?""",
+                (FAILED, now, LEASED, now, self.max_attempts)
+            )
+            row = self.conn.execute(
+                """SELECT * FROM tasks
+                   WHERE status = ? OR (status = ? AND lease_until < ?)
+                   ORDER BY seq, created LIMIT 1""",
+                (QUEUED, LEASED, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                """UPDATE tasks SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1,
+                       updated = ? WHERE task_id = ?""",
+                (LEASED, worker, now + self.lease_seconds, now, row['task_id'])
+            )
+            task = dict(row)
+            task['attempts'] += 1
+            return task
+
+    def heartbeat(self, task_id, worker):
+        """续约，返回False表示租约已经过期并被其他进程取走"""
+        now = time.time()
+        with self.transaction():
+            cursor = self.conn.execute(
+                """UPDATE tasks SET lease_until = ?, updated = ?
+                   WHERE task_id = ? AND worker = ? AND status = ?""",
+                (now + self.lease_seconds, now, task_id, worker, LEASED)
+            )
+            return cursor.rowcount > 0
+
+    def complete(self, task_id, worker, path=None):
+        now = time.time()
+        with self.transaction():
+            self.conn.execute(
+                """UPDATE tasks SET status = ?, path = COALESCE(?, path), error = NULL,
+                       lease_until = NULL, updated = ? WHERE task_id = ? AND worker = ?""",
+                (COMPLETED, path, now, task_id, worker)
+            )
+
+    def fail(self, task_id, worker, error):
+        """任务失败：还有尝试次数时放回队列，否则标记为失败"""
+        now = time.time()
+        with self.transaction():
+            self.conn.execute(
+                """UPDATE tasks SET status = CASE WHEN attempts < ? THEN ? ELSE ? END,
+                       error = ?, lease_until = NULL, updated = ?
+                   WHERE task_id = ? AND worker = ?""",
+                (self.max_attempts, QUEUED, FAILED, error, now, task_id, worker)
+            )
+
+    def release_worker(self, worker):
+        """工作进程异常退出时调用：立即把它持有的任务放回队列，不必等租约到期"""
+        with self.transaction():
+            self.conn.execute(
+                "UPDATE tasks SET status = ?, lease_until = NULL, updated = ? WHERE worker = ? AND status = ?",
+                (QUEUED, time.time(), worker, LEASED)
+            )
+
+    def stats(self):
+        """各状态的任务数"""
+        with self.lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+        counts = {QUEUED: 0, LEASED: 0, COMPLETED: 0, FAILED: 0}
+        counts.update({status: count for status, count in rows})
+        return counts
+
+    def active(self):
+        """是否还有等待中或正在下载的任务"""
+        counts = self.stats()
+        return counts[QUEUED] + counts[LEASED] > 0
+
+
+class Transaction:
+    def __init__(self, conn, lock):
+        self.conn = conn
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            self.conn.execute('BEGIN IMMEDIATE')
+        except Exception:
+            self.lock.release()
+            raise
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self.lock.release()
+
+
+class Heartbeat:
+    """下载任务期间在后台定期续约，间隔为租约时长的三分之一
+
+    续约失败（租约已过期并被其他进程取走）时lost变为True，下载本身不中断，
+    之后的complete/fail因为worker不匹配而不会覆盖新租户的记录。
+    """
+    def __init__(self, work_queue, task_id, worker):
+        self.work_queue = work_queue
+        self.task_id = task_id
+        self.worker = worker
+        self.lost = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        interval = self.work_queue.lease_seconds / 3
+        while not self.stopped.wait(interval):
+            try:
+                if not self.work_queue.heartbeat(self.task_id, self.worker):
+                    self.lost = True
+                    print(f"任务 {self.task_id} 的租约已被其他工作进程取走")
+                    return
+            except sqlite3.Error as e:  # 共享文件系统暂时不可用时下次再试，租约还有余量
+                print(f"任务 {self.task_id} 续约失败: {e}")